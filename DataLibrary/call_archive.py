@@ -0,0 +1,207 @@
+import json
+import os
+import struct
+import uuid
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from Utils.logger_config import basic_logger
+
+logger = basic_logger("CallArchive")
+
+'''
+Author: Sean Baker
+Date: 2024-09-24
+Description: Cold storage of finished calls in date partitioned, compressed column files
+'''
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./DataLibrary/archive")
+
+MAGIC = b"GPCOL1\n"
+# Footer length, written after the footer so a reader finds it from the end of the file
+FOOTER_SIZE = struct.Struct("<Q")
+
+# Column types: "int" and "float" are packed machine arrays (None becomes NaN for floats), "str" is a JSON list
+TURN_COLUMNS = (("call_sid", "str"), ("seq", "int"), ("role", "str"), ("name", "str"), ("content", "str"),
+                ("created_at", "str"), ("latency_ms", "float"), ("tokens", "int"))
+CALL_COLUMNS = (("call_sid", "str"), ("from_number", "str"), ("to_number", "str"), ("start_time", "str"),
+                ("end_time", "str"), ("final_status", "str"), ("system_message", "str"), ("initial_message", "str"),
+                ("duration_s", "float"), ("turn_count", "int"), ("latency_ms_avg", "float"),
+                ("latency_ms_max", "float"), ("tokens", "int"))
+
+
+def _encode(values: Sequence, kind: str) -> bytes:
+    if kind == "int":
+        return array("q", values).tobytes()
+    if kind == "float":
+        return array("d", (float("nan") if value is None else value for value in values)).tobytes()
+    return json.dumps(list(values), separators=(",", ":")).encode()
+
+
+def _decode(data: bytes, kind: str) -> list:
+    if kind == "int":
+        return array("q", data).tolist()
+    if kind == "float":
+        return [None if value != value else value for value in array("d", data)]
+    return json.loads(data)
+
+
+def write_columns(path: str, columns: Sequence[Tuple[str, str]], rows: List[dict], level: int = 6) -> int:
+    """
+    Write rows to a column file.
+
+    Each column is compressed on its own, so a reader decompresses only the
+    columns it asks for and similar values compress together. The file is
+    written next to ``path`` and renamed into place, a reader never sees
+    half of it.
+
+    Args:
+        path (str): The file to create.
+        columns (Sequence[Tuple[str, str]]): Column names and types.
+        rows (List[dict]): The rows, missing keys are stored as None.
+        level (int): zlib compression level.
+
+    Returns:
+        int: Size of the file in bytes.
+    """
+    footer = {"rows": len(rows), "columns": []}
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(MAGIC)
+        offset = len(MAGIC)
+        for name, kind in columns:
+            raw = _encode([row.get(name) for row in rows], kind)
+            block = zlib.compress(raw, level)
+            file.write(block)
+            footer["columns"].append({"name": name, "type": kind, "offset": offset, "length": len(block),
+                                      "raw_length": len(raw)})
+            offset += len(block)
+        data = json.dumps(footer).encode()
+        file.write(data)
+        file.write(FOOTER_SIZE.pack(len(data)))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    return offset + len(data) + FOOTER_SIZE.size
+
+
+def read_columns(path: str, names: Optional[Sequence[str]] = None) -> Dict[str, list]:
+    """
+    Read columns of a column file.
+
+    Args:
+        path (str): The file.
+        names (Optional[Sequence[str]]): Columns to read, all of them if None.
+
+    Returns:
+        Dict[str, list]: Column name to its values, in row order.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a column file")
+        file.seek(-FOOTER_SIZE.size, os.SEEK_END)
+        (length,) = FOOTER_SIZE.unpack(file.read(FOOTER_SIZE.size))
+        file.seek(-FOOTER_SIZE.size - length, os.SEEK_END)
+        footer = json.loads(file.read(length))
+        columns = {}
+        for column in footer["columns"]:
+            if names is not None and column["name"] not in names:
+                continue
+            file.seek(column["offset"])
+            columns[column["name"]] = _decode(zlib.decompress(file.read(column["length"])), column["type"])
+    return columns
+
+
+def _rows(columns: Dict[str, list], start: int = 0, stop: Optional[int] = None) -> List[dict]:
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*(columns[name][start:stop] for name in names))]
+
+
+class CallArchive:
+    """
+    Finished calls moved out of the live database, one directory per call date.
+
+    An archive run writes a ``calls`` file (one row per call: numbers, times,
+    status, duration, latency and token totals) and a ``turns`` file (every
+    transcript turn, ordered by call and seq) into
+    ``<root>/date=YYYY-MM-DD/``. The turns of one call are a contiguous row
+    range, ``write`` returns where each call's range starts so a call can be
+    read back from its file alone. Directories follow the ``key=value``
+    partition layout bulk query tools understand.
+
+    Args:
+        root (str): Directory of the archive.
+    """
+
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+
+    def partition(self, day: str) -> str:
+        return os.path.join(self.root, f"date={day}")
+
+    def write(self, day: str, calls: List[dict], turns: List[dict]) -> Dict[str, Tuple[str, int, int]]:
+        """
+        Write one archive run of a day's calls.
+
+        Args:
+            day (str): The calls' date, ``YYYY-MM-DD``.
+            calls (List[dict]): One summary row per call, see ``CALL_COLUMNS``.
+            turns (List[dict]): The calls' turns, see ``TURN_COLUMNS``.
+
+        Returns:
+            Dict[str, Tuple[str, int, int]]: call_sid to the turns file, the call's first row and its turn count.
+        """
+        directory = self.partition(day)
+        os.makedirs(directory, exist_ok=True)
+        part = uuid.uuid4().hex[:12]
+        turns = sorted(turns, key=lambda turn: (turn["call_sid"], turn["seq"]))
+        turns_path = os.path.join(directory, f"turns-{part}.gpc")
+        size = write_columns(turns_path, TURN_COLUMNS, turns)
+        size += write_columns(os.path.join(directory, f"calls-{part}.gpc"), CALL_COLUMNS, calls)
+
+        ranges: Dict[str, Tuple[str, int, int]] = {call["call_sid"]: (turns_path, 0, 0) for call in calls}
+        for row, turn in enumerate(turns):
+            _, start, count = ranges[turn["call_sid"]]
+            ranges[turn["call_sid"]] = (turns_path, row if count == 0 else start, count + 1)
+        logger.info(f"Archived {len(calls)} calls and {len(turns)} turns of {day}, {size} bytes")
+        return ranges
+
+    @staticmethod
+    def discard(turns_path: str):
+        """Remove the files of one ``write``, given its turns file, when the run is not recorded after all."""
+        directory, name = os.path.split(turns_path)
+        for path in (turns_path, os.path.join(directory, "calls-" + name[len("turns-"):])):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def read_turns(path: str, start: int, count: int) -> List[dict]:
+        """The turns of one call, as stored by ``write``."""
+        if count == 0:
+            return []
+        return _rows(read_columns(path), start, start + count)
+
+    def scan(self, table: str = "turns", since: Optional[str] = None, until: Optional[str] = None,
+             columns: Optional[Sequence[str]] = None) -> Iterator[Dict[str, list]]:
+        """
+        Read archived data in bulk, a file at a time.
+
+        Args:
+            table (str): ``turns`` or ``calls``.
+            since (Optional[str]): First day, ``YYYY-MM-DD``, inclusive.
+            until (Optional[str]): Last day, exclusive.
+            columns (Optional[Sequence[str]]): Columns to read, all of them if None.
+
+        Yields:
+            Dict[str, list]: The columns of one file.
+        """
+        if not os.path.isdir(self.root):
+            return
+        for directory in sorted(os.listdir(self.root)):
+            day = directory.partition("=")[2]
+            if not day or (since and day < since) or (until and day >= until):
+                continue
+            for name in sorted(os.listdir(os.path.join(self.root, directory))):
+                if name.startswith(f"{table}-") and name.endswith(".gpc"):
+                    yield read_columns(os.path.join(self.root, directory, name), columns)
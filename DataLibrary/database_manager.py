@@ -1,206 +1,1124 @@
-import os
-from typing import List, Optional
-from datetime import datetime
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy import Column, String, Boolean, Text, DateTime, Integer, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+import asyncio
 import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, Text, bindparam, delete,
+                        event, func, inspect, select, text)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, relationship
+
+from DataLibrary.call_archive import CallArchive
+from EventHandlers import EventHandler
+from Utils.logger_config import basic_logger
+
+logger = basic_logger("DatabaseManager")
+
+'''
+Author: Sean Baker
+Date: 2024-09-23
+Description: Async persistence of contacts, call contexts and transcript turns, with write-behind batching of call updates
+'''
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./DataLibrary/call_contexts.db")
+
+# Applied to every new SQLite connection: readers no longer wait for the writer, and commits skip the full fsync
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Full-text index over transcript_turns.content, kept in step with the table by triggers (SQLite only)
+SEARCH_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS transcript_search USING fts5("
+    "content, content='transcript_turns', content_rowid='turn_id', tokenize='porter unicode61', prefix='2 3 4')",
+    "CREATE TRIGGER IF NOT EXISTS transcript_turns_ai AFTER INSERT ON transcript_turns BEGIN "
+    "INSERT INTO transcript_search(rowid, content) VALUES (new.turn_id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS transcript_turns_ad AFTER DELETE ON transcript_turns BEGIN "
+    "INSERT INTO transcript_search(transcript_search, rowid, content) VALUES ('delete', old.turn_id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS transcript_turns_au AFTER UPDATE OF content ON transcript_turns BEGIN "
+    "INSERT INTO transcript_search(transcript_search, rowid, content) VALUES ('delete', old.turn_id, old.content); "
+    "INSERT INTO transcript_search(rowid, content) VALUES (new.turn_id, new.content); END",
+)
+
+# Finished calls stay in the live tables this long before they are moved to the archive
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", 30))
+# An archive run's claim on its calls lapses after this long, calls of a run that died are archived by a later one
+ARCHIVE_CLAIM_TIMEOUT = float(os.getenv("ARCHIVE_CLAIM_TIMEOUT", 600))
+# SQLite is only vacuumed once this share of its pages is free, rebuilding the file for less is not worth the writes
+VACUUM_FREE_FRACTION = float(os.getenv("VACUUM_FREE_FRACTION", 0.25))
+
+# Queued in place of a call context to delete the call
+DELETE = object()
+
+Base = declarative_base()
+
+
+class SearchUnavailableError(Exception):
+    """Raised when transcript search is asked of a database without the full-text index."""
+
+
+class ContactModel(Base):
+    __tablename__ = "contacts"
+
+    contact_id = Column(Integer, primary_key=True, index=True)
+    phone_number = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    name = Column(String)
+    # JSON object, e.g. {"language": "es", "callback_window": "mornings"}
+    preferences = Column(Text)
+    updated_at = Column(DateTime)
+
+    # Relationship to Calls
+    calls = relationship("CallContextModel", back_populates="contact")
+
+
+class CallContextModel(Base):
+    __tablename__ = "call_contexts"
+
+    call_sid = Column(String, primary_key=True, index=True)
+    stream_sid = Column(String, index=True)
+    call_ended = Column(Boolean, default=False)
+    user_context = Column(Text)
+    system_message = Column(String)
+    initial_message = Column(String)
+    start_time = Column(DateTime, default=datetime.utcnow)
+    end_time = Column(DateTime)
+    final_status = Column(String)
+    to_number = Column(String, nullable=False, index=True)
+    from_number = Column(String, nullable=False, index=True)
+    # The archive run moving the call, so that one process archives it when every worker runs the archiver
+    archive_claim = Column(String)
+    archive_claimed_at = Column(DateTime)
+
+    # Foreign key to ContactModel
+    contact_id = Column(Integer, ForeignKey('contacts.contact_id'))
+    contact = relationship("ContactModel", back_populates="calls")
+
+    # Relationship to Transcriptions
+    transcription = relationship("TranscriptionModel", back_populates="call", uselist=False)
+
+
+class TranscriptTurnModel(Base):
+    """One message of a call's conversation, appended once and never rewritten."""
+    __tablename__ = "transcript_turns"
+    __table_args__ = (Index("ix_transcript_turns_call_sid_seq", "call_sid", "seq", unique=True),)
+
+    turn_id = Column(Integer, primary_key=True)
+    call_sid = Column(String, nullable=False)
+    seq = Column(Integer, nullable=False)
+    role = Column(String, nullable=False)
+    name = Column(String)
+    content = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Milliseconds from the caller's turn to the completed reply, on assistant turns
+    latency_ms = Column(Float)
+
+    def as_dict(self) -> dict:
+        return {"seq": self.seq, "role": self.role, "name": self.name, "content": self.content,
+                "created_at": self.created_at.isoformat() if self.created_at else None,
+                "latency_ms": self.latency_ms}
+
+
+class ArchivedCallModel(Base):
+    """Where an archived call's turns are, plus the summary the archive run computed for it."""
+    __tablename__ = "archived_calls"
+
+    call_sid = Column(String, primary_key=True)
+    day = Column(String, nullable=False, index=True)
+    path = Column(String, nullable=False)
+    row_offset = Column(Integer, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    from_number = Column(String, index=True)
+    to_number = Column(String, index=True)
+    start_time = Column(DateTime)
+    end_time = Column(DateTime)
+    final_status = Column(String)
+    duration_s = Column(Float)
+    latency_ms_avg = Column(Float)
+    latency_ms_max = Column(Float)
+    tokens = Column(Integer)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    def as_dict(self) -> dict:
+        return {"call_sid": self.call_sid, "from_number": self.from_number, "to_number": self.to_number,
+                "start_time": self.start_time.isoformat() if self.start_time else None,
+                "end_time": self.end_time.isoformat() if self.end_time else None,
+                "final_status": self.final_status, "turn_count": self.row_count, "duration_s": self.duration_s,
+                "latency_ms_avg": self.latency_ms_avg, "latency_ms_max": self.latency_ms_max, "tokens": self.tokens}
+
+
+class TranscriptionModel(Base):
+    __tablename__ = "transcriptions"
+
+    transcription_id = Column(Integer, primary_key=True, index=True)
+    call_id = Column(String, ForeignKey('call_contexts.call_sid'), nullable=False)
+    transcription_text = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relationship to CallContext
+    call = relationship("CallContextModel", back_populates="transcription")
+
+
+def _parse_time(value):
+    """CallContext keeps times as ISO strings, the columns want datetimes."""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """Times are stored as naive UTC, an aware time is converted to that."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _turn_row(call_sid: str, seq: int, message, created_at: datetime, latency_ms: Optional[float] = None) -> dict:
+    if not isinstance(message, dict):
+        message = {"role": "transcript", "content": message if isinstance(message, str) else json.dumps(message)}
+    content = message.get("content")
+    return {"call_sid": call_sid, "seq": seq, "role": message.get("role") or "unknown", "name": message.get("name"),
+            "content": content if content is None or isinstance(content, str) else json.dumps(content),
+            "created_at": created_at,
+            "latency_ms": latency_ms if message.get("role") == "assistant" else None}
+
+
+def _archive_rows(context: "CallContextModel", turns: List[dict]):
+    """Turn rows and the call summary row an archive run stores for a call."""
+    rows = []
+    for turn in turns:
+        content = turn["content"] or ""
+        rows.append({"call_sid": turn["call_sid"], "seq": turn["seq"], "role": turn["role"], "name": turn["name"],
+                     "content": turn["content"],
+                     "created_at": turn["created_at"].isoformat() if turn["created_at"] else None,
+                     "latency_ms": turn["latency_ms"],
+                     # About four characters per LLM token, the estimate the interim stabilizer uses too
+                     "tokens": (len(content) + 3) // 4})
+    latencies = [row["latency_ms"] for row in rows if row["latency_ms"] is not None]
+    duration = None
+    if context.start_time and context.end_time:
+        duration = (context.end_time - context.start_time).total_seconds()
+    call = {"call_sid": context.call_sid, "from_number": context.from_number, "to_number": context.to_number,
+            "start_time": context.start_time.isoformat() if context.start_time else None,
+            "end_time": context.end_time.isoformat() if context.end_time else None,
+            "final_status": context.final_status, "system_message": context.system_message,
+            "initial_message": context.initial_message, "duration_s": duration, "turn_count": len(rows),
+            "latency_ms_avg": sum(latencies) / len(latencies) if latencies else None,
+            "latency_ms_max": max(latencies) if latencies else None,
+            "tokens": sum(row["tokens"] for row in rows)}
+    return call, rows
+
+
+def _blob_turns(call_sid: str, blob: str, created_at: Optional[datetime]) -> List[dict]:
+    """Turns of a transcript stored as one blob, a JSON message list or plain text with a line per turn."""
+    try:
+        messages = json.loads(blob)
+    except ValueError:
+        messages = [line.strip() for line in blob.splitlines() if line.strip()]
+    if not isinstance(messages, list):
+        messages = [messages]
+    return [_turn_row(call_sid, seq, message, created_at or datetime.utcnow()) for seq, message in enumerate(messages)]
 
 
-class DatabaseManager:
+def migrate_transcript_blobs(connection, chunk: int = 500) -> int:
+    """
+    Move transcripts stored as one blob per call into ``transcript_turns``.
+
+    ``call_contexts.user_context`` blobs become one row per message and are
+    cleared. ``transcriptions`` rows are exploded for calls that have no turns
+    yet and are left in place. Calls that already have turns are skipped, so
+    the migration can be run again safely.
+
+    Args:
+        connection: A synchronous SQLAlchemy connection inside a transaction.
+        chunk (int): Calls read per query.
+
+    Returns:
+        int: Turns written.
+    """
+    contexts, turns, written = CallContextModel.__table__, TranscriptTurnModel.__table__, 0
+    while True:
+        blobs = connection.execute(select(contexts.c.call_sid, contexts.c.user_context, contexts.c.start_time)
+                                   .where(contexts.c.user_context.is_not(None)).limit(chunk)).all()
+        if not blobs:
+            break
+        call_sids = [blob[0] for blob in blobs]
+        migrated = set(connection.scalars(select(turns.c.call_sid).where(turns.c.call_sid.in_(call_sids)).distinct()))
+        rows = [row for call_sid, blob, start_time in blobs if call_sid not in migrated
+                for row in _blob_turns(call_sid, blob, start_time)]
+        if rows:
+            connection.execute(turns.insert(), rows)
+        connection.execute(contexts.update().where(contexts.c.call_sid.in_(call_sids)).values(user_context=None))
+        written += len(rows)
+
+    transcriptions = TranscriptionModel.__table__
+    without_turns = ~select(turns.c.call_sid).where(turns.c.call_sid == transcriptions.c.call_id).exists()
+    for call_sid, blob, created_at in connection.execute(
+            select(transcriptions.c.call_id, transcriptions.c.transcription_text, transcriptions.c.created_at)
+            .where(without_turns)).all():
+        rows = _blob_turns(call_sid, blob, created_at)
+        if rows:
+            connection.execute(turns.insert(), rows)
+            written += len(rows)
+    if written:
+        logger.info(f"Migrated {written} transcript turns out of transcript blobs")
+    return written
+
+
+def _create_search_index(connection):
+    """Create the full-text index, indexing the turns already stored when it is new."""
+    is_new = not inspect(connection).has_table("transcript_search")
+    for statement in SEARCH_SCHEMA:
+        connection.execute(text(statement))
+    if is_new:
+        connection.execute(text("INSERT INTO transcript_search(transcript_search) VALUES ('rebuild')"))
+
+
+def _create_schema(connection):
+    """Create missing tables, add columns missing from tables an older version created, migrate old data."""
+    Base.metadata.create_all(connection)
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                logger.info(f"Adding column {table.name}.{column.name}")
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                        f"{column.type.compile(connection.dialect)}"))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    if connection.dialect.name == "sqlite":
+        _create_search_index(connection)
+    migrate_transcript_blobs(connection)
+    backfill_start_times(connection)
+
+
+def backfill_start_times(connection) -> int:
+    """
+    Give calls stored without a start time the time of their first turn.
+
+    Versions before ``CallSession`` set ``start_time`` stored NULL, those
+    calls were never archived and sorted last in caller profiles. Calls
+    without turns get the current time.
+
+    Returns:
+        int: Calls updated.
+    """
+    contexts, turns = CallContextModel.__table__, TranscriptTurnModel.__table__
+    first_turn = select(func.min(turns.c.created_at)).where(turns.c.call_sid == contexts.c.call_sid).scalar_subquery()
+    updated = connection.execute(contexts.update().where(contexts.c.start_time.is_(None))
+                                 .values(start_time=func.coalesce(first_turn, datetime.utcnow()))).rowcount
+    if updated:
+        logger.info(f"Set the start time of {updated} calls stored without one")
+    return updated
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn a search box query into an FTS5 MATCH expression.
+
+    ``"quoted words"`` match as a phrase, ``word*`` as a prefix, every other
+    word must appear somewhere in the turn. FTS5 operators typed by the user
+    are matched as plain words, so no query is a syntax error.
+
+    Args:
+        query (str): e.g. ``"refund request" deliver*``.
+
+    Returns:
+        str: The MATCH expression.
+
+    Raises:
+        ValueError: If the query has no words.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        if phrase:
+            words = re.findall(r"\w+", phrase)
+            if words:
+                terms.append('"' + " ".join(words) + '"')
+            continue
+        # A word with punctuation inside (o'neil, 555-0100) is tokenized into several, they must be adjacent
+        tokens = re.findall(r"\w+", word)
+        if tokens:
+            terms.append('"' + " ".join(tokens) + '"' + ("*" if word.endswith("*") else ""))
+    if not terms:
+        raise ValueError("The search query has no words")
+    return " ".join(terms)
+
+
+class DatabaseManager(EventHandler):
     """
     DatabaseManager is a class that manages the database operations for call contexts and transcriptions.
 
+    The schema is created on first use, inside the event loop that uses the
+    manager. Call context writes are write-behind: ``save_call_context``
+    queues the context and returns, a writer task commits every context
+    queued during ``flush_interval`` in one transaction. Several updates of
+    one call before a flush collapse into a single row write of its latest
+    state. ``create_call_context`` and ``update_call_context`` wait until
+    their batch is committed, so callers that need the write durable still
+    share the transaction with everyone else.
+
+    The conversation is not part of the call context row. Each save appends
+    the messages added to ``user_context`` since the previous save to
+    ``transcript_turns``, one small row per message, so a long call costs
+    the same per turn as a short one.
+
+    Calls older than the retention window are moved to a ``CallArchive`` by
+    ``archive_calls``, so the live tables hold recent calls only. An
+    archived call leaves transcript search, ``get_archived_call`` still
+    reads it back from its archive file.
+
     Args:
-        db_url (str): The URL of the database. Default is "sqlite+aiosqlite:///./DataLibrary/call_contexts.db".
+        db_url (str): The URL of the database. Default is the DATABASE_URL env var or
+            "sqlite+aiosqlite:///./DataLibrary/call_contexts.db".
+        pool_size (int): Connections kept open.
+        max_overflow (int): Extra connections opened under load.
+        flush_interval (float): Seconds queued writes wait to be batched.
+        max_batch (int): Calls written per transaction at most.
+        archive (Optional[CallArchive]): Where old calls are moved, ``ARCHIVE_DIR`` by default.
+        retry_interval (float): Seconds before a batch that failed is written again.
+        max_attempts (int): Attempts at writing a call's queued state before it is dropped.
 
     Attributes:
-        engine (alchemy.AsyncEngine): The SQLAlchemy async engine for the database connection.
-        SessionLocal (alchemy.orm.session.Session): The SQLAlchemy async session for the database.
-        Base (alchemy.ext.declarative.api.DeclarativeMeta): The SQLAlchemy declarative base for table definitions.
-        ContactModel (alchemy.ext.declarative.api.DeclarativeMeta): The SQLAlchemy model class for contacts table.
-        CallContextModel (alchemy.ext.declarative.api.DeclarativeMeta): The SQLAlchemy model class for call_contexts table.
-        TranscriptionModel (alchemy.ext.declarative.api.DeclarativeMeta): The SQLAlchemy model class for transcriptions table.
+        engine (AsyncEngine): The SQLAlchemy async engine for the database connection.
+        SessionLocal (async_sessionmaker): Creates async sessions for the database.
+        metrics (Dict[str, float]): Queued writes, coalesced writes, flushes and rows written.
 
     Methods:
-        _initialize_tables(): Initializes the tables in the database.
+        ensure_schema(): Creates the tables on first use.
         get_db(): Creates a database session and yields it for use.
-        create_call_context(db: AsyncSession, call_context): Creates a new call context in the database.
-        get_call_context(db: AsyncSession, call_sid: str): Retrieves a call context based on the call SID.
-        update_call_context(db: AsyncSession, call_sid: str, call_context): Updates a call context in the database.
-        delete_call_context(db: AsyncSession, call_sid: str): Deletes a call context from the database.
-        get_all_call_contexts(db: AsyncSession): Retrieves all call contexts from the database.
-        create_transcription(db: AsyncSession, call_sid: str, transcription_text: str): Creates a new transcription in the database.
-        get_transcription(db: AsyncSession, call_sid: str): Retrieves a transcription based on the call SID.
-        delete_transcription(db: AsyncSession, call_sid: str): Deletes a transcription from the database.
-        get_all_contacts(db: AsyncSession): Retrieves all contacts from the database.
-        get_contact_by_phone(db: AsyncSession, phone_number: str): Retrieves a contact based on the phone number.
+        save_call_context(call_context, latency_ms): Queues a call context write and its new turns, returns at once.
+        create_call_context(call_context): Writes a new call context.
+        get_call_context(call_sid: str): Retrieves a call context based on the call SID.
+        update_call_context(call_context): Updates a call context in the database.
+        delete_call_context(call_sid: str): Deletes a call context from the database.
+        get_all_call_contexts(): Retrieves all call contexts from the database.
+        get_turns(call_sid: str, after_seq: int, limit: int): Retrieves a page of a call's transcript turns.
+        search_turns(query: str, ...): Full-text search over every call's transcript turns.
+        archive_calls(older_than: timedelta): Moves old calls to the archive and vacuums.
+        get_archived_call(call_sid: str): Retrieves an archived call's summary and transcript.
+        start_archiving(interval: float): Archives old calls periodically until ``close``.
+        create_transcription(call_sid: str, transcription_text: str): Creates a new transcription in the database.
+        get_transcription(call_sid: str): Retrieves a transcription based on the call SID.
+        delete_transcription(call_sid: str): Deletes a transcription from the database.
+        get_all_contacts(): Retrieves all contacts from the database.
+        get_contact_by_phone(phone_number: str): Retrieves a contact based on the phone number.
+        update_contact(phone_number: str, name, preferences): Creates or updates a contact.
+        get_caller_profile(phone_number: str): Retrieves a caller's contact, preferences and recent calls.
+        flush(): Writes everything queued so far.
+        close(): Flushes and closes the connections.
     """
-    def __init__(self, db_url: str = "sqlite+aiosqlite:///./DataLibrary/call_contexts.db"):
-        # Ensure the DataLibrary folder exists
-        if not os.path.exists('DataLibrary'):
-            os.makedirs('DataLibrary')
-
-        # SQLAlchemy async setup with aiosqlite
-        self.engine = create_async_engine(db_url, connect_args={"check_same_thread": False})
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine, class_=AsyncSession)
-        self.Base = declarative_base()
-
-        # Initialize the tables
-        self._initialize_tables()
-
-    def _initialize_tables(self):
-        class ContactModel(self.Base):
-            __tablename__ = "contacts"
-
-            contact_id = Column(Integer, primary_key=True, index=True)
-            phone_number = Column(String, unique=True, nullable=False)
-            created_at = Column(DateTime, default=datetime.utcnow)
-
-            # Relationship to Calls
-            calls = relationship("CallContextModel", back_populates="contact")
-
-        class CallContextModel(self.Base):
-            __tablename__ = "call_contexts"
-
-            call_sid = Column(String, primary_key=True, index=True)
-            stream_sid = Column(String, index=True)
-            call_ended = Column(Boolean, default=False)
-            user_context = Column(Text)
-            system_message = Column(String)
-            initial_message = Column(String)
-            start_time = Column(DateTime, default=datetime.utcnow)
-            end_time = Column(DateTime)
-            final_status = Column(String)
-            to_number = Column(String, nullable=False)
-            from_number = Column(String, nullable=False)
-
-            # Foreign key to ContactModel
-            contact_id = Column(Integer, ForeignKey('contacts.contact_id'))
-            contact = relationship("ContactModel", back_populates="calls")
-
-            # Relationship to Transcriptions
-            transcription = relationship("TranscriptionModel", back_populates="call", uselist=False)
-
-        class TranscriptionModel(self.Base):
-            __tablename__ = "transcriptions"
-
-            transcription_id = Column(Integer, primary_key=True, index=True)
-            call_id = Column(String, ForeignKey('call_contexts.call_sid'), nullable=False)
-            transcription_text = Column(Text, nullable=False)
-            created_at = Column(DateTime, default=datetime.utcnow)
-
-            # Relationship to CallContext
-            call = relationship("CallContextModel", back_populates="transcription")
-
-        # Save these classes as attributes of the DatabaseManager class
-        self.ContactModel = ContactModel
-        self.CallContextModel = CallContextModel
-        self.TranscriptionModel = TranscriptionModel
-
-        # Create the database tables
-        async def create_tables():
-            async with self.engine.begin() as conn:
-                await conn.run_sync(self.Base.metadata.create_all)
 
-        import asyncio
-        asyncio.run(create_tables())
+    ContactModel = ContactModel
+    CallContextModel = CallContextModel
+    TranscriptionModel = TranscriptionModel
+    TranscriptTurnModel = TranscriptTurnModel
+    ArchivedCallModel = ArchivedCallModel
+
+    def __init__(self, db_url: str = DATABASE_URL, pool_size: int = int(os.getenv("DB_POOL_SIZE", 5)),
+                 max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", 10)),
+                 flush_interval: float = float(os.getenv("DB_FLUSH_INTERVAL", 0.05)),
+                 max_batch: int = int(os.getenv("DB_MAX_BATCH", 1000)), archive: Optional[CallArchive] = None,
+                 retry_interval: float = float(os.getenv("DB_RETRY_INTERVAL", 1.0)),
+                 max_attempts: int = int(os.getenv("DB_MAX_ATTEMPTS", 5))):
+        super().__init__()
+        self.is_sqlite = db_url.startswith("sqlite")
+        in_memory = self.is_sqlite and (":memory:" in db_url or db_url.rstrip("/").endswith(":"))
+        engine_args = {}
+        if self.is_sqlite:
+            # Ensure the database folder exists
+            path = db_url.split(":///", 1)[-1]
+            if not in_memory and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            engine_args["connect_args"] = {"check_same_thread": False}
+        if not in_memory:
+            engine_args.update(pool_size=pool_size, max_overflow=max_overflow, pool_recycle=3600)
+
+        self.engine = create_async_engine(db_url, **engine_args)
+        if self.is_sqlite:
+            event.listen(self.engine.sync_engine, "connect", self._configure_sqlite)
+        self.SessionLocal = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self._schema_ready = False
+        self._schema_lock = asyncio.Lock()
+        # call_sid -> latest CallContext (or DELETE) not written yet
+        self._pending: Dict[str, object] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        # call_sid -> transcript turns not written yet, and how many messages of its user_context were queued
+        self._pending_turns: Dict[str, List[dict]] = {}
+        self._persisted: Dict[str, int] = {}
+        # call_sid -> failed attempts at writing its queued state
+        self._failures: Dict[str, int] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self.archive = archive or CallArchive()
+        self._archiver: Optional[asyncio.Task] = None
+        self.metrics = {"queued": 0, "coalesced": 0, "flushes": 0, "rows": 0, "turns": 0, "max_batch": 0,
+                        "errors": 0, "flush_ms_total": 0.0}
+
+    @staticmethod
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    async def ensure_schema(self):
+        """Create the tables on first use."""
+        if self._schema_ready:
+            return
+        async with self._schema_lock:
+            if not self._schema_ready:
+                async with self.engine.begin() as conn:
+                    await conn.run_sync(_create_schema)
+                self._schema_ready = True
 
     async def get_db(self):
+        await self.ensure_schema()
         async with self.SessionLocal() as db:
-            try:
-                yield db
-            finally:
-                await db.close()
-
-    async def create_call_context(self, db: AsyncSession, call_context):
-        db_call_context = self.CallContextModel(
-            call_sid=call_context.call_sid,
-            stream_sid=call_context.stream_sid,
-            call_ended=call_context.call_ended,
-            user_context=json.dumps(call_context.user_context),
-            system_message=call_context.system_message,
-            initial_message=call_context.initial_message,
-            start_time=call_context.start_time,
-            end_time=call_context.end_time,
-            final_status=call_context.final_status,
-            to_number=call_context.to_number,
-            from_number=call_context.from_number,
-            contact_id=call_context.contact_id
-        )
-        db.add(db_call_context)
-        await db.commit()
-        await db.refresh(db_call_context)
-        return db_call_context
+            yield db
+
+    @staticmethod
+    def _row(call_context) -> dict:
+        return {
+            "call_sid": call_context.call_sid,
+            "stream_sid": call_context.stream_sid,
+            "call_ended": call_context.call_ended,
+            "system_message": call_context.system_message,
+            "initial_message": call_context.initial_message,
+            # The column default does not apply to an explicit None, the upsert keeps the first value stored
+            "start_time": _parse_time(call_context.start_time) or datetime.utcnow(),
+            "end_time": _parse_time(call_context.end_time),
+            "final_status": call_context.final_status,
+            "to_number": call_context.to_number or "",
+            "from_number": call_context.from_number or "",
+            "contact_id": getattr(call_context, "contact_id", None),
+        }
+
+    def _insert_turns(self):
+        dialect = postgresql if self.engine.dialect.name == "postgresql" else sqlite
+        return dialect.insert(TranscriptTurnModel).on_conflict_do_nothing(index_elements=["call_sid", "seq"])
+
+    def _upsert(self):
+        """INSERT .. ON CONFLICT DO UPDATE of a call context row, executed once for a whole batch."""
+        dialect = postgresql if self.engine.dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(CallContextModel)
+        # user_context is left alone, the conversation lives in transcript_turns, and so is an archive run's claim
+        updated = {column.name: statement.excluded[column.name] for column in CallContextModel.__table__.columns
+                   if column.name not in ("call_sid", "user_context", "archive_claim", "archive_claimed_at")}
+        updated["start_time"] = func.coalesce(CallContextModel.start_time, statement.excluded.start_time)
+        return statement.on_conflict_do_update(index_elements=[CallContextModel.call_sid], set_=updated)
+
+    def _queue(self, call_sid: str, item) -> asyncio.Future:
+        if not call_sid:
+            raise ValueError("A call context needs a call_sid to be stored")
+        if call_sid in self._pending:
+            self.metrics["coalesced"] += 1
+        self._pending[call_sid] = item
+        self.metrics["queued"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(call_sid, []).append(future)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_behind())
+        self._wakeup.set()
+        return future
+
+    def save_call_context(self, call_context, latency_ms: Optional[float] = None) -> asyncio.Future:
+        """
+        Queue a write of the call context's current state and of the messages added since the last save.
 
-    async def get_call_context(self, db: AsyncSession, call_sid: str):
-        return await db.query(self.CallContextModel).filter(self.CallContextModel.call_sid == call_sid).first()
+        Args:
+            call_context (CallContext): The context, read when the batch is written.
+            latency_ms (Optional[float]): Time the reply took, recorded on the new assistant turns.
 
-    async def update_call_context(self, db: AsyncSession, call_sid: str, call_context):
-        db_call_context = await db.query(self.CallContextModel).filter(
-            self.CallContextModel.call_sid == call_sid).first()
+        Returns:
+            asyncio.Future: Resolves once the batch holding the write is committed, awaiting it is optional.
+        """
+        future = self._queue(call_context.call_sid, call_context)
+        self._queue_turns(call_context, latency_ms)
+        return future
+
+    def _queue_turns(self, call_context, latency_ms: Optional[float]):
+        call_sid, messages = call_context.call_sid, call_context.user_context or []
+        persisted = self._persisted.get(call_sid, 0)
+        if len(messages) < persisted:
+            # The conversation was replaced, turns already written stay and new ones follow them
+            logger.warning(f"Conversation of {call_sid} shrank from {persisted} to {len(messages)} messages")
+        elif len(messages) > persisted:
+            now = datetime.utcnow()
+            self._pending_turns.setdefault(call_sid, []).extend(
+                _turn_row(call_sid, seq, messages[seq], now, latency_ms) for seq in range(persisted, len(messages)))
+        if call_context.call_ended:
+            # Nothing more will be added, the call may be archived
+            self._persisted.pop(call_sid, None)
+        else:
+            self._persisted[call_sid] = len(messages)
+
+    async def _write_behind(self):
+        while True:
+            await self._wakeup.wait()
+            # Give other calls a moment to add their updates to the same transaction
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            if not await self.flush():
+                # The database may be locked or unreachable for a while, what failed is written on the next try
+                await asyncio.sleep(self.retry_interval)
+                self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """
+        Write every queued call context, in transactions of at most ``max_batch`` calls.
+
+        Returns:
+            bool: False if a batch failed, it stays queued and the flush stops there.
+        """
+        # One flush at a time, so a flush returns only after writes another one had taken are committed too
+        async with self._flush_lock:
+            while self._pending:
+                if not await self._flush_batch():
+                    return False
+        return True
+
+    def _requeue(self, batch: Dict[str, object], turns: Dict[str, List[dict]]):
+        """Put a batch back in the queue, unless a newer write of the call was queued meanwhile."""
+        for call_sid, item in batch.items():
+            item = self._pending.setdefault(call_sid, item)
+            if call_sid in turns and item is not DELETE:
+                self._pending_turns[call_sid] = turns[call_sid] + self._pending_turns.get(call_sid, [])
+
+    async def _flush_batch(self) -> bool:
+        call_sids = list(self._pending)[:self.max_batch]
+        batch = {call_sid: self._pending.pop(call_sid) for call_sid in call_sids}
+        turns = {call_sid: self._pending_turns.pop(call_sid) for call_sid in call_sids
+                 if call_sid in self._pending_turns}
+        waiters = {call_sid: self._waiters.pop(call_sid, []) for call_sid in call_sids}
+        started = time.perf_counter()
+        try:
+            await self._write_batch(batch, [row for rows in turns.values() for row in rows])
+        except asyncio.CancelledError:
+            self._requeue(batch, turns)
+            for call_sid in call_sids:
+                self._waiters[call_sid] = waiters[call_sid] + self._waiters.get(call_sid, [])
+            raise
+        except Exception as e:
+            self.metrics["errors"] += 1
+            logger.error(f"Error writing {len(batch)} call contexts: {e!r}")
+            # Their transcript turns are only queued once, the batch is kept to be written again
+            for call_sid in call_sids:
+                self._failures[call_sid] = self._failures.get(call_sid, 0) + 1
+                if self._failures[call_sid] >= self.max_attempts:
+                    logger.error(f"Dropping the queued writes of {call_sid} after {self.max_attempts} attempts")
+                    del self._failures[call_sid]
+                    batch.pop(call_sid)
+                    turns.pop(call_sid, None)
+            self._requeue(batch, turns)
+            for future in (future for futures in waiters.values() for future in futures):
+                if not future.done():
+                    future.set_exception(e)
+                    # Nobody may await a fire and forget save
+                    future.exception()
+            return False
+        for call_sid in call_sids:
+            self._failures.pop(call_sid, None)
+        self.metrics["flushes"] += 1
+        self.metrics["rows"] += len(batch)
+        self.metrics["turns"] += sum(len(rows) for rows in turns.values())
+        self.metrics["max_batch"] = max(self.metrics["max_batch"], len(batch))
+        self.metrics["flush_ms_total"] += (time.perf_counter() - started) * 1000
+        for future in (future for futures in waiters.values() for future in futures):
+            if not future.done():
+                future.set_result(None)
+        # A finished call is part of its numbers' call history now
+        ended = {number for item in batch.values() if item is not DELETE and item.call_ended
+                 for number in (item.from_number, item.to_number) if number}
+        for number in ended:
+            await self.createEvent('contactchanged', number)
+        return True
+
+    async def _write_batch(self, batch: Dict[str, object], turns: List[dict]):
+        await self.ensure_schema()
+        rows = [self._row(item) for item in batch.values() if item is not DELETE]
+        deleted = [call_sid for call_sid, item in batch.items() if item is DELETE]
+        async with self.engine.begin() as conn:
+            if deleted:
+                await conn.execute(delete(TranscriptTurnModel).where(TranscriptTurnModel.call_sid.in_(deleted)))
+                await conn.execute(delete(TranscriptionModel).where(TranscriptionModel.call_id.in_(deleted)))
+                await conn.execute(delete(CallContextModel).where(CallContextModel.call_sid.in_(deleted)))
+            if rows:
+                await conn.execute(self._upsert(), rows)
+            if turns:
+                await conn.execute(self._insert_turns(), turns)
+
+    async def create_call_context(self, call_context):
+        """Write a new call context, returns once it is committed."""
+        await self.save_call_context(call_context)
+
+    async def get_call_context(self, call_sid: str) -> Optional[CallContextModel]:
+        await self._read_your_writes()
+        async with self.SessionLocal() as db:
+            return await db.get(CallContextModel, call_sid)
+
+    async def update_call_context(self, call_context):
+        """Write the call context's current state, returns once it is committed."""
+        await self.save_call_context(call_context)
+
+    async def delete_call_context(self, call_sid: str):
+        db_call_context = await self.get_call_context(call_sid)
         if db_call_context:
-            db_call_context.stream_sid = call_context.stream_sid
-            db_call_context.call_ended = call_context.call_ended
-            db_call_context.user_context = json.dumps(call_context.user_context)
-            db_call_context.system_message = call_context.system_message
-            db_call_context.initial_message = call_context.initial_message
-            db_call_context.start_time = call_context.start_time
-            db_call_context.end_time = call_context.end_time
-            db_call_context.final_status = call_context.final_status
-            db_call_context.to_number = call_context.to_number
-            db_call_context.from_number = call_context.from_number
-            db_call_context.contact_id = call_context.contact_id
-            await db.commit()
-            await db.refresh(db_call_context)
+            self._pending_turns.pop(call_sid, None)
+            self._persisted.pop(call_sid, None)
+            await self._queue(call_sid, DELETE)
         return db_call_context
 
-    async def delete_call_context(self, db: AsyncSession, call_sid: str):
-        db_call_context = await db.query(self.CallContextModel).filter(
-            self.CallContextModel.call_sid == call_sid).first()
-        if db_call_context:
-            await db.delete(db_call_context)
+    async def get_all_call_contexts(self) -> List[CallContextModel]:
+        await self._read_your_writes()
+        async with self.SessionLocal() as db:
+            return list(await db.scalars(select(CallContextModel)))
+
+    async def get_turns(self, call_sid: str, after_seq: int = -1, limit: int = 100) -> List[TranscriptTurnModel]:
+        """
+        A page of a call's transcript, oldest first.
+
+        Pages are keyset paginated: pass the ``seq`` of the last turn of one
+        page as ``after_seq`` to get the next one, which stays an index range
+        scan however deep into the call the page is.
+
+        Args:
+            call_sid (str): The call.
+            after_seq (int): Only turns after this one.
+            limit (int): Turns returned at most.
+
+        Returns:
+            List[TranscriptTurnModel]: The turns, ordered by seq.
+        """
+        await self._read_your_writes()
+        async with self.SessionLocal() as db:
+            return list(await db.scalars(
+                select(TranscriptTurnModel)
+                .where(TranscriptTurnModel.call_sid == call_sid, TranscriptTurnModel.seq > after_seq)
+                .order_by(TranscriptTurnModel.seq).limit(limit)))
+
+    async def search_turns(self, query: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                           number: Optional[str] = None, role: Optional[str] = None, limit: int = 20,
+                           cursor: Optional[int] = None, order: str = "recent", snippet_tokens: int = 12) -> dict:
+        """
+        Find transcript turns that mention something, across every call.
+
+        ``order="recent"`` returns the newest turns first and pages by keyset,
+        the query stops after ``limit`` matches however large the index is.
+        ``order="rank"`` returns the best bm25 matches first, which means
+        ranking every match, and pages by offset.
+
+        Args:
+            query (str): Words, ``"phrases"`` and ``prefix*`` terms, see ``build_match_query``.
+            since (Optional[datetime]): Only turns at or after this time.
+            until (Optional[datetime]): Only turns before this time.
+            number (Optional[str]): Only calls from or to this phone number.
+            role (Optional[str]): Only turns of this role, e.g. "user".
+            limit (int): Results per page.
+            cursor (Optional[int]): ``next`` of the previous page.
+            order (str): "recent" or "rank".
+            snippet_tokens (int): Words of context in each snippet.
+
+        Returns:
+            dict: ``results`` (call, turn, snippet with matches in <mark>) and ``next``, None on the last page.
+
+        Raises:
+            ValueError: If the query has no words or the order is unknown.
+            SearchUnavailableError: If the database is not SQLite, the index is built with FTS5.
+        """
+        if not self.is_sqlite:
+            raise SearchUnavailableError("Transcript search needs the SQLite FTS5 index")
+        if order not in ("recent", "rank"):
+            raise ValueError(f"Unknown order {order!r}")
+        conditions = ["transcript_search MATCH :match"]
+        params = {"match": build_match_query(query), "limit": limit, "tokens": snippet_tokens}
+        if since is not None:
+            conditions.append("t.created_at >= :since")
+            params["since"] = _naive_utc(since)
+        if until is not None:
+            conditions.append("t.created_at < :until")
+            params["until"] = _naive_utc(until)
+        if number:
+            conditions.append("(c.from_number = :number OR c.to_number = :number)")
+            params["number"] = number
+            # A number has few calls, start from them instead of from every turn matching the words
+            tables = ("call_contexts c CROSS JOIN transcript_turns t ON t.call_sid = c.call_sid "
+                      "CROSS JOIN transcript_search ON transcript_search.rowid = t.turn_id")
+        else:
+            tables = ("transcript_search JOIN transcript_turns t ON t.turn_id = transcript_search.rowid "
+                      "LEFT JOIN call_contexts c ON c.call_sid = t.call_sid")
+        if role:
+            conditions.append("t.role = :role")
+            params["role"] = role
+        if order == "recent":
+            if cursor is not None:
+                conditions.append("transcript_search.rowid < :cursor")
+                params["cursor"] = cursor
+            ordering = "ORDER BY transcript_search.rowid DESC LIMIT :limit"
+        else:
+            ordering = "ORDER BY bm25(transcript_search) LIMIT :limit OFFSET :offset"
+            params["offset"] = cursor or 0
+
+        statement = text(
+            "SELECT t.turn_id, t.call_sid, t.seq, t.role, t.created_at, c.from_number, c.to_number, c.start_time, "
+            "snippet(transcript_search, 0, '<mark>', '</mark>', '…', :tokens) AS snippet "
+            f"FROM {tables} WHERE {' AND '.join(conditions)} {ordering}")
+        # Bound as the column type, so the times are in the format created_at is stored in
+        statement = statement.bindparams(*(bindparam(name, type_=DateTime) for name in ("since", "until")
+                                           if name in params))
+        await self._read_your_writes()
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(statement, params)).mappings().all()
+
+        results = [{"call_sid": row["call_sid"], "seq": row["seq"], "role": row["role"], "snippet": row["snippet"],
+                    "created_at": str(row["created_at"]) if row["created_at"] else None,
+                    "from_number": row["from_number"], "to_number": row["to_number"],
+                    "call_started_at": str(row["start_time"]) if row["start_time"] else None}
+                   for row in rows]
+        if len(rows) < limit:
+            next_cursor = None
+        else:
+            next_cursor = rows[-1]["turn_id"] if order == "recent" else (cursor or 0) + limit
+        return {"results": results, "next": next_cursor}
+
+    async def _read_your_writes(self):
+        """Reads see writes queued before them."""
+        await self.ensure_schema()
+        if self._pending or self._flush_lock.locked():
+            await self.flush()
+
+    async def create_transcription(self, call_sid: str, transcription_text: str):
+        await self._read_your_writes()
+        async with self.SessionLocal() as db:
+            db_transcription = TranscriptionModel(call_id=call_sid, transcription_text=transcription_text)
+            db.add(db_transcription)
             await db.commit()
-        return db_call_context
+            return db_transcription
+
+    async def get_transcription(self, call_sid: str) -> Optional[TranscriptionModel]:
+        await self.ensure_schema()
+        async with self.SessionLocal() as db:
+            return await db.scalar(select(TranscriptionModel).where(TranscriptionModel.call_id == call_sid))
 
-    async def get_all_call_contexts(self, db: AsyncSession):
-        return await db.query(self.CallContextModel).all()
-
-    async def create_transcription(self, db: AsyncSession, call_sid: str, transcription_text: str):
-        db_transcription = self.TranscriptionModel(
-            call_id=call_sid,
-            transcription_text=transcription_text
-        )
-        db.add(db_transcription)
-        await db.commit()
-        await db.refresh(db_transcription)
-        return db_transcription
-
-    async def get_transcription(self, db: AsyncSession, call_sid: str):
-        return await db.query(self.TranscriptionModel).filter(self.TranscriptionModel.call_id == call_sid).first()
-
-    async def delete_transcription(self, db: AsyncSession, call_sid: str):
-        db_transcription = await db.query(self.TranscriptionModel).filter(
-            self.TranscriptionModel.call_id == call_sid).first()
-        if db_transcription:
-            await db.delete(db_transcription)
+    async def delete_transcription(self, call_sid: str):
+        await self.ensure_schema()
+        async with self.SessionLocal() as db:
+            db_transcription = await db.scalar(
+                select(TranscriptionModel).where(TranscriptionModel.call_id == call_sid))
+            if db_transcription:
+                await db.delete(db_transcription)
+                await db.commit()
+            return db_transcription
+
+    async def get_all_contacts(self) -> List[ContactModel]:
+        await self.ensure_schema()
+        async with self.SessionLocal() as db:
+            return list(await db.scalars(select(ContactModel)))
+
+    async def get_contact_by_phone(self, phone_number: str) -> Optional[ContactModel]:
+        await self.ensure_schema()
+        async with self.SessionLocal() as db:
+            return await db.scalar(select(ContactModel).where(ContactModel.phone_number == phone_number))
+
+    async def update_contact(self, phone_number: str, name: Optional[str] = None,
+                             preferences: Optional[dict] = None) -> ContactModel:
+        """
+        Create or update the contact of a phone number and announce it with a ``contactchanged`` event.
+
+        Args:
+            phone_number (str): The contact's number.
+            name (Optional[str]): New name, unchanged if None.
+            preferences (Optional[dict]): Preferences merged into the stored ones, a None value removes one.
+
+        Returns:
+            ContactModel: The stored contact.
+        """
+        await self.ensure_schema()
+        async with self.SessionLocal() as db:
+            contact = await db.scalar(select(ContactModel).where(ContactModel.phone_number == phone_number))
+            if contact is None:
+                contact = ContactModel(phone_number=phone_number)
+                db.add(contact)
+            if name is not None:
+                contact.name = name
+            if preferences:
+                merged = {**json.loads(contact.preferences or "{}"), **preferences}
+                contact.preferences = json.dumps({key: value for key, value in merged.items() if value is not None})
+            contact.updated_at = datetime.utcnow()
             await db.commit()
-        return db_transcription
+        await self.createEvent('contactchanged', phone_number)
+        return contact
+
+    async def get_caller_profile(self, phone_number: str, recent_calls: int = 3) -> dict:
+        """
+        What is known about a caller: contact name, preferences and their last finished calls.
+
+        Reads run on one connection and stay on indexes, recent calls come
+        from the live tables first and from the archive index once those
+        run out. Writes still queued are not waited for.
+
+        Args:
+            phone_number (str): The caller's number.
+            recent_calls (int): Previous calls summarized at most.
+
+        Returns:
+            dict: ``phone_number``, ``name``, ``preferences`` and ``recent_calls``, newest first, each with
+            ``start_time``, ``duration_s``, ``final_status`` and ``first_request``, the caller's first words.
+        """
+        await self.ensure_schema()
+        contexts, archived = CallContextModel.__table__, ArchivedCallModel.__table__
+        turns = TranscriptTurnModel.__table__
+        async with self.engine.connect() as conn:
+            contact = (await conn.execute(select(ContactModel.name, ContactModel.preferences)
+                                          .where(ContactModel.phone_number == phone_number))).first()
+            calls = [dict(row) for row in (await conn.execute(
+                select(contexts.c.call_sid, contexts.c.start_time, contexts.c.end_time, contexts.c.final_status)
+                .where((contexts.c.from_number == phone_number) | (contexts.c.to_number == phone_number),
+                       contexts.c.call_ended.is_(True))
+                .order_by(contexts.c.start_time.desc()).limit(recent_calls))).mappings()]
+            if calls:
+                # The first two turns are the scripted hello and greeting, the caller speaks from the third on
+                rows = await conn.execute(
+                    select(turns.c.call_sid, turns.c.content, func.min(turns.c.seq))
+                    .where(turns.c.call_sid.in_([call["call_sid"] for call in calls]), turns.c.role == "user",
+                           turns.c.seq > 1)
+                    .group_by(turns.c.call_sid))
+                first_requests = {call_sid: content for call_sid, content, _ in rows}
+                for call in calls:
+                    call["first_request"] = first_requests.get(call["call_sid"])
+            if len(calls) < recent_calls:
+                calls += [{**dict(row), "first_request": None} for row in (await conn.execute(
+                    select(archived.c.call_sid, archived.c.start_time, archived.c.end_time, archived.c.final_status)
+                    .where((archived.c.from_number == phone_number) | (archived.c.to_number == phone_number))
+                    .order_by(archived.c.start_time.desc()).limit(recent_calls - len(calls)))).mappings()]
+
+        for call in calls:
+            start_time, end_time = call.pop("start_time"), call.pop("end_time")
+            call["start_time"] = start_time.isoformat() if start_time else None
+            call["duration_s"] = (end_time - start_time).total_seconds() if start_time and end_time else None
+        return {"phone_number": phone_number, "name": contact.name if contact else None,
+                "preferences": json.loads(contact.preferences) if contact and contact.preferences else {},
+                "recent_calls": calls}
+
+    async def archive_calls(self, older_than: timedelta = timedelta(days=ARCHIVE_RETENTION_DAYS),
+                            chunk: int = 200, vacuum: bool = True) -> Dict[str, int]:
+        """
+        Move calls that started before the retention window to the archive.
+
+        Calls are archived ``chunk`` at a time: the run claims them in a write
+        transaction, so concurrent runs of other workers take other calls,
+        their turns and summaries are written to the archive, an
+        ``archived_calls`` row records where each call went, and the call's
+        live rows are deleted in the same transaction. Writers wait while a
+        chunk is archived, their saves stay queued. Calls with queued writes or
+        an unfinished transcript are left alone. The database is vacuumed
+        afterwards once enough of it is free.
+
+        Args:
+            older_than (timedelta): Age of the calls to archive.
+            chunk (int): Calls archived per transaction.
+            vacuum (bool): Whether to vacuum once calls were archived.
+
+        Returns:
+            Dict[str, int]: Calls and turns archived.
+        """
+        await self._read_your_writes()
+        cutoff = datetime.utcnow() - older_than
+        run = uuid.uuid4().hex
+        archived = {"calls": 0, "turns": 0}
+        started = time.perf_counter()
+        while True:
+            async with self._flush_lock:
+                contexts = await self._claim_calls(run, cutoff, chunk, set(self._pending) | set(self._persisted))
+                if not contexts:
+                    break
+                calls, turns = await self._archive_chunk(run, contexts)
+            archived["calls"] += calls
+            archived["turns"] += turns
+
+        if archived["calls"] and vacuum:
+            await self.vacuum()
+        if archived["calls"]:
+            logger.info(f"Archived {archived['calls']} calls and {archived['turns']} turns older than {cutoff} "
+                        f"in {time.perf_counter() - started:.1f}s")
+        return archived
+
+    async def _claim_calls(self, run: str, cutoff: datetime, chunk: int, live) -> list:
+        """Mark up to ``chunk`` unclaimed calls as this run's and return their rows."""
+        contexts = CallContextModel.__table__
+        now = datetime.utcnow()
+        # Repeated on the updated rows, a concurrent run that claimed one first wins it
+        unclaimed = contexts.c.archive_claim.is_(None) | (
+            contexts.c.archive_claimed_at < now - timedelta(seconds=ARCHIVE_CLAIM_TIMEOUT))
+        candidates = (select(contexts.c.call_sid)
+                      .where(contexts.c.start_time < cutoff, contexts.c.call_sid.not_in(live), unclaimed)
+                      .order_by(contexts.c.start_time).limit(chunk))
+        async with self.engine.begin() as conn:
+            return list(await conn.execute(
+                contexts.update().where(contexts.c.call_sid.in_(candidates), unclaimed)
+                .values(archive_claim=run, archive_claimed_at=now).returning(*contexts.c)))
+
+    async def _archive_chunk(self, run: str, contexts: list) -> Tuple[int, int]:
+        call_sids = [context.call_sid for context in contexts]
+        contexts_table, turns_table = CallContextModel.__table__, TranscriptTurnModel.__table__
+        async with self.engine.connect() as conn:
+            turns = (await conn.execute(select(turns_table).where(turns_table.c.call_sid.in_(call_sids))
+                                        .order_by(turns_table.c.call_sid, turns_table.c.seq))).mappings().all()
+        by_call: Dict[str, List[dict]] = {}
+        for turn in turns:
+            by_call.setdefault(turn["call_sid"], []).append(turn)
 
-    async def get_all_contacts(self, db: AsyncSession):
-        return await db.query(self.ContactModel).all()
+        days: Dict[str, tuple] = {}
+        for context in contexts:
+            call, rows = _archive_rows(context, by_call.get(context.call_sid, []))
+            calls, day_turns, day_contexts = days.setdefault(context.start_time.date().isoformat(), ([], [], []))
+            calls.append(call)
+            day_turns.extend(rows)
+            day_contexts.append((context, call))
 
-    async def get_contact_by_phone(self, db: AsyncSession, phone_number: str):
-        return await db.query(self.ContactModel).filter(self.ContactModel.phone_number == phone_number).first()
+        entries, written = [], []
+        try:
+            for day, (calls, day_turns, day_contexts) in days.items():
+                # The files are complete before the live rows go, a crash in between archives the calls again later
+                ranges = await asyncio.to_thread(self.archive.write, day, calls, day_turns)
+                written.append(next(iter(ranges.values()))[0])
+                for context, call in day_contexts:
+                    path, row_offset, row_count = ranges[context.call_sid]
+                    entries.append({"call_sid": context.call_sid, "day": day, "path": path,
+                                    "row_offset": row_offset, "row_count": row_count,
+                                    "from_number": context.from_number, "to_number": context.to_number,
+                                    "start_time": context.start_time, "end_time": context.end_time,
+                                    "final_status": context.final_status, "duration_s": call["duration_s"],
+                                    "latency_ms_avg": call["latency_ms_avg"],
+                                    "latency_ms_max": call["latency_ms_max"], "tokens": call["tokens"],
+                                    "archived_at": datetime.utcnow()})
+
+            async with self.engine.begin() as conn:
+                # Taking the write lock first, the claims cannot lapse to another run before the commit
+                held = (await conn.execute(
+                    contexts_table.update()
+                    .where(contexts_table.c.call_sid.in_(call_sids), contexts_table.c.archive_claim == run)
+                    .values(archive_claimed_at=datetime.utcnow()))).rowcount
+                if held == len(call_sids):
+                    await conn.execute(delete(ArchivedCallModel).where(ArchivedCallModel.call_sid.in_(call_sids)))
+                    await conn.execute(ArchivedCallModel.__table__.insert(), entries)
+                    await conn.execute(delete(TranscriptTurnModel).where(TranscriptTurnModel.call_sid.in_(call_sids)))
+                    await conn.execute(delete(TranscriptionModel).where(TranscriptionModel.call_id.in_(call_sids)))
+                    await conn.execute(delete(CallContextModel).where(CallContextModel.call_sid.in_(call_sids)))
+                else:
+                    # The run took longer than its claims last, another run archives these calls
+                    await conn.execute(
+                        contexts_table.update()
+                        .where(contexts_table.c.call_sid.in_(call_sids), contexts_table.c.archive_claim == run)
+                        .values(archive_claim=None, archive_claimed_at=None))
+        except BaseException:
+            await asyncio.to_thread(self._discard, written)
+            raise
+        if held != len(call_sids):
+            logger.warning(f"Archive run {run} lost its claim on {len(call_sids) - held} of {len(call_sids)} calls")
+            await asyncio.to_thread(self._discard, written)
+            return 0, 0
+        return len(call_sids), len(turns)
+
+    def _discard(self, paths: List[str]):
+        for path in paths:
+            try:
+                self.archive.discard(path)
+            except OSError as e:
+                logger.error(f"Error removing archive files of {path}: {e!r}")
+
+    async def vacuum(self, min_free: float = VACUUM_FREE_FRACTION) -> bool:
+        """
+        Rebuild the database file without the space deleted rows left.
+
+        SQLite is only rebuilt once ``min_free`` of its pages are free. The
+        rebuild does not hold ``_flush_lock``, reads go on meanwhile and a
+        batch whose commit times out waiting for it is written again.
+
+        Returns:
+            bool: Whether the database was vacuumed.
+        """
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if self.is_sqlite:
+                # Deleted turns stay in the full-text index as tombstones until its segments are merged
+                await conn.execute(text("INSERT INTO transcript_search(transcript_search) VALUES ('optimize')"))
+                free = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+                pages = (await conn.execute(text("PRAGMA page_count"))).scalar()
+                if free < pages * min_free:
+                    return False
+            await conn.execute(text("VACUUM"))
+            if self.is_sqlite:
+                # Shrink the write-ahead log too, VACUUM wrote the whole database through it
+                await conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        return True
+
+    async def get_archived_call(self, call_sid: str) -> Optional[dict]:
+        """
+        An archived call's summary and transcript, read from its archive file.
+
+        Returns:
+            Optional[dict]: The summary with a ``turns`` list, or None if the call was not archived.
+        """
+        await self.ensure_schema()
+        async with self.SessionLocal() as db:
+            entry = await db.get(ArchivedCallModel, call_sid)
+        if entry is None:
+            return None
+        turns = await asyncio.to_thread(self.archive.read_turns, entry.path, entry.row_offset, entry.row_count)
+        return {**entry.as_dict(), "turns": [{"seq": turn["seq"], "role": turn["role"], "name": turn["name"],
+                                              "content": turn["content"], "created_at": turn["created_at"],
+                                              "latency_ms": turn["latency_ms"]} for turn in turns]}
+
+    def start_archiving(self, interval: float = float(os.getenv("ARCHIVE_INTERVAL", 3600))):
+        """Archive old calls every ``interval`` seconds until ``close``, 0 turns it off."""
+        if interval > 0 and self._archiver is None:
+            self._archiver = asyncio.create_task(self._archive_periodically(interval))
+
+    async def _archive_periodically(self, interval: float):
+        while True:
+            try:
+                await self.archive_calls()
+            except Exception as e:
+                logger.error(f"Error archiving calls: {e!r}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        """Write what is still queued, stop the writer and close the connections."""
+        if self._archiver is not None:
+            self._archiver.cancel()
+            await asyncio.gather(self._archiver, return_exceptions=True)
+            self._archiver = None
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        if not await self.flush():
+            logger.error(f"Closing with {len(self._pending)} call contexts not written")
+        await self.engine.dispose()
+        logger.info(f"Database writes: {self.metrics}")
 
 
 # Example usage of the DatabaseManager class:
 if __name__ == "__main__":
-    db_manager = DatabaseManager()
-
+    from services.call_details import CallContext
 
-    # Example of using the DatabaseManager class in an async context
     async def main():
         """
         Main Method
@@ -209,31 +1127,26 @@ if __name__ == "__main__":
 
         :return: None
         """
+        db_manager = DatabaseManager()
+        await db_manager.ensure_schema()
         async with db_manager.SessionLocal() as db:
             # Create a new contact
-            new_contact = db_manager.ContactModel(phone_number="1234567890")
+            new_contact = ContactModel(phone_number="1234567890")
             db.add(new_contact)
             await db.commit()
 
-            # Create a new call context
-            new_call_context = db_manager.CallContextModel(
-                call_sid="ABC123",
-                stream_sid="STREAM123",
-                call_ended=False,
-                user_context=json.dumps(["user_action"]),
-                system_message="System message",
-                initial_message="Hello",
-                start_time=datetime.utcnow(),
-                end_time=None,
-                final_status="in_progress",
-                to_number="1234567890",
-                from_number="0987654321",
-                contact_id=new_contact.contact_id
-            )
-            db.add(new_call_context)
-            await db.commit()
-
-
-    import asyncio
+        # Create a new call context
+        call_context = CallContext()
+        call_context.call_sid = "ABC123"
+        call_context.stream_sid = "STREAM123"
+        call_context.user_context = ["user_action"]
+        call_context.system_message = "System message"
+        call_context.initial_message = "Hello"
+        call_context.start_time = datetime.utcnow().isoformat()
+        call_context.final_status = "in_progress"
+        call_context.to_number = "1234567890"
+        call_context.from_number = "0987654321"
+        await db_manager.create_call_context(call_context)
+        await db_manager.close()
 
     asyncio.run(main())
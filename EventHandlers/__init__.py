@@ -1,3 +1,2 @@
 from .event_manager import  *
 from .assitant_event_manager import *
-from .stream_handler import *
\ No newline at end of file
@@ -1,9 +1,60 @@
 import asyncio
-from typing import Any, Callable, Dict, List
-from Utils.logger_config import log_function_call, configure_logger
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+from Utils.logger_config import log_function_call, configure_logger, basic_logger
 import re
 import json
 
+logger = basic_logger("EventHandler")
+
+'''
+Author: Sean Baker
+Date: 2024-09-17
+Description: Event emitter with callbacks classified once at registration and per subscription dispatch modes
+'''
+
+# Dispatch modes of a subscription
+INLINE = "inline"  # awaited in turn, the emitter waits and sees exceptions
+CONCURRENT = "concurrent"  # started together with the other concurrent callbacks and gathered
+BACKGROUND = "background"  # fire and forget into the emitter's supervised task set
+DISPATCH_MODES = (INLINE, CONCURRENT, BACKGROUND)
+
+
+class Subscription:
+    """A callback registered for an event, classified once when it is registered."""
+
+    __slots__ = ("callback", "is_async", "mode", "once")
+
+    def __init__(self, callback: Callable, mode: str = INLINE, once: bool = False):
+        if mode not in DISPATCH_MODES:
+            raise ValueError(f"Unknown dispatch mode {mode!r}, expected one of {DISPATCH_MODES}")
+        self.callback = callback
+        self.is_async = asyncio.iscoroutinefunction(callback)
+        # A plain function has nothing to schedule, it always runs inline
+        self.mode = mode if self.is_async else INLINE
+        self.once = once
+
+
+class EventStats:
+    """Dispatch counters of one event, times cover inline and concurrent callbacks only."""
+
+    __slots__ = ("count", "errors", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": self.total_seconds * 1000,
+            "max_ms": self.max_seconds * 1000,
+            "mean_ms": self.total_seconds * 1000 / self.count if self.count else 0.0,
+        }
+
 
 class EventHandler:
     """
@@ -19,34 +70,150 @@ class EventHandler:
        :private-members:
        :special-members:
 
+    Callbacks are awaited inline by default, in registration order, as they
+    always were. A subscriber that should not hold up the emitter can ask
+    for ``concurrent`` (gathered with the other concurrent subscribers) or
+    ``background`` (run as a task the emitter keeps track of and cancels in
+    ``cancel_background``).
     """
 
     def __init__(self):
         """
         Initializes an instance of the EventEmitter class.
         """
-        self._events: Dict[str, List[Callable]] = {}
+        self._events: Dict[str, List[Subscription]] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.event_stats: Dict[str, EventStats] = {}
+
 
+    def on(self, event: str, callback: Callable, mode: str = INLINE, once: bool = False):
+        """
+        Subscribe to an event.
 
-    def on(self, event: str, callback: Callable):
-        if event not in self._events:
-            self._events[event] = []
-        self._events[event].append(callback)
+        Args:
+            event (str): The event name.
+            callback (Callable): A function or coroutine function called with the event's arguments.
+            mode (str): ``inline``, ``concurrent`` or ``background``.
+            once (bool): Unsubscribe after the first call.
+        """
+        # Copy on write, an event being dispatched keeps iterating the list it started with
+        self._events[event] = [*self._events.get(event, ()), Subscription(callback, mode, once)]
 
 
-    async def createEvent(self, event: str, *args: Any, **kwargs: Any):
-        if event in self._events:
-            for callback in self._events[event]:
-                await self._run_callback(callback, *args, **kwargs)
+    def once(self, event: str, callback: Callable, mode: str = INLINE):
+        """Subscribe to the next occurrence of an event only."""
+        self.on(event, callback, mode, once=True)
 
 
-    async def _run_callback(self, callback: Callable, *args: Any, **kwargs: Any):
-        if asyncio.iscoroutinefunction(callback):
-            await callback(*args, **kwargs)
-        else:
-            callback(*args, **kwargs)
+    def off(self, event: Optional[str] = None, callback: Optional[Callable] = None):
+        """
+        Unsubscribe.
+
+        Args:
+            event (Optional[str]): The event, every event if omitted.
+            callback (Optional[Callable]): The callback to remove, every callback of the event if omitted.
+        """
+        if event is None:
+            self._events.clear()
+            return
+        if callback is None:
+            self._events.pop(event, None)
+            return
+        self._set_subscriptions(event, [sub for sub in self._events.get(event, ()) if sub.callback != callback])
 
 
+    def _unsubscribe(self, event: str, subscription: Subscription):
+        """Remove one subscription, others of the same callback stay."""
+        self._set_subscriptions(event, [sub for sub in self._events.get(event, ()) if sub is not subscription])
 
 
+    def _set_subscriptions(self, event: str, subscriptions: List[Subscription]):
+        if subscriptions:
+            self._events[event] = subscriptions
+        else:
+            self._events.pop(event, None)
+
 
+    async def createEvent(self, event: str, *args: Any, **kwargs: Any):
+        subscriptions = self._events.get(event)
+        if not subscriptions:
+            return
+        stats = self.event_stats.get(event)
+        if stats is None:
+            stats = self.event_stats[event] = EventStats()
+
+        started = time.perf_counter()
+        pending = None
+        try:
+            for sub in subscriptions:
+                if sub.once:
+                    self._unsubscribe(event, sub)
+                if not sub.is_async:
+                    sub.callback(*args, **kwargs)
+                elif sub.mode == INLINE:
+                    await sub.callback(*args, **kwargs)
+                elif sub.mode == CONCURRENT:
+                    if pending is None:
+                        pending = []
+                    pending.append(sub.callback(*args, **kwargs))
+                else:
+                    self._spawn(event, sub.callback(*args, **kwargs))
+
+            if pending:
+                results = await asyncio.gather(*pending, return_exceptions=True)
+                pending = None
+                errors = [result for result in results if isinstance(result, BaseException)]
+                if errors:
+                    stats.errors += len(errors) - 1
+                    raise errors[0]
+        except BaseException:
+            stats.errors += 1
+            if pending:
+                # An inline callback failed before the concurrent ones were started
+                for coroutine in pending:
+                    coroutine.close()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.count += 1
+            stats.total_seconds += elapsed
+            if elapsed > stats.max_seconds:
+                stats.max_seconds = elapsed
+
+
+    def _spawn(self, event: str, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(lambda done: self._background_done(event, done))
+
+
+    def _background_done(self, event: str, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.event_stats[event].errors += 1
+            logger.error(f"Background '{event}' callback failed: {task.exception()!r}")
+
+
+    @property
+    def background_tasks(self) -> int:
+        """Background callbacks still running."""
+        return len(self._background)
+
+
+    async def drain(self):
+        """Wait for the running background callbacks to finish."""
+        while self._background:
+            await asyncio.gather(*list(self._background), return_exceptions=True)
+
+
+    async def cancel_background(self):
+        """Cancel the running background callbacks and wait for them to unwind."""
+        tasks = list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """Dispatch counters per event."""
+        return {event: stats.as_dict() for event, stats in self.event_stats.items()}
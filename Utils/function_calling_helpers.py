@@ -1,43 +1,193 @@
 import asyncio
 import json
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
-from Utils import logger
-from Utils import convert_to_request_log
 
+from functions.tool_http import tool_http
+from Utils.logger_config import basic_logger
+from Utils.utils import convert_to_request_log
 
+logger = basic_logger(__name__)
 
-async def trigger_api(url, method, param, api_token, meta_info, run_id, **kwargs):
-    try:
-        code = compile(param % kwargs, "<string>", "exec")
-        exec(code, globals(), kwargs)
-        req = param % kwargs
-        logger.info(f"Params {param % kwargs} \n {type(req)} \n {param} \n {kwargs} \n\n {req}")
+'''
+Author: Sean Baker
+Date: 2024-09-06
+Description: Declarative HTTP tools, parameter templates are compiled once at registration and
+             identical requests that are already in flight are shared instead of sent twice
+'''
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+
+class ApiTool:
+    """
+    An HTTP tool defined by a URL, a method and a ``%(name)s`` style JSON parameter template.
+
+    The template is split into literal segments and placeholder slots once, when
+    the tool is registered, so rendering is a single join. Values that sit inside
+    a JSON string are escaped, so a quote in the caller's words can't break the body.
+
+    Args:
+        name (str): The tool name, used for logging and stats.
+        url (str): The endpoint to call.
+        method (str): "get" (template becomes the query parameters) or "post" (template becomes the JSON body).
+        param (str): The parameter template.
+        api_token (Optional[str]): Sent as the Authorization header when set.
+        timeout (float): Request timeout in seconds.
+
+    Raises:
+        ValueError: If the method is not supported or the template does not render to a JSON object.
+    """
+
+    def __init__(self, name: str, url: str, method: str, param: str, api_token: Optional[str] = None,
+                 timeout: float = 10.0):
+        self.name = name
+        self.url = url
+        self.method = method.lower()
+        if self.method not in ("get", "post"):
+            raise ValueError(f"Unsupported method for {name}: {method}")
 
-        headers = {'Content-Type': 'application/json'}
+        self.headers = {'Content-Type': 'application/json'}
         if api_token:
-            headers['Authorization'] = api_token
-
-        convert_to_request_log(req, meta_info, None, "function_call", direction="request", is_cached=False,
-                               run_id=run_id)
-
-        logger.info(f"Sleeping for 700 ms to make sure that we do not send the same message multiple times")
-        await asyncio.sleep(0.7)
-
-        async with aiohttp.ClientSession() as session:
-            if method.lower() == "get":
-                logger.info(f"Sending request {req}, {url}, {headers}")
-                async with session.get(url, params=json.loads(req), headers=headers) as response:
-                    response_text = await response.text()
-                    logger.info(f"Response from the server: {response_text}")
-            elif method.lower() == "post":
-                logger.info(f"Sending request {json.loads(req)}, {url}, {headers}")
-                async with session.post(url, json=json.loads(req), headers=headers) as response:
-                    response_text = await response.text()
-                    logger.info(f"Response from the server: {response_text}")
-
-            return response_text
-    except Exception as e:
-        message = f"ERROR CALLING API: There was an error calling the API: {e}"
-        logger.error(message)
-        return message
\ No newline at end of file
+            self.headers['Authorization'] = api_token
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+        self.literals, self.slots = self._compile(param)
+        try:
+            sample = self.render({key: "sample" if quoted else 0 for key, quoted in self.slots})
+            json.loads(sample)
+        except (json.JSONDecodeError, TypeError) as e:
+            raise ValueError(f"Parameter template for {name} is not valid JSON: {e}") from e
+
+    @staticmethod
+    def _compile(param: str) -> Tuple[List[str], List[Tuple[str, bool]]]:
+        literals = PLACEHOLDER.split(param)[::2]
+        slots = []
+        # Whether the template is inside a JSON string where each slot starts, e.g. "Table for %(guests)s"
+        in_string = escaped = False
+        for literal, name in zip(literals, PLACEHOLDER.findall(param)):
+            for char in literal:
+                if escaped:
+                    escaped = False
+                elif char == "\\" and in_string:
+                    escaped = True
+                elif char == '"':
+                    in_string = not in_string
+            slots.append((name, in_string))
+        return literals, slots
+
+    def render(self, kwargs: Dict[str, Any]) -> str:
+        """
+        Render the parameter template with the tool call arguments.
+
+        Args:
+            kwargs (Dict[str, Any]): The arguments from the LLM.
+
+        Returns:
+            str: The rendered JSON document.
+        """
+        parts = [self.literals[0]]
+        for (key, quoted), literal in zip(self.slots, self.literals[1:]):
+            value = kwargs[key]
+            parts.append(json.dumps(str(value))[1:-1] if quoted else str(value))
+            parts.append(literal)
+        return "".join(parts)
+
+
+class ApiToolExecutor:
+    """
+    Registry and executor for ApiTools.
+
+    Requests go through the shared tool HTTP session, and a request whose
+    (url, method, Authorization header, rendered body) is already in flight
+    awaits that request's response instead of sending a duplicate. Tools with
+    different credentials never share a response.
+    """
+
+    def __init__(self):
+        self.tools: Dict[str, ApiTool] = {}
+        self.in_flight: Dict[Tuple[str, str, Optional[str], str], asyncio.Task] = {}
+        self.deduplicated = 0
+
+    def register(self, name: str, url: str, method: str, param: str, api_token: Optional[str] = None,
+                 **options) -> ApiTool:
+        """Compile and register a tool, see ApiTool for the arguments."""
+        tool = ApiTool(name, url, method, param, api_token, **options)
+        self.tools[name] = tool
+        return tool
+
+    async def execute(self, name: str, meta_info: Dict[str, Any], run_id: str, **kwargs) -> str:
+        """
+        Call a registered tool.
+
+        Args:
+            name (str): The tool name.
+            meta_info (Dict[str, Any]): Request metadata used for the request log.
+            run_id (str): The run id used for the request log.
+            **kwargs: The tool call arguments.
+
+        Returns:
+            str: The response body, or an error message the LLM can relay.
+        """
+        return await self.execute_tool(self.tools[name], meta_info, run_id, **kwargs)
+
+    async def execute_tool(self, tool: ApiTool, meta_info: Dict[str, Any], run_id: str, **kwargs) -> str:
+        """Same as execute, for a tool object that may not be registered by name."""
+        try:
+            req = tool.render(kwargs)
+            convert_to_request_log(req, meta_info, None, "function_call", direction="request", is_cached=False,
+                                   run_id=run_id)
+
+            key = (tool.url, tool.method, tool.headers.get('Authorization'), req)
+            task = self.in_flight.get(key)
+            if task is None:
+                task = asyncio.create_task(self._send(tool, req))
+                self.in_flight[key] = task
+                task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            else:
+                self.deduplicated += 1
+                logger.info(f"Sharing in-flight {tool.method.upper()} {tool.url} for {tool.name}")
+
+            response = await asyncio.shield(task)
+            convert_to_request_log(response, meta_info, None, "function_call", direction="response", is_cached=False,
+                                   run_id=run_id)
+            return response
+        except Exception as e:
+            message = f"ERROR CALLING API: There was an error calling the API: {e}"
+            logger.error(message)
+            return message
+
+    async def _send(self, tool: ApiTool, req: str) -> str:
+        start = time.perf_counter()
+        body = json.loads(req)
+        if tool.method == "get":
+            request = tool_http.session.get(tool.url, params=body, headers=tool.headers, timeout=tool.timeout)
+        else:
+            request = tool_http.session.post(tool.url, json=body, headers=tool.headers, timeout=tool.timeout)
+
+        async with request as response:
+            response_text = await response.text()
+        logger.info(f"{tool.name} responded in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return response_text
+
+
+api_tools = ApiToolExecutor()
+# Tools defined inline through trigger_api, keyed by their full definition
+_inline_tools: Dict[Tuple[str, str, str, Optional[str]], ApiTool] = {}
+
+
+async def trigger_api(url, method, param, api_token, meta_info, run_id, **kwargs):
+    """Call an API tool defined inline, the template is compiled on first use and reused afterwards."""
+    key = (url, method.lower(), param, api_token)
+    tool = _inline_tools.get(key)
+    if tool is None:
+        try:
+            tool = _inline_tools[key] = ApiTool(f"{method.lower()} {url}", url, method, param, api_token)
+        except ValueError as e:
+            message = f"ERROR CALLING API: There was an error calling the API: {e}"
+            logger.error(message)
+            return message
+    return await api_tools.execute_tool(tool, meta_info, run_id, **kwargs)
@@ -2,10 +2,15 @@ import asyncio
 import copy
 import json
 import os
+from collections import deque
 from datetime import datetime
 import loguru as logger
 import aiofiles
 
+from Utils.logger_config import basic_logger
+
+request_log_logger = basic_logger("RequestLogWriter")
+
 
 def format_messages(messages, use_system_prompt=False):
     formatted_string = ""
@@ -36,9 +41,11 @@ def write_json_file(file_path, data):
     with open(file_path, 'w') as file:
         json.dump(data, file, indent=4, ensure_ascii=False)
 
-async def write_request_logs(message, run_id):
+REQUEST_LOG_HEADER = "Time,Component,Direction,Leg ID,Sequence ID,Model,Data,Input Tokens,Output Tokens,Characters,Latency,Cached,Final Transcript,Engine\n"
+
+
+def format_request_log(message):
     component_details = [None, None, None, None, None]
-    logger.info(f"Message {message}")
     message_data = message.get('data', '')
     if message_data is None:
         message_data = ''
@@ -58,25 +65,84 @@ async def write_request_logs(message, run_id):
         component_details = [message_data, None, None, None, message.get('latency', None), None, None, None]
 
     row = row + component_details
+    return ','.join(['"' + str(item).replace('"', '""') + '"' if item is not None else '' for item in row]) + '\n'
+
 
-    header = "Time,Component,Direction,Leg ID,Sequence ID,Model,Data,Input Tokens,Output Tokens,Characters,Latency,Cached,Final Transcript,Engine\n"
-    log_string = ','.join(['"' + str(item).replace('"', '""') + '"' if item is not None else '' for item in row]) + '\n'
+def request_log_path(run_id):
     log_dir = f"./logs/{run_id.split('#')[0]}"
+    return log_dir, f"{log_dir}/{run_id.split('#')[1]}.csv"
+
+
+async def write_request_logs(message, run_id):
+    log_string = format_request_log(message)
+    log_dir, log_file_path = request_log_path(run_id)
     os.makedirs(log_dir, exist_ok=True)
-    log_file_path = f"{log_dir}/{run_id.split('#')[1]}.csv"
     file_exists = os.path.exists(log_file_path)
 
     async with aiofiles.open(log_file_path, mode='a') as log_file:
         if not file_exists:
-            await log_file.write(header + log_string)
+            await log_file.write(REQUEST_LOG_HEADER + log_string)
         else:
             await log_file.write(log_string)
+
+
+class RequestLogWriter:
+    """
+    Batches request log rows and appends them to their CSV files on a short interval,
+    instead of spawning a task and opening the file for every single row.
+
+    Args:
+        flush_interval (float): Seconds between flushes.
+        max_rows (int): Rows kept in memory before the oldest are dropped if the disk can't keep up.
+            Dropped rows are counted in ``dropped`` and logged on the next flush.
+    """
+
+    def __init__(self, flush_interval=0.5, max_rows=10000):
+        self.flush_interval = flush_interval
+        self.pending = deque(maxlen=max_rows)
+        self.dropped = 0
+        self._unreported = 0
+        self._flush_task = None
+
+    def write(self, message, run_id):
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+            self._unreported += 1
+        self.pending.append((run_id, format_request_log(message)))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if self._unreported:
+            request_log_logger.warning(f"Dropped {self._unreported} request log rows, {self.dropped} in total, "
+                                       f"the log files are not keeping up")
+            self._unreported = 0
+        batches = {}
+        while self.pending:
+            run_id, log_string = self.pending.popleft()
+            batches.setdefault(run_id, []).append(log_string)
+
+        for run_id, rows in batches.items():
+            log_dir, log_file_path = request_log_path(run_id)
+            os.makedirs(log_dir, exist_ok=True)
+            header = "" if os.path.exists(log_file_path) else REQUEST_LOG_HEADER
+            async with aiofiles.open(log_file_path, mode='a') as log_file:
+                await log_file.write(header + "".join(rows))
+
+
+request_log_writer = RequestLogWriter()
+
+
 def convert_to_request_log(message, meta_info, model, component = "transcriber", direction = 'response', is_cached = False, engine=None, run_id = None):
     log = dict()
     log['direction'] = direction
     log['data'] = message
     log['leg_id'] = meta_info['request_id'] if "request_id" in meta_info else "1234"
-    log['time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log['time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log['component'] = component
     log['sequence_id'] = meta_info['sequence_id']
     log['model'] = model
@@ -90,12 +156,11 @@ def convert_to_request_log(message, meta_info, model, component = "transcriber",
         if 'is_final' in meta_info and meta_info['is_final']:
             log['is_final'] = True
     if component == "function_call":
-        logger.info(f"Logging {message} {log['data']}")
         log['latency'] = None
     else:
         log['is_final'] = False #This is logged only for users to know final transcript from the transcriber
     log['engine'] = engine
-    asyncio.create_task(write_request_logs(log, run_id))
+    request_log_writer.write(log, run_id)
 
 def create_ws_data_packet(data, meta_info=None, is_md5_hash=False, llm_generated=False):
     metadata = copy.deepcopy(meta_info)
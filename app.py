@@ -1,23 +1,28 @@
-import asyncio
-import base64
 import json
 import os
-from collections import deque
-from typing import Dict
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+from urllib.parse import parse_qs
 
 import dotenv
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
-from twilio.rest import Client
+from fastapi import FastAPI, Request, WebSocket, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse
 from twilio.rest.insights.v1.call import CallContext
 from twilio.twiml.voice_response import Connect, VoiceResponse
 
 from Utils.logger_config import recursively_wrap_functions_in_directory, configured_logger
+from DataLibrary.database_manager import DatabaseManager, SearchUnavailableError
 from main import project_root, port
+from functions.tool_http import tool_http
+from telephony.twilio_client import get_twilio_client, close_twilio_client
 from services import CallContext
-from services import LLMFactory
-from networking import StreamService
-from speach_to_text import TranscriptionService
+from services import LLMFactory, CallPrewarmRegistry, CallSession, CallStoreFactory
+from services.caller_profile import CallerProfileCache
+from services.capacity import CapacityManager, hold_twiml, overflow_twiml
+from speach_to_text import STTFactory, DeepgramConnectionPool
+from speach_to_text.offline_stt import shutdown_decoder_pool
+from networking.audio_pool import shutdown_audio_pool
 from text_to_speach import TTSFactory
 
 '''
@@ -29,16 +34,82 @@ dotenv.load_dotenv()
 app = FastAPI()
 logger = configured_logger()
 
-# Global dictionary to store call contexts for each server instance (should be replaced with a database in production)
-global call_contexts
-call_contexts = {}
-
+# Call state shared by every worker, use sqlite (one host) or redis (several hosts) with more than one worker
+call_store = CallStoreFactory.get_call_store(os.getenv("CALL_STORE", "memory"))
+
+# Call history, every turn of every call is appended to its transcript
+database = DatabaseManager()
+
+# Contact, preferences and recent calls of each caller, looked up at /incoming and dropped when they change
+caller_profiles = CallerProfileCache(database.get_caller_profile)
+database.on('contactchanged', caller_profiles.invalidate)
+
+# Live calls, loop lag and provider concurrency of this worker, new calls are turned away when it is hot
+capacity = CapacityManager()
+# An outbound call holds its place while the callee's phone rings, Twilio gives up ringing after 60 seconds
+OUTBOUND_RESERVATION_TTL = float(os.getenv("OUTBOUND_RESERVATION_TTL", 90))
+HOLD_AUDIO_URL = os.getenv("HOLD_AUDIO_URL", "http://com.twilio.sounds.music.s3.amazonaws.com/MARKOVICHAMP-Borghestral.mp3")
+
+# Pre-connected Deepgram sockets shared by every call on this worker
+stt_service_name = os.getenv("STT_SERVICE", "deepgram")
+uses_deepgram = STTFactory.uses_deepgram(stt_service_name)
+stt_pool = DeepgramConnectionPool()
+
+# STT connection, LLM client and greeting audio prepared between /incoming and the media stream start
+greeting_tts = TTSFactory.get_tts_service(os.getenv("TTS_SERVICE", "deepgram"))
+prewarm = CallPrewarmRegistry(
+    stt_connect=stt_pool.acquire,
+    render_greeting=greeting_tts.render,
+    llm_warm_up=lambda: LLMFactory.warm_up(os.getenv("LLM_SERVICE", "openai")),
+    load_profile=caller_profiles.load
+)
+
+
+@app.on_event("startup")
+async def startup():
+    capacity.lag_monitor.start()
+    await call_store.start()
+    # Calls past ARCHIVE_RETENTION_DAYS move to compressed files under ARCHIVE_DIR every ARCHIVE_INTERVAL seconds
+    database.start_archiving()
+    if uses_deepgram:
+        await stt_pool.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    logger.info(f"Tool HTTP stats: {tool_http.report()}")
+    logger.info(f"STT pool stats: {stt_pool.stats()}")
+    logger.info(f"Caller profile stats: {caller_profiles.metrics()}")
+    await tool_http.close()
+    await prewarm.close()
+    await stt_pool.stop()
+    await call_store.close()
+    await database.close()
+    await close_twilio_client()
+    await capacity.lag_monitor.stop()
+    shutdown_decoder_pool()
+    shutdown_audio_pool()
 
 
 # First route that gets called by Twilio when call is initiated
 @app.post("/incoming")
-async def incoming_call() -> HTMLResponse:
+async def incoming_call(request: Request) -> HTMLResponse:
+    # Twilio posts the call details form encoded, start preparing the call before returning the TwiML
+    form = parse_qs((await request.body()).decode())
+    call_sid = form.get("CallSid", [None])[0]
     server = os.environ.get("SERVER")
+    # Only calls placed by /start_call are in the store before their stream starts, they were admitted there
+    call_context = await call_store.get(call_sid) if call_sid else None
+    if call_context is None and not capacity.admit(call_sid):
+        twiml = overflow_twiml(os.getenv("OVERFLOW_NUMBER"), os.getenv("OVERFLOW_QUEUE"),
+                               wait_url=f"https://{server}/hold", retry_url=f"https://{server}/incoming")
+        return HTMLResponse(content=twiml, status_code=200)
+    if call_sid:
+        initial_message = call_context.initial_message if call_context else os.environ.get("INITIAL_MESSAGE")
+        # Calls started from /start_call come back here too, their customer is the callee
+        customer_number = call_context.to_number if call_context else form.get("From", [None])[0]
+        prewarm.prepare(call_sid, initial_message, stt=uses_deepgram, customer_number=customer_number)
+
     response = VoiceResponse()
     connect = Connect()
     connect.stream(url=f"wss://{server}/connection")
@@ -46,10 +117,25 @@ async def incoming_call() -> HTMLResponse:
     return HTMLResponse(content=str(response), status_code=200)
 
 
+# Twilio fetches this for callers waiting in the overflow queue, each time the hold audio ends
+@app.post("/hold")
+async def hold(request: Request) -> HTMLResponse:
+    form = parse_qs((await request.body()).decode())
+    call_sid = form.get("CallSid", [None])[0]
+    return HTMLResponse(content=hold_twiml(capacity.admit(call_sid), HOLD_AUDIO_URL), status_code=200)
+
+
+# Load of this worker, a load balancer can route new calls around workers that answer 503
+@app.get("/health")
+async def health():
+    load = capacity.load()
+    return JSONResponse(content=load, status_code=200 if load["accepting"] else 503)
+
+
 @app.get("/call_recording/{call_sid}")
 async def get_call_recording(call_sid: str):
     """Get the recording URL for a specific call."""
-    recording = get_twilio_client().calls(call_sid).recordings.list()
+    recording = await get_twilio_client().calls(call_sid).recordings.list_async()
     if recording:
         print({"recording_url": f"https://api.twilio.com/{recording[0].uri}"})
         return {"recording_url": f"https://api.twilio.com/{recording[0].uri}"}
@@ -67,130 +153,22 @@ async def websocket_endpoint(websocket: WebSocket):
 
     logger.info(f"Using LLM service: {llm_service_name}")
     logger.info(f"Using TTS service: {tts_service_name}")
-
-    llm_service = LLMFactory.get_llm_service(llm_service_name, CallContext())
-    stream_service = StreamService(websocket)
-    transcription_service = TranscriptionService()
-    tts_service = TTSFactory.get_tts_service(tts_service_name)
-
-    marks = deque()
-    interaction_count = 0
-
-    await transcription_service.connect()
-
-    async def process_media(msg):
-        await transcription_service.send(base64.b64decode(msg['media']['payload']))
-
-    async def handle_transcription(text):
-        nonlocal interaction_count
-        if not text:
-            return
-        logger.info(f"Interaction {interaction_count} – STT -> LLM: {text}")
-        await llm_service.completion(text, interaction_count)
-        interaction_count += 1
-
-    async def handle_llm_reply(llm_reply, icount):
-        logger.info(f"Interaction {icount}: LLM -> TTS: {llm_reply['partialResponse']}")
-        await tts_service.generate(llm_reply, icount)
-
-    async def handle_speech(response_index, audio, label, icount):
-        logger.info(f"Interaction {icount}: TTS -> TWILIO: {label}")
-        await stream_service.buffer(response_index, audio)
-
-    async def handle_audio_sent(mark_label):
-        marks.append(mark_label)
-
-    async def handle_utterance(text, stream_sid):
-        try:
-            if len(marks) > 0 and text.strip():
-                logger.info("Intruption detected, clearing system.")
-                await websocket.send_json({
-                    "streamSid": stream_sid,
-                    "event": "clear"
-                })
-
-                # reset states
-                stream_service.reset()
-                llm_service.reset()
-
-        except Exception as e:
-            logger.error(f"Error while handling utterance: {e}")
-            e.print_stack()
-
-    transcription_service.on('utterance', handle_utterance)
-    transcription_service.on('transcription', handle_transcription)
-    llm_service.on('llmreply', handle_llm_reply)
-    tts_service.on('speech', handle_speech)
-    stream_service.on('audiosent', handle_audio_sent)
-
-    # Queue for incoming WebSocket messages
-    message_queue = asyncio.Queue()
-
-    async def websocket_listener():
-        try:
-            while True:
-                data = await websocket.receive_text()
-                await message_queue.put(json.loads(data))
-        except WebSocketDisconnect:
-            logger.info("WebSocket disconnected")
-
-    async def message_processor():
-        while True:
-            msg = await message_queue.get()
-            if msg['event'] == 'start':
-                stream_sid = msg['start']['streamSid']
-                call_sid = msg['start']['callSid']
-
-                call_context = CallContext()
-
-                if os.getenv("RECORD_CALLS") == "true":
-                    get_twilio_client().calls(call_sid).recordings.create({"recordingChannels": "dual"})
-
-                # Decide if the call the call was initiated from the UI or is an inbound
-                if call_sid not in call_contexts:
-                    # Inbound call
-                    call_context.system_message = os.environ.get("SYSTEM_MESSAGE")
-                    call_context.initial_message = os.environ.get("INITIAL_MESSAGE")
-                    call_context.call_sid = call_sid
-                    call_contexts[call_sid] = call_context
-                else:
-                    # Call from UI, reuse the existing context
-                    call_context = call_contexts[call_sid]
-
-                llm_service.set_call_context(call_context)
-
-                stream_service.set_stream_sid(stream_sid)
-                transcription_service.set_stream_sid(stream_sid)
-
-                logger.info(f"Twilio -> Starting Media Stream for {stream_sid}")
-                await tts_service.generate({
-                    "partialResponseIndex": None,
-                    "partialResponse": call_context.initial_message
-                }, 1)
-            elif msg['event'] == 'media':
-                asyncio.create_task(process_media(msg))
-            elif msg['event'] == 'mark':
-                label = msg['mark']['name']
-                if label in marks:
-                    marks.remove(label)
-            elif msg['event'] == 'stop':
-                logger.info(f"Twilio -> Media stream {stream_sid} ended.")
-                break
-            message_queue.task_done()
-
-    try:
-        listener_task = asyncio.create_task(websocket_listener())
-        processor_task = asyncio.create_task(message_processor())
-
-        await asyncio.gather(listener_task, processor_task)
-    except asyncio.CancelledError:
-        logger.info("Tasks cancelled")
-    finally:
-        await transcription_service.disconnect()
-
-
-def get_twilio_client():
-    return Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+    logger.info(f"Using STT service: {stt_service_name}")
+
+    session = CallSession(
+        websocket,
+        llm_service=LLMFactory.get_llm_service(llm_service_name, CallContext()),
+        # Dropped Deepgram sockets are replaced from the warm pool
+        stt_service=STTFactory.get_stt_service(stt_service_name, connection_factory=stt_pool.acquire),
+        tts_service=TTSFactory.get_tts_service(tts_service_name),
+        call_store=call_store,
+        database=database,
+        prewarm=prewarm,
+        stt_connect=stt_pool.acquire if uses_deepgram else None,
+        twilio_client=get_twilio_client,
+        capacity=capacity
+    )
+    await session.run()
 
 
 # API route to initiate a call via UI
@@ -205,28 +183,43 @@ async def start_call(request: Dict[str, str]):
         logger.error("Missing 'to_number' in request")
         raise HTTPException(status_code=400, detail="Missing 'to_number' in request")
 
+    reason = capacity.refusal()
+    if reason is not None:
+        raise HTTPException(status_code=503, detail=f"Worker at capacity: {reason}")
+    # Admitted before it is placed, the callee answering must not find the worker full
+    placeholder = f"outbound-{uuid.uuid4().hex}"
+    capacity.admit(placeholder, ttl=OUTBOUND_RESERVATION_TTL)
+
     service_url = f"https://{os.getenv('SERVER')}/incoming"
 
     try:
-        client = get_twilio_client()
         logger.info(f"Initiating call to {to_number} via {service_url}")
-        call = client.calls.create(
-            to=to_number,
-            from_=os.getenv("APP_NUMBER"),
-            url=service_url
-        )
+        try:
+            client = get_twilio_client()
+            call = await client.calls.create_async(
+                to=to_number,
+                from_=os.getenv("APP_NUMBER"),
+                url=service_url
+            )
+        except BaseException:
+            capacity.cancel_reservation(placeholder)
+            raise
         call_sid = call.sid
+        capacity.move_reservation(placeholder, call_sid)
 
         # Create CallContext instance
-        call_context = CallContext(
-            call_sid=call_sid,
-            system_message=system_message or os.getenv("SYSTEM_MESSAGE"),
-            initial_message=initial_message or os.getenv("Config.INITIAL_MESSAGE"),
-            to_number=to_number,
-            from_number=os.getenv("APP_NUMBER")
-        )
-
-
+        call_context = CallContext()
+        call_context.call_sid = call_sid
+        call_context.system_message = system_message or os.getenv("SYSTEM_MESSAGE")
+        call_context.initial_message = initial_message or os.getenv("INITIAL_MESSAGE")
+        call_context.to_number = to_number
+        call_context.from_number = os.getenv("APP_NUMBER")
+        call_context.start_time = datetime.utcnow().isoformat()
+        await call_store.put(call_context)
+        database.save_call_context(call_context)
+
+        # The callee may take a while to answer, the STT connection is opened once /incoming fires
+        prewarm.prepare(call_sid, call_context.initial_message, stt=False, ttl=120)
 
         return {"call_sid": call_sid}
     except Exception as e:
@@ -240,7 +233,7 @@ async def get_call_status(call_sid: str):
     """Get the status of a call."""
     try:
         client = get_twilio_client()
-        call = client.calls(call_sid).fetch()
+        call = await client.calls(call_sid).fetch_async()
         return {"status": call.status}
     except Exception as e:
         logger.error(f"Error fetching call status: {str(e)}")
@@ -254,7 +247,7 @@ async def end_call(request: Dict[str, str]):
     try:
         call_sid = request.get("call_sid")
         client = get_twilio_client()
-        client.calls(call_sid).update(status='completed')
+        await client.calls(call_sid).update_async(status='completed')
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Error ending call {str(e)}")
@@ -263,15 +256,48 @@ async def end_call(request: Dict[str, str]):
 
 # API call to get the transcript for a specific call
 @app.get("/transcript/{call_sid}")
-async def get_transcript(call_sid: str):
-    """Get the entire transcript for a specific call."""
-    call_context = call_contexts.get(call_sid)
-
-    if not call_context:
-        logger.info(f"[GET] Call not found for call SID: {call_sid}")
-        return {"error": "Call not found"}
-
-    return {"transcript": call_context.user_context}
+async def get_transcript(call_sid: str, after: int = -1, limit: int = 100):
+    """
+    Get the transcript of a call a page at a time.
+
+    Pass the returned ``next`` as ``after`` to get the following page, ``next`` is null on the last page.
+    """
+    limit = max(1, min(limit, 1000))
+    turns = await database.get_turns(call_sid, after_seq=after, limit=limit)
+
+    if not turns and not await database.get_call_context(call_sid):
+        archived = await database.get_archived_call(call_sid)
+        if archived is not None:
+            page = [turn for turn in archived["turns"] if turn["seq"] > after][:limit]
+            return {"transcript": page, "next": page[-1]["seq"] if len(page) == limit else None, "archived": True}
+        if after < 0:
+            logger.info(f"[GET] Call not found for call SID: {call_sid}")
+            return {"error": "Call not found"}
+
+    return {"transcript": [turn.as_dict() for turn in turns],
+            "next": turns[-1].seq if len(turns) == limit else None}
+
+
+# API route to update what is known about a caller, used to personalize their next calls
+@app.put("/contacts/{phone_number}")
+async def update_contact(phone_number: str, request: Dict):
+    """Set a contact's ``name`` and merge ``preferences`` into theirs, a null preference is removed."""
+    preferences = request.get("preferences")
+    if preferences is not None and not isinstance(preferences, dict):
+        raise HTTPException(status_code=400, detail="'preferences' must be an object")
+    contact = await database.update_contact(phone_number, name=request.get("name"), preferences=preferences)
+    return {"phone_number": contact.phone_number, "name": contact.name,
+            "preferences": json.loads(contact.preferences or "{}")}
+
+
+# API route to get an archived call's summary and transcript
+@app.get("/archive/{call_sid}")
+async def get_archived_call(call_sid: str):
+    """Get a call moved to the archive: numbers, times, duration, latency and token totals, and its transcript."""
+    archived = await database.get_archived_call(call_sid)
+    if archived is None:
+        raise HTTPException(status_code=404, detail="Call not archived")
+    return archived
 
 
 # API route to get all call transcripts
@@ -280,9 +306,9 @@ async def get_all_transcripts():
     """Get a list of all current call transcripts."""
     try:
         transcript_list = []
-        for call_sid, context in call_contexts.items():
+        for context in await call_store.all():
             transcript_list.append({
-                "call_sid": call_sid,
+                "call_sid": context.call_sid,
                 "transcript": context.user_context,
             })
         return {"transcripts": transcript_list}
@@ -291,6 +317,26 @@ async def get_all_transcripts():
         return {"error": f"Failed to fetch all transcripts: {str(e)}"}
 
 
+# API route to find calls by what was said in them
+@app.get("/search")
+async def search_transcripts(q: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                             number: Optional[str] = None, role: Optional[str] = None, limit: int = 20,
+                             cursor: Optional[int] = None, order: str = "recent"):
+    """
+    Search every call's transcript.
+
+    ``q`` takes words, ``"quoted phrases"`` and ``prefix*`` terms. Results carry a snippet with the matches in
+    ``<mark>``, pass the returned ``next`` as ``cursor`` for the following page.
+    """
+    try:
+        return await database.search_turns(q, since=since, until=until, number=number, role=role,
+                                           limit=max(1, min(limit, 100)), cursor=cursor, order=order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SearchUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+
 if __name__ == "__main__":
     import uvicorn
     logger.add("logs/app.log", format="{time} {level} {message}", level="INFO")
@@ -1,29 +1,25 @@
-import os
-from twilio.rest import Client
-import asyncio
+from telephony.twilio_client import get_twilio_client
 '''
 Author: Sean Baker
 Date: 2024-07-08 
 Description: terminates call 
 '''
 async def end_call(context, args):
-    # Retrieve the Twilio credentials from environment variables
-    account_sid = os.environ['TWILIO_ACCOUNT_SID']
-    auth_token = os.environ['TWILIO_AUTH_TOKEN']
-    client = Client(account_sid, auth_token)
+    client = get_twilio_client()
     call_sid = context.call_sid
 
     # Fetch the call
-    call = client.calls(call_sid).fetch()
+    call = await client.calls(call_sid).fetch_async()
 
     # Check if the call is already completed
     if call.status in ['completed', 'failed', 'busy', 'no-answer', 'canceled']:
         return f"Call already ended with status: {call.status}"
 
-    # Wait for 5 seconds before ending the call to ensure the goodbye goes through
-    await asyncio.sleep(5)
+    # Wait for Twilio to acknowledge the goodbye audio instead of sleeping a fixed 5 seconds
+    if context.mark_tracker is not None:
+        await context.mark_tracker.wait_until_played(timeout=10)
 
     # End the call
-    call = client.calls(call_sid).update(status='completed')
+    call = await client.calls(call_sid).update_async(status='completed')
 
     return f"Call ended successfully. Final status: {call.status}"
\ No newline at end of file
@@ -8,7 +8,13 @@ tools = [
                 "type": "object",
                 "properties": {}
             },
-            "say": "Transferring your call, please wait."
+            "say": "Transferring your call, please wait.",
+            "intents": [
+                r"(?:transfer|connect|put) me (?:through )?(?:to|with) (?:a |an |the |some )?(?:real )?(?:human|person|agent|representative|operator|someone|somebody)",
+                r"(?:can|could|may) i (?:please )?(?:speak|talk) (?:to|with) (?:a |an |the |some )?(?:real )?(?:human|person|agent|representative|operator|someone|somebody)",
+                r"i (?:want|need|would like|'d like) to (?:speak|talk) (?:to|with) (?:a |an |the |some )?(?:real )?(?:human|person|agent|representative|operator|someone|somebody)",
+                r"(?:speak|talk) (?:to|with) (?:a |an |the |some )?(?:real )?(?:human|person|agent|representative|operator)",
+            ]
         }
     },
     {
@@ -20,7 +26,12 @@ tools = [
                 "type": "object",
                 "properties": {}
             },
-            "say": "Goodbye."
+            "say": "Goodbye.",
+            "intents": [
+                r"(?:good ?bye|bye(?: bye)?|bye now|see you|see ya)",
+                r"(?:that'?s all|that is all)(?: (?:good ?bye|bye))?",
+                r"(?:hang up|end (?:the|this) call)",
+            ]
         }
     },
 
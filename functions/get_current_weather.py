@@ -1,5 +1,6 @@
 import logging
-import requests
+
+from .tool_http import tool_http, ToolHttpError
 
 logger = logging.getLogger(__name__)
 
@@ -22,9 +23,7 @@ async def get_current_weather(context, args):
     params = {"location": location}
 
     try:
-        response = requests.get(api_url, params=params)
-        response.raise_for_status()
-        weather_data = response.json()
+        weather_data = await tool_http.get_json("get_current_weather", api_url, params=params)
 
         # Extract relevant weather information from the response
         temperature = weather_data.get("temperature")
@@ -33,6 +32,6 @@ async def get_current_weather(context, args):
         else:
             return "Could not retrieve temperature information."
 
-    except requests.RequestException as e:
+    except ToolHttpError as e:
         logger.error(f"Error retrieving weather data: {e}")
         return "Error retrieving weather data."
@@ -1,6 +1,7 @@
-import requests
 import os
 
+from .tool_http import tool_http, ToolHttpError
+
 api_key = os.getenv('TICKET_MASTER_API_KEY')  # Retrieve API key from environment variable
 
 '''
@@ -8,7 +9,7 @@ Author: Sean Baker
 Date: 2024-07-21
 Description: API to search for venues 
 '''
-def search_events(api_key, params):
+async def search_events(api_key, params):
     """
     Searches for events using the Ticketmaster Discovery API.
 
@@ -20,23 +21,27 @@ def search_events(api_key, params):
     params['apikey'] = api_key
 
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-
-        events_data = response.json()
+        events_data = await tool_http.get_json("search_events", url, params=params)
 
         if '_embedded' in events_data and 'events' in events_data['_embedded']:
             events = events_data['_embedded']['events']
             return events
         else:
             return "No events found for the given parameters."
-    except requests.exceptions.HTTPError as http_err:
+    except ToolHttpError as http_err:
         return f"HTTP error occurred: {http_err}"
     except Exception as err:
         return f"Other error occurred: {err}"
 
 
-def search_venues(api_key, params):
+async def search_venues(context, args):
+    """
+    Tool wrapper around search_events, looks up upcoming events for the caller.
+
+    :param context: The call context (not used in this function).
+    :param args: Optional keyword, city, stateCode, classificationName and size filters.
+    :return: A short description of the events found or an error message.
+    """
     api_key = os.getenv('TICKET_MASTER_API_KEY')  # Retrieve API key from environment variable
 
     if not api_key:
@@ -49,9 +54,8 @@ def search_venues(api_key, params):
         'classificationName': 'Music',
         'size': '5'
     }
-    events = search_events(api_key, search_params)
+    search_params.update({key: value for key, value in (args or {}).items() if key in search_params})
+    events = await search_events(api_key, search_params)
     if isinstance(events, list):
-        for event in events:
-            print(event['name'])
-    else:
-        print(events)
\ No newline at end of file
+        return ", ".join(event['name'] for event in events)
+    return events
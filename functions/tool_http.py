@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+'''
+Author: Sean Baker
+Date: 2024-09-05
+Description: Shared async HTTP client for tools, pooled session, per tool timeouts/retries and a TTL result cache
+'''
+
+_MISSING = object()
+
+
+class ToolHttpError(Exception):
+    """Raised when a tool request fails after all retries."""
+
+
+class TTLCache:
+    """
+    A small LRU cache where every entry also expires after a fixed time to live.
+
+    Args:
+        max_size (int): Maximum number of entries, the least recently used entry is evicted first.
+        ttl (float): Seconds an entry stays valid.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ToolStats:
+    """Latency and error counters for one tool."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency: float, error: bool = False):
+        self.requests += 1
+        self.errors += int(error)
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+
+class ToolHttpClient:
+    """
+    Async HTTP client shared by every tool in the process.
+
+    One pooled aiohttp session is reused for all requests, so tools never block
+    the event loop and never pay a fresh TCP/TLS handshake per call. Each tool
+    can have its own timeout, retry count and result cache.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections.
+        timeout (float): Default request timeout in seconds.
+        retries (int): Default number of retries for timeouts, connection errors and 5xx responses.
+        cache_ttl (float): Default seconds a cached result stays valid, 0 disables caching.
+        cache_size (int): Default maximum cached results per tool.
+    """
+
+    def __init__(self, pool_size: int = 100, timeout: float = 5.0, retries: int = 2,
+                 cache_ttl: float = 300.0, cache_size: int = 256):
+        self.pool_size = pool_size
+        self.defaults = {"timeout": timeout, "retries": retries, "cache_ttl": cache_ttl, "cache_size": cache_size}
+        self.tool_config: Dict[str, Dict[str, Any]] = {}
+        self.caches: Dict[str, TTLCache] = {}
+        self.stats: Dict[str, ToolStats] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def configure(self, tool: str, **options):
+        """
+        Override the timeout, retries, cache_ttl or cache_size for a tool.
+
+        Args:
+            tool (str): The tool name.
+            **options: The settings to override.
+        """
+        self.tool_config.setdefault(tool, {}).update(options)
+        self.caches.pop(tool, None)
+
+    def _option(self, tool: str, name: str):
+        return self.tool_config.get(tool, {}).get(name, self.defaults[name])
+
+    def _cache(self, tool: str) -> TTLCache:
+        if tool not in self.caches:
+            self.caches[tool] = TTLCache(self._option(tool, "cache_size"), self._option(tool, "cache_ttl"))
+        return self.caches[tool]
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @staticmethod
+    def normalize_key(*parts: Any) -> str:
+        """Builds a cache key that ignores case, surrounding whitespace and argument order."""
+
+        def normalize(value):
+            if isinstance(value, str):
+                return " ".join(value.lower().split())
+            if isinstance(value, dict):
+                return {str(k): normalize(v) for k, v in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [normalize(v) for v in value]
+            return value
+
+        return json.dumps([normalize(part) for part in parts], sort_keys=True, default=str)
+
+    async def get_json(self, tool: str, url: str, params: Optional[Dict[str, Any]] = None,
+                       headers: Optional[Dict[str, str]] = None, cache: bool = True) -> Any:
+        """
+        GET a JSON document for a tool, served from the tool's cache when possible.
+
+        Args:
+            tool (str): The tool name, used for per tool settings and stats.
+            url (str): The URL to fetch.
+            params (Optional[Dict[str, Any]]): Query parameters.
+            headers (Optional[Dict[str, str]]): Request headers.
+            cache (bool): Whether the result may be served from or stored in the cache.
+
+        Returns:
+            Any: The decoded JSON body.
+
+        Raises:
+            ToolHttpError: If the request fails after all retries or returns a client error.
+        """
+        use_cache = cache and self._option(tool, "cache_ttl") > 0
+        key = self.normalize_key(url, params or {}) if use_cache else None
+        if use_cache:
+            cached = self._cache(tool).get(key, _MISSING)
+            if cached is not _MISSING:
+                return cached
+
+        result = await self.request(tool, "GET", url, params=params, headers=headers)
+        if use_cache:
+            self._cache(tool).set(key, result)
+        return result
+
+    async def request(self, tool: str, method: str, url: str, **kwargs) -> Any:
+        """
+        Send a request with the tool's timeout and retry policy and decode the JSON response.
+
+        Args:
+            tool (str): The tool name.
+            method (str): The HTTP method.
+            url (str): The URL.
+            **kwargs: Passed to aiohttp (params, json, headers, ...).
+
+        Returns:
+            Any: The decoded JSON body.
+
+        Raises:
+            ToolHttpError: If the request fails after all retries or returns a client error.
+        """
+        timeout = aiohttp.ClientTimeout(total=self._option(tool, "timeout"))
+        retries = self._option(tool, "retries")
+        stats = self.stats.setdefault(tool, ToolStats())
+        start = time.perf_counter()
+
+        for attempt in range(retries + 1):
+            try:
+                async with self.session.request(method, url, timeout=timeout, **kwargs) as response:
+                    if response.status >= 500 and attempt < retries:
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status)
+                    if response.status >= 400:
+                        raise ToolHttpError(f"{tool} request failed with status {response.status}")
+                    result = await response.json(content_type=None)
+                stats.record(time.perf_counter() - start)
+                return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    stats.record(time.perf_counter() - start, error=True)
+                    raise ToolHttpError(f"{tool} request failed after {attempt + 1} attempts: {e}") from e
+                backoff = 0.1 * (2 ** attempt) * (1 + random.random())
+                logger.warning(f"{tool} request failed ({e}), retrying in {backoff:.2f}s")
+                await asyncio.sleep(backoff)
+            except ToolHttpError:
+                stats.record(time.perf_counter() - start, error=True)
+                raise
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per tool latency and cache numbers.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Stats keyed by tool name.
+        """
+        report = {}
+        for tool in set(self.stats) | set(self.caches):
+            stats = self.stats.get(tool, ToolStats())
+            cache = self.caches.get(tool)
+            report[tool] = {
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "average_latency_ms": round(stats.average_latency * 1000, 2),
+                "max_latency_ms": round(stats.max_latency * 1000, 2),
+                "cache_hits": cache.hits if cache else 0,
+                "cache_misses": cache.misses if cache else 0,
+                "cache_hit_rate": round(cache.hit_rate, 3) if cache else 0.0,
+            }
+        return report
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+tool_http = ToolHttpClient()
+tool_http.configure("get_current_weather", timeout=3.0, cache_ttl=600.0)
+tool_http.configure("search_events", timeout=5.0, cache_ttl=900.0)
@@ -1,6 +1,5 @@
 import os
-from twilio.rest import Client
-import asyncio
+from telephony.twilio_client import get_twilio_client
 
 '''
 Author: Sean Baker
@@ -22,21 +21,18 @@ async def transfer_call(context, args):
         Exception: If there is an error during the call transfer.
     """
     # Retrieve the active call using the CallSid
-    account_sid = os.environ['TWILIO_ACCOUNT_SID']
-    auth_token = os.environ['TWILIO_AUTH_TOKEN']
     transfer_number = os.environ['TRANSFER_NUMBER']
 
-    client = Client(account_sid, auth_token)
+    client = get_twilio_client()
     call_sid = context.call_sid
 
-    # Wait for 10 seconds before transferring the call
-    await asyncio.sleep(8)
+    # Wait for Twilio to acknowledge the preamble audio instead of sleeping a fixed 8 seconds
+    if context.mark_tracker is not None:
+        await context.mark_tracker.wait_until_played(timeout=15)
 
     try:
-        call = client.calls(call_sid).fetch()
-
         # Update the call with the transfer number
-        call = client.calls(call_sid).update(
+        await client.calls(call_sid).update_async(
             url=f'http://twimlets.com/forward?PhoneNumber={transfer_number}',
             method='POST'
         )
@@ -1,3 +1,6 @@
 from .streaming_service import StreamService
+from .mark_tracker import MarkTracker
+from .bounded_queue import BoundedQueue, BLOCK, DROP_OLDEST, DROP_NEWEST
 from .audio_utils import convert_audio_to_wav,create_ws_data_packet
+from .audio_pool import AudioWorkerPool, shared_audio_pool, shutdown_audio_pool
 from .default_input import DefaultInputHandler
\ No newline at end of file
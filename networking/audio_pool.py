@@ -0,0 +1,223 @@
+import asyncio
+import base64
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from Utils.logger_config import basic_logger
+
+logger = basic_logger("AudioPool")
+
+'''
+Author: Sean Baker
+Date: 2024-09-21
+Description: Worker processes for CPU bound audio work (transcoding, resampling, trimming, encoding) off the event loop
+'''
+
+# Payloads at least this large travel through shared memory instead of being pickled
+SHARED_MEMORY_MIN_BYTES = int(os.getenv("AUDIO_SHM_MIN_BYTES", 64 * 1024))
+
+
+class SharedBuffer:
+    """A reference to bytes left in a shared memory segment, the only thing pickled for large payloads."""
+
+    __slots__ = ("name", "size")
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    def __getstate__(self):
+        return self.name, self.size
+
+    def __setstate__(self, state):
+        self.name, self.size = state
+
+    @classmethod
+    def wrap(cls, data: bytes) -> Union[bytes, "SharedBuffer"]:
+        """Copy large data into a new segment, small data is returned as is."""
+        if len(data) < SHARED_MEMORY_MIN_BYTES:
+            return data
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        shm.close()
+        return cls(shm.name, len(data))
+
+    @staticmethod
+    def unwrap(payload: Union[bytes, str, "SharedBuffer"], unlink: bool) -> Union[bytes, str]:
+        """The data behind a payload, the segment is unlinked by whichever side reads it last."""
+        if not isinstance(payload, SharedBuffer):
+            return payload
+        shm = shared_memory.SharedMemory(name=payload.name)
+        try:
+            return bytes(shm.buf[:payload.size])
+        finally:
+            shm.close()
+            if unlink:
+                shm.unlink()
+
+
+def trim_encode(audio: bytes, trim_bytes: int = 0) -> str:
+    """Drop the first trim_bytes and base64 encode, e.g. the click at the start of Deepgram audio."""
+    return base64.b64encode(memoryview(audio)[trim_bytes:]).decode('utf-8')
+
+
+def to_wav(audio: bytes, source_format: str, sample_rate: int) -> bytes:
+    """Decode compressed audio (mp3, flac, ...) to a WAV resampled to sample_rate."""
+    from .audio_utils import convert_audio_to_wav, resample  # Local import, pydub and torchaudio are heavy
+    return resample(convert_audio_to_wav(audio, source_format), sample_rate, format="wav")
+
+
+# name -> (function, largest input in bytes still run inline on the event loop)
+JOBS: Dict[str, Tuple[Callable, int]] = {
+    "trim_encode": (trim_encode, 256 * 1024),
+    "to_wav": (to_wav, 0),
+}
+
+
+def run_job(job: str, payload: Union[bytes, SharedBuffer], params: dict):
+    """Worker process entry point, reads the input from shared memory and leaves large outputs there."""
+    function, _ = JOBS[job]
+    result = function(SharedBuffer.unwrap(payload, unlink=True), **params)
+    return SharedBuffer.wrap(result) if isinstance(result, bytes) else result
+
+
+class JobStats:
+    __slots__ = ("count", "inline", "errors", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.count = 0
+        self.inline = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "inline": self.inline, "errors": self.errors,
+                "mean_ms": self.total_ms / self.count if self.count else 0.0, "max_ms": self.max_ms}
+
+
+class AudioWorkerPool:
+    """
+    Runs audio jobs in worker processes so CPU bursts do not delay other calls' audio.
+
+    Inputs and outputs above ``SHARED_MEMORY_MIN_BYTES`` are handed over in
+    shared memory, only the segment name is pickled. Jobs whose input is below
+    the job's inline limit run on the event loop, shipping them would cost
+    more than running them.
+
+    Args:
+        workers (int): Worker processes.
+        inline (bool): Whether small jobs may run inline.
+    """
+
+    def __init__(self, workers: int = int(os.getenv("AUDIO_WORKERS", max((os.cpu_count() or 2) // 2, 1))),
+                 inline: bool = os.getenv("AUDIO_INLINE_FAST_PATH", "true") == "true"):
+        self.workers = workers
+        self.inline = inline
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.stats: Dict[str, JobStats] = {}
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def run(self, job: str, audio: bytes, **params):
+        """
+        Run an audio job.
+
+        Args:
+            job (str): A name from ``JOBS``.
+            audio (bytes): The input audio.
+            **params: Keyword arguments of the job function.
+
+        Returns:
+            The job's result, bytes or str.
+        """
+        function, inline_max_bytes = JOBS[job]
+        stats = self.stats.get(job)
+        if stats is None:
+            stats = self.stats[job] = JobStats()
+
+        started = time.perf_counter()
+        try:
+            if self.inline and len(audio) <= inline_max_bytes:
+                stats.inline += 1
+                return function(audio, **params)
+            return await self._submit(job, audio, params)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+
+    async def _submit(self, job: str, audio: bytes, params: dict):
+        payload = SharedBuffer.wrap(audio)
+        future = asyncio.get_running_loop().run_in_executor(self.executor, run_job, job, payload, params)
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker keeps going, whatever it leaves in shared memory is released when it is done
+            future.add_done_callback(lambda done: self._discard(done, payload))
+            raise
+        except Exception:
+            self._release(payload)
+            raise
+        finally:
+            self.queue_depth -= 1
+        return SharedBuffer.unwrap(result, unlink=True)
+
+    def _discard(self, future: asyncio.Future, payload):
+        if future.cancelled() or future.exception() is not None:
+            self._release(payload)
+        else:
+            self._release(future.result())
+
+    @staticmethod
+    def _release(payload):
+        """Unlink a segment nobody will read, it may already be gone."""
+        if isinstance(payload, SharedBuffer):
+            try:
+                SharedBuffer.unwrap(payload, unlink=True)
+            except FileNotFoundError:
+                pass
+
+    def metrics(self) -> Dict:
+        return {"queue_depth": self.queue_depth, "max_queue_depth": self.max_queue_depth,
+                "jobs": {job: stats.as_dict() for job, stats in self.stats.items()}}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_shared_pool: Optional[AudioWorkerPool] = None
+
+
+def shared_audio_pool() -> AudioWorkerPool:
+    """The process wide audio pool, its workers start on the first job that is not run inline."""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = AudioWorkerPool()
+    return _shared_pool
+
+
+def shutdown_audio_pool():
+    """Stop the shared audio pool if it was started."""
+    global _shared_pool
+    if _shared_pool is not None:
+        logger.info(f"Audio pool stats: {_shared_pool.metrics()}")
+        _shared_pool.shutdown()
+        _shared_pool = None
@@ -3,9 +3,9 @@ import copy
 
 import torchaudio
 from pydub import AudioSegment
-from Utils.logger_config import configure_logger
+from Utils.logger_config import basic_logger
 
-logger = configure_logger(__name__)
+logger = basic_logger(__name__)
 
 def convert_audio_to_wav(audio_bytes, source_format='flac'):
     logger.info(f"CONVERTING AUDIO TO WAV {source_format}")
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from Utils.logger_config import basic_logger
+
+logger = basic_logger("BoundedQueue")
+
+'''
+Author: Sean Baker
+Date: 2024-09-22
+Description: Bounded asyncio queue with an explicit overflow policy and high-water metrics for each stage of a call
+'''
+
+# What a full queue does with a new item
+BLOCK = "block"               # The producer waits, pressure travels upstream
+DROP_OLDEST = "drop_oldest"   # The oldest item is discarded, for live audio where new beats old
+DROP_NEWEST = "drop_newest"   # The new item is discarded
+
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class BoundedQueue(asyncio.Queue):
+    """
+    An ``asyncio.Queue`` that never grows past ``maxsize``.
+
+    ``put`` follows the queue's overflow policy: with ``BLOCK`` it waits for
+    room, with the drop policies it returns at once after discarding an item.
+    Blocked puts are served in the order they arrived. A plain queue lets a
+    new put take the room a get just made for a waiting one, so a producer
+    can be overtaken again and again, e.g. one TTS worker's sentence played
+    long after the sentences after it. ``offer`` is the non-async counterpart for the drop
+    policies, for callers that must not wait (e.g. the websocket reader).
+
+    Args:
+        maxsize (int): Items the queue holds at most, must be positive.
+        policy (str): ``BLOCK``, ``DROP_OLDEST`` or ``DROP_NEWEST``.
+        name (str): Stage name used in logs and metrics.
+
+    Attributes:
+        high_water (int): Most items the queue has held at once.
+        dropped (int): Items discarded by the overflow policy.
+        blocked (int): Puts that had to wait for room.
+        blocked_seconds (float): Time producers spent waiting for room.
+    """
+
+    def __init__(self, maxsize: int, policy: str = BLOCK, name: str = "queue"):
+        if maxsize <= 0:
+            raise ValueError(f"{name}: a bounded queue needs a positive maxsize, got {maxsize}")
+        if policy not in POLICIES:
+            raise ValueError(f"{name}: unknown overflow policy {policy!r}")
+        super().__init__(maxsize=maxsize)
+        self.policy = policy
+        self.name = name
+        self.high_water = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self._put_lock = asyncio.Lock()
+
+    def _put(self, item):
+        super()._put(item)
+        if self.qsize() > self.high_water:
+            self.high_water = self.qsize()
+
+    def offer(self, item: Any) -> bool:
+        """
+        Add an item without waiting, applying the overflow policy if the queue is full.
+
+        Returns:
+            bool: False if the item itself was dropped.
+
+        Raises:
+            asyncio.QueueFull: If the queue is full and its policy is ``BLOCK``.
+        """
+        if self.full():
+            if self.dropped == 0 and self.policy != BLOCK:
+                logger.warning(f"{self.name} queue is full, applying {self.policy}")
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.policy == DROP_OLDEST:
+                self.get_nowait()
+                self.dropped += 1
+        self.put_nowait(item)
+        return True
+
+    async def put(self, item: Any):
+        if self.policy != BLOCK:
+            self.offer(item)
+            return
+        if not self.full() and not self._put_lock.locked():
+            self.put_nowait(item)
+            return
+        self.blocked += 1
+        started = time.perf_counter()
+        try:
+            # Only the first waiting producer waits for room, the others wait their turn behind it
+            async with self._put_lock:
+                await super().put(item)
+        finally:
+            self.blocked_seconds += time.perf_counter() - started
+
+    def drain(self) -> List[Any]:
+        """Remove and return every queued item."""
+        items = []
+        while not self.empty():
+            items.append(self.get_nowait())
+        return items
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"size": self.qsize(), "maxsize": self.maxsize, "policy": self.policy,
+                "high_water": self.high_water, "dropped": self.dropped, "blocked": self.blocked,
+                "blocked_ms": round(self.blocked_seconds * 1000, 1)}
@@ -0,0 +1,123 @@
+import asyncio
+from collections import deque
+from typing import Set
+
+from Utils.logger_config import basic_logger
+
+logger = basic_logger("MarkTracker")
+'''
+Author: Sean Baker
+Date: 2024-09-03
+Description: Tracks Twilio marks so actions like hang up or transfer can wait for audio to actually finish playing
+'''
+
+
+class MarkTracker:
+    """
+    Tracks the marks sent after each audio chunk until Twilio acknowledges them.
+
+    Twilio echoes a mark back once the audio queued before it has been played
+    (or cleared), so an empty tracker means the caller has heard everything we
+    sent. Tasks that are still producing audio (e.g. a tool preamble that is
+    being synthesized) can be tracked as well, so waiting also covers audio that
+    has not been sent yet. Replies queued in the call's TTS pipeline are counted
+    with ``hold``/``release`` for the same reason.
+
+    Attributes:
+        _outstanding (deque): Mark labels sent but not yet acknowledged, in send order.
+        _seconds (dict): Audio duration sent before each outstanding mark.
+        _producers (Set[asyncio.Task]): Tasks that will send more audio.
+        _held (int): Replies in the TTS pipeline whose audio has not been sent yet.
+    """
+
+    def __init__(self):
+        self._outstanding = deque()
+        self._seconds = {}
+        self._producers: Set[asyncio.Task] = set()
+        self._held = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    def __len__(self):
+        return len(self._outstanding)
+
+    def __contains__(self, label: str):
+        return label in self._outstanding
+
+    @property
+    def busy(self) -> bool:
+        """Whether audio is playing or still on its way to Twilio."""
+        return bool(self._outstanding) or self._held > 0
+
+    @property
+    def pending_audio_seconds(self) -> float:
+        """Seconds of audio sent to Twilio that have not been played yet."""
+        return sum(self._seconds.values())
+
+    def sent(self, label: str, seconds: float = 0.0):
+        """
+        Record a mark that was sent after an audio chunk.
+
+        Args:
+            label (str): The mark label.
+            seconds (float): Duration of the audio chunk the mark follows.
+        """
+        self._outstanding.append(label)
+        self._seconds[label] = seconds
+        self._drained.clear()
+
+    def acknowledged(self, label: str):
+        """
+        Record a mark echoed back by Twilio.
+
+        Args:
+            label (str): The mark label.
+        """
+        if label in self._outstanding:
+            self._outstanding.remove(label)
+            self._seconds.pop(label, None)
+        self._check_drained()
+
+    def hold(self):
+        """A reply entered the TTS pipeline, its audio will follow."""
+        self._held += 1
+        self._drained.clear()
+
+    def release(self):
+        """A held reply's audio has been sent, or the reply was dropped."""
+        self._held = max(self._held - 1, 0)
+        self._check_drained()
+
+    def _check_drained(self):
+        if not self._outstanding and not self._held:
+            self._drained.set()
+
+    def track(self, task: asyncio.Task):
+        """
+        Track a task that will send audio, waiters also wait for it to finish.
+
+        Args:
+            task (asyncio.Task): The task producing audio.
+        """
+        self._producers.add(task)
+        task.add_done_callback(self._producers.discard)
+
+    async def wait_until_played(self, timeout: float = 10.0) -> bool:
+        """
+        Wait until all tracked audio has been sent and every mark acknowledged.
+
+        Args:
+            timeout (float): Maximum seconds to wait.
+
+        Returns:
+            bool: True if playback finished, False if the timeout was hit.
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                while self._producers:
+                    await asyncio.gather(*list(self._producers), return_exceptions=True)
+                await self._drained.wait()
+            return True
+        except TimeoutError:
+            logger.warning(f"Playback not acknowledged after {timeout}s, {len(self._outstanding)} marks outstanding")
+            return False
@@ -3,10 +3,10 @@ from typing import Dict
 
 from fastapi import WebSocket
 
-from Utils.logger_config import configure_logger
+from Utils.logger_config import basic_logger
 from EventHandlers.event_manager import EventHandler
 
-logger = configure_logger("Stream")
+logger = basic_logger("Stream")
 '''
 Author: Sean Baker
 Date: 2024-07-22 
@@ -16,22 +16,31 @@ class StreamService(EventHandler):
     """
     A class that handles streaming audio data over a WebSocket connection.
 
+    Out of order chunks wait in ``audio_buffer`` for the chunks before them.
+    The buffer holds at most ``max_buffered`` chunks: if a chunk never arrives
+    (its TTS request failed) the gap is skipped once the buffer is full, instead
+    of holding every later chunk of the call.
+
     Args:
         websocket (WebSocket): The WebSocket connection to use for streaming.
+        max_buffered (int): Out of order chunks held at most.
 
     Attributes:
         ws (WebSocket): The WebSocket connection.
         expected_audio_index (int): The expected index of the next audio chunk.
         audio_buffer (Dict[int, str]): A dictionary to store buffered audio chunks.
         stream_sid (str): The stream session ID.
+        buffer_stats (Dict[str, int]): High-water mark of the buffer, skipped indexes and late chunks dropped.
 
     """
 
-    def __init__(self, websocket: WebSocket):
+    def __init__(self, websocket: WebSocket, max_buffered: int = 32):
         super().__init__()
         self.ws = websocket
         self.expected_audio_index = 0
         self.audio_buffer: Dict[int, str] = {}
+        self.max_buffered = max_buffered
+        self.buffer_stats = {"high_water": 0, "skipped": 0, "late": 0}
         self.stream_sid = ''
 
     def set_stream_sid(self, stream_sid: str):
@@ -51,6 +60,7 @@ class StreamService(EventHandler):
         If the index is None, the audio chunk is sent immediately.
         If the index matches the expected index, the audio chunk is sent and the expected index is incremented.
         If the index does not match the expected index, the audio chunk is buffered.
+        A chunk for an index that was already played or skipped is dropped.
 
         Args:
             index (int): The index of the audio chunk.
@@ -62,14 +72,26 @@ class StreamService(EventHandler):
         elif index == self.expected_audio_index:
             await self.send_audio(audio)
             self.expected_audio_index += 1
-
-            while self.expected_audio_index in self.audio_buffer:
-                buffered_audio = self.audio_buffer[self.expected_audio_index]
-                await self.send_audio(buffered_audio)
-                del self.audio_buffer[self.expected_audio_index]
-                self.expected_audio_index += 1
+            await self._flush()
+        elif index < self.expected_audio_index:
+            self.buffer_stats["late"] += 1
         else:
             self.audio_buffer[index] = audio
+            self.buffer_stats["high_water"] = max(self.buffer_stats["high_water"], len(self.audio_buffer))
+            if len(self.audio_buffer) > self.max_buffered:
+                # The expected chunk is not coming, play on from the oldest one we have
+                next_index = min(self.audio_buffer)
+                logger.warning(f"Audio chunks {self.expected_audio_index}-{next_index - 1} never arrived, skipping")
+                self.buffer_stats["skipped"] += next_index - self.expected_audio_index
+                self.expected_audio_index = next_index
+                await self._flush()
+
+    async def _flush(self):
+        """Send the buffered chunks that follow on from the expected index."""
+        while self.expected_audio_index in self.audio_buffer:
+            buffered_audio = self.audio_buffer.pop(self.expected_audio_index)
+            await self.send_audio(buffered_audio)
+            self.expected_audio_index += 1
 
     def reset(self):
         """
@@ -105,4 +127,6 @@ class StreamService(EventHandler):
             }
         })
 
-        await self.createEvent('audiosent', mark_label)
\ No newline at end of file
+        # 8 kHz mu-law, one byte per sample
+        seconds = (len(audio) * 3 // 4 - audio[-2:].count('=')) / 8000
+        await self.createEvent('audiosent', mark_label, seconds)
\ No newline at end of file
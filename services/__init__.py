@@ -1,5 +1,8 @@
 from .call_details import CallContext
+from .call_store import AbstractCallStore, CallStoreFactory, MemoryCallStore, SQLiteCallStore, RedisCallStore
 from .openai_service import OpenAIService
 from .google_bard import GeminiService
 from .openai_assistant import AssistantService
 from .gpt_service import AbstractLLMService, LLMFactory
+from .call_prewarm import CallPrewarmRegistry
+from .call_session import CallSession
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from openai import BaseModel
 
@@ -16,3 +16,24 @@ class CallContext:
         self.start_time: Optional[str] = None
         self.end_time: Optional[str] = None
         self.final_status: Optional[str] = None
+        self.to_number: Optional[str] = None
+        self.from_number: Optional[str] = None
+        # Runtime only, set by the media stream so tools can wait for audio to finish playing
+        self.mark_tracker = None
+
+    # Fields shared through the call store, runtime objects like the mark tracker stay on the worker
+    SERIALIZED_FIELDS = ("stream_sid", "call_sid", "call_ended", "user_context", "system_message", "initial_message",
+                         "start_time", "end_time", "final_status", "to_number", "from_number")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The context as plain data."""
+        return {field: getattr(self, field) for field in self.SERIALIZED_FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CallContext":
+        """Build a context from ``to_dict`` output, unknown keys are ignored."""
+        context = cls()
+        for field in cls.SERIALIZED_FIELDS:
+            if field in data:
+                setattr(context, field, data[field])
+        return context
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from Utils import basic_logger
+
+logger = basic_logger("Prewarm")
+
+'''
+Author: Sean Baker
+Date: 2024-09-10
+Description: Pre-warms STT, LLM and the greeting audio between /incoming (or /start_call) and the media stream start
+'''
+
+
+class PreparedCall:
+    """
+    Resources prepared for a call before its media stream starts.
+
+    Attributes:
+        call_sid (str): The Twilio call SID.
+        stt_connection (Optional[asyncio.Task]): Resolves to a started STT connection.
+        greeting (Optional[asyncio.Task]): Resolves to the base64 greeting audio.
+        greeting_text (Optional[str]): The text the greeting was rendered from.
+        llm_warm_up (Optional[asyncio.Task]): Warms the LLM client's connection pool.
+        customer_number (Optional[str]): The caller on inbound calls, the callee on outbound ones.
+        profile (Optional[asyncio.Task]): Resolves to the customer's profile.
+        expires_at (float): Monotonic time after which an unclaimed entry is released.
+    """
+
+    def __init__(self, call_sid: str, expires_at: float):
+        self.call_sid = call_sid
+        self.stt_connection: Optional[asyncio.Task] = None
+        self.greeting: Optional[asyncio.Task] = None
+        self.greeting_text: Optional[str] = None
+        self.llm_warm_up: Optional[asyncio.Task] = None
+        self.customer_number: Optional[str] = None
+        self.profile: Optional[asyncio.Task] = None
+        self.expires_at = expires_at
+
+    async def take_stt_connection(self):
+        """Returns the prepared STT connection, or None if it is missing or failed."""
+        if self.stt_connection is None:
+            return None
+        try:
+            return await self.stt_connection
+        except Exception as e:
+            logger.error(f"Prepared STT connection for {self.call_sid} failed: {e}")
+            return None
+
+    async def take_greeting(self, timeout: float = 1.0) -> Optional[str]:
+        """Returns the prepared greeting audio if it is ready within the timeout."""
+        if self.greeting is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.greeting), timeout)
+        except Exception as e:
+            logger.info(f"Prepared greeting for {self.call_sid} not used: {e!r}")
+            return None
+
+    async def take_profile(self, timeout: float = 0.5) -> Optional[dict]:
+        """Returns the customer's profile if it is ready within the timeout."""
+        if self.profile is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.profile), timeout)
+        except Exception as e:
+            logger.info(f"Caller profile for {self.call_sid} not used: {e!r}")
+            return None
+
+    async def release(self):
+        """Cancel pending work and close anything that was prepared but never claimed."""
+        for task in (self.greeting, self.llm_warm_up, self.profile):
+            if task is not None and not task.done():
+                task.cancel()
+        connection = await self.take_stt_connection() if self.stt_connection is not None else None
+        if connection is not None:
+            await connection.finish()
+
+
+class CallPrewarmRegistry:
+    """
+    Prepared call resources keyed by CallSid.
+
+    ``/incoming`` and ``/start_call`` call ``prepare`` so the STT connection,
+    the LLM client, the greeting audio and the customer's profile are set up
+    while Twilio is still opening the media stream. The websocket handler ``claim``s them on ``start``.
+    Entries that are never claimed are released after their TTL.
+
+    Args:
+        stt_connect (Callable): Coroutine function returning a started STT connection.
+        render_greeting (Callable): Coroutine function rendering text to base64 audio.
+        llm_warm_up (Callable): Coroutine function warming the LLM client.
+        load_profile (Optional[Callable]): Coroutine function returning the profile of a phone number.
+        ttl (float): Seconds an unclaimed entry is kept.
+    """
+
+    def __init__(self, stt_connect: Callable[[], Awaitable], render_greeting: Callable[[str], Awaitable],
+                 llm_warm_up: Callable[[], Awaitable], load_profile: Optional[Callable[[str], Awaitable]] = None,
+                 ttl: float = 30.0):
+        self.stt_connect = stt_connect
+        self.render_greeting = render_greeting
+        self.llm_warm_up = llm_warm_up
+        self.load_profile = load_profile
+        self.ttl = ttl
+        self._calls: Dict[str, PreparedCall] = {}
+        # Releases of expired entries, referenced until they finish so they are not garbage collected midway
+        self._releasing: Set[asyncio.Task] = set()
+        self.metrics = {"prepared": 0, "claimed": 0, "expired": 0}
+
+    def prepare(self, call_sid: str, initial_message: Optional[str] = None, stt: bool = True,
+                ttl: Optional[float] = None, customer_number: Optional[str] = None) -> PreparedCall:
+        """
+        Start preparing resources for a call, parts that are already prepared are kept.
+
+        Args:
+            call_sid (str): The Twilio call SID.
+            initial_message (Optional[str]): The greeting to render.
+            stt (bool): Whether to open the STT connection now. Outbound calls skip this at
+                ``/start_call`` because the callee may take a while to answer.
+            ttl (Optional[float]): Seconds to keep the entry if it is not claimed.
+            customer_number (Optional[str]): Whose profile to load, the caller or the callee.
+
+        Returns:
+            PreparedCall: The entry for the call.
+        """
+        self._expire()
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        prepared = self._calls.get(call_sid)
+        if prepared is None:
+            prepared = self._calls[call_sid] = PreparedCall(call_sid, expires_at)
+            self.metrics["prepared"] += 1
+        prepared.expires_at = max(prepared.expires_at, expires_at)
+
+        if stt and prepared.stt_connection is None:
+            prepared.stt_connection = asyncio.create_task(self.stt_connect())
+        if initial_message and prepared.greeting_text != initial_message:
+            prepared.greeting_text = initial_message
+            prepared.greeting = asyncio.create_task(self.render_greeting(initial_message))
+        if prepared.llm_warm_up is None:
+            prepared.llm_warm_up = asyncio.create_task(self.llm_warm_up())
+        if customer_number and self.load_profile is not None and prepared.customer_number != customer_number:
+            prepared.customer_number = customer_number
+            prepared.profile = asyncio.create_task(self.load_profile(customer_number))
+        return prepared
+
+    def claim(self, call_sid: str) -> Optional[PreparedCall]:
+        """
+        Take the prepared resources for a call.
+
+        Args:
+            call_sid (str): The Twilio call SID.
+
+        Returns:
+            Optional[PreparedCall]: The prepared call, or None if nothing was prepared.
+        """
+        prepared = self._calls.pop(call_sid, None)
+        if prepared is not None:
+            self.metrics["claimed"] += 1
+        self._expire()
+        return prepared
+
+    def _expire(self):
+        now = time.monotonic()
+        for call_sid in [sid for sid, prepared in self._calls.items() if prepared.expires_at < now]:
+            self.metrics["expired"] += 1
+            task = asyncio.create_task(self._calls.pop(call_sid).release())
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+
+    async def close(self):
+        """Release every unclaimed entry, and wait for releases of expired ones."""
+        calls, self._calls = list(self._calls.values()), {}
+        await asyncio.gather(*(prepared.release() for prepared in calls), *self._releasing, return_exceptions=True)
@@ -0,0 +1,438 @@
+import asyncio
+import base64
+import contextvars
+import json
+import os
+import time
+from datetime import datetime
+from enum import Enum
+from typing import Awaitable, Callable, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from networking import BLOCK, DROP_OLDEST, BoundedQueue, MarkTracker, StreamService
+from speach_to_text.interim_stabilizer import InterimStabilizer, estimate_tokens
+from Utils import basic_logger
+from .call_details import CallContext
+from .caller_profile import personalize
+from .capacity import CapacityManager
+from .call_store import AbstractCallStore, MemoryCallStore
+
+logger = basic_logger("CallSession")
+
+# Interruption epoch of the reply a TTS worker is rendering, audio from before a barge-in is dropped
+current_epoch: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_epoch", default=None)
+# Queued on the outbound stage after a reply's audio, releases the reply's hold on the mark tracker
+RELEASE = object()
+
+'''
+Author: Sean Baker
+Date: 2024-09-16
+Description: One object per media stream, owns the STT/LLM/TTS services and every task of the call
+'''
+
+
+class SessionState(Enum):
+    CREATED = "created"
+    STARTING = "starting"
+    ACTIVE = "active"
+    CLOSING = "closing"
+    CLOSED = "closed"
+
+
+class SessionEnded(Exception):
+    """Raised inside the session's task group to end the call."""
+
+
+class CallSession:
+    """
+    A Twilio media stream and the services that answer it.
+
+    All work runs in one TaskGroup: the websocket reader, the audio feed into
+    STT, the barge-in check on interim transcripts, the turn responder, a small
+    pool of TTS workers and the sender that writes audio to Twilio. Stages are
+    connected by ``BoundedQueue``s, each with an overflow policy, so a stalled
+    stage never grows memory: inbound audio and interims drop the oldest item
+    (new speech matters more than old), turns, replies and outbound audio
+    block and push back on the stage before them. The LLM keeps reading
+    tokens while earlier sentences are synthesized. TTS workers render
+    sentences in parallel, ``StreamService`` puts them back in order by their
+    response index. When the socket drops, Twilio sends ``stop`` or any stage
+    fails, the group is cancelled and ``close`` releases STT, TTS and the LLM
+    state exactly once.
+
+    Args:
+        websocket (WebSocket): The accepted media stream websocket.
+        llm_service: The LLM service for the call.
+        stt_service: The STT service for the call.
+        tts_service: The TTS service for the call.
+        call_store (AbstractCallStore): Shared call state, holds the contexts of calls started from the UI
+            and receives a snapshot of this call's context after every turn.
+        database (Optional[DatabaseManager]): Persists the call and appends each turn to its transcript.
+        prewarm: Registry holding resources prepared by /incoming and /start_call.
+        stt_connect (Optional[Callable]): Returns a started STT connection when nothing was prepared.
+        twilio_client (Optional[Callable]): Returns the shared async Twilio client, used to start recordings.
+        capacity (Optional[CapacityManager]): The worker's capacity manager, counts the session and its
+            STT stream, LLM completions and TTS requests.
+        media_queue_size (int): Inbound audio frames buffered for STT, 20 ms each.
+        interim_queue_size (int): Interim transcripts waiting for the barge-in check.
+        turn_queue_size (int): Final transcripts waiting for the LLM.
+        tts_workers (int): Sentences synthesized at the same time.
+        reply_queue_size (int): LLM sentences waiting for a TTS worker, a full queue pauses the LLM.
+        outbound_queue_size (int): Audio chunks waiting to be sent to Twilio.
+        reorder_buffer_size (int): Out of order audio chunks held until the ones before them are sent.
+        profile_wait (float): Seconds the first LLM turn waits for a caller profile still being looked up.
+    """
+
+    def __init__(self, websocket: WebSocket, llm_service, stt_service, tts_service,
+                 call_store: Optional[AbstractCallStore] = None, database=None, prewarm=None,
+                 stt_connect: Optional[Callable[[], Awaitable]] = None,
+                 twilio_client: Optional[Callable] = None, capacity: Optional[CapacityManager] = None,
+                 media_queue_size: int = 250, interim_queue_size: int = 1, turn_queue_size: int = 8,
+                 tts_workers: int = int(os.getenv("TTS_WORKERS", 3)), reply_queue_size: int = 16,
+                 outbound_queue_size: int = 64, reorder_buffer_size: int = 32,
+                 profile_wait: float = float(os.getenv("CALLER_PROFILE_WAIT", 0.5))):
+        self.websocket = websocket
+        self.llm_service = llm_service
+        self.stt_service = stt_service
+        self.tts_service = tts_service
+        self.stream_service = StreamService(websocket, max_buffered=reorder_buffer_size)
+        self.call_store = call_store if call_store is not None else MemoryCallStore()
+        self.database = database
+        self.prewarm = prewarm
+        self.stt_connect = stt_connect
+        self.twilio_client = twilio_client
+        self.capacity = capacity if capacity is not None else CapacityManager()
+
+        self.state = SessionState.CREATED
+        self.stream_sid: Optional[str] = None
+        self.call_sid: Optional[str] = None
+        self.call_context: Optional[CallContext] = None
+        self.marks = MarkTracker()
+        self.barge_in = InterimStabilizer(min_stable_words=int(os.getenv("BARGE_IN_MIN_WORDS", 2)),
+                                          min_stable_ms=float(os.getenv("BARGE_IN_STABLE_MS", 250)))
+        self.interaction_count = 0
+        # Tokens of the reply currently being spoken, thrown away and regenerated if the caller interrupts it
+        self.reply_tokens = 0
+
+        self.media = BoundedQueue(media_queue_size, DROP_OLDEST, "media")
+        self.interims = BoundedQueue(interim_queue_size, DROP_OLDEST, "interims")
+        self.turns = BoundedQueue(turn_queue_size, BLOCK, "turns")
+        self.replies = BoundedQueue(reply_queue_size, BLOCK, "replies")
+        self.outbound = BoundedQueue(outbound_queue_size, BLOCK, "outbound")
+        self.tts_workers = max(tts_workers, 1)
+        # Bumped on every interruption, replies rendered for an older epoch are not played
+        self._epoch = 0
+        self.started = asyncio.Event()
+        self._task_group: Optional[asyncio.TaskGroup] = None
+        self._counted = False
+        self.profile_wait = profile_wait
+        self._pending_profile = None
+
+        self.stt_service.on('utterance', self.handle_utterance)
+        self.stt_service.on('transcription', self.handle_transcription)
+        self.llm_service.on('llmreply', self.handle_llm_reply)
+        self.tts_service.on('speech', self.handle_speech)
+        self.stream_service.on('audiosent', self.handle_audio_sent)
+
+    async def run(self):
+        """Serve the media stream until it ends, then tear everything down."""
+        self.state = SessionState.STARTING
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                self._task_group = task_group
+                task_group.create_task(self._receive())
+                task_group.create_task(self._transcribe())
+                task_group.create_task(self._watch_interims())
+                task_group.create_task(self._respond())
+                for _ in range(self.tts_workers):
+                    task_group.create_task(self._synthesize())
+                task_group.create_task(self._stream())
+        except* SessionEnded:
+            pass
+        except* Exception as errors:
+            for error in errors.exceptions:
+                logger.error(f"Call session {self.stream_sid} failed: {error!r}")
+        finally:
+            self._task_group = None
+            await self.close()
+
+    def spawn(self, coroutine) -> asyncio.Task:
+        """Run a coroutine as part of the session, it is cancelled when the call ends."""
+        if self._task_group is None:
+            coroutine.close()
+            raise RuntimeError("Call session is not running")
+        return self._task_group.create_task(coroutine)
+
+    async def _receive(self):
+        try:
+            while True:
+                msg = json.loads(await self.websocket.receive_text())
+                event = msg.get('event')
+                if event == 'media':
+                    # STT fell behind if the queue is full, old audio is worth less than new audio
+                    self.media.offer(msg['media']['payload'])
+                elif event == 'mark':
+                    self.marks.acknowledged(msg['mark']['name'])
+                elif event == 'start':
+                    self.spawn(self._start(msg['start']))
+                elif event == 'stop':
+                    logger.info(f"Twilio -> Media stream {self.stream_sid} ended.")
+                    raise SessionEnded()
+        except WebSocketDisconnect:
+            logger.info("WebSocket disconnected")
+            raise SessionEnded()
+
+    async def _transcribe(self):
+        await self.started.wait()
+        while True:
+            payload = await self.media.get()
+            await self.stt_service.send(base64.b64decode(payload))
+
+    async def _respond(self):
+        while True:
+            text = await self.turns.get()
+            started = time.perf_counter()
+            await self._personalize()
+            if os.getenv("INTENT_FAST_PATH", "true") == "true" and \
+                    await self.llm_service.fast_path(text, self.interaction_count):
+                logger.info(f"Interaction {self.interaction_count} – STT -> fast path: {text}")
+            else:
+                logger.info(f"Interaction {self.interaction_count} – STT -> LLM: {text}")
+                with self.capacity.provider("llm"):
+                    await self.llm_service.completion(text, self.interaction_count)
+            self.interaction_count += 1
+            await self.save_context(latency_ms=(time.perf_counter() - started) * 1000)
+
+    async def _personalize(self):
+        """Merge the caller's prefetched profile into the system message, once."""
+        prepared, self._pending_profile = self._pending_profile, None
+        if prepared is None:
+            return
+        started = time.perf_counter()
+        profile = await prepared.take_profile(timeout=self.profile_wait)
+        self.call_context.system_message = personalize(self.call_context.system_message, profile)
+        self.llm_service.system_message = self.call_context.system_message
+        logger.info(f"Caller profile of {self.call_sid} {'merged' if profile else 'not found'}, "
+                    f"waited {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    async def _synthesize(self):
+        while True:
+            llm_reply, icount, epoch = await self.replies.get()
+            current_epoch.set(epoch)
+            try:
+                if epoch == self._epoch:
+                    with self.capacity.provider("tts"):
+                        await self.tts_service.generate(llm_reply, icount)
+            except Exception as e:
+                logger.error(f"Interaction {icount}: TTS failed: {e!r}")
+            finally:
+                await self.outbound.put(RELEASE)
+
+    async def _stream(self):
+        while True:
+            item = await self.outbound.get()
+            if item is RELEASE:
+                self.marks.release()
+                continue
+            epoch, response_index, audio = item
+            if epoch is not None and epoch != self._epoch:
+                # Rendered before an interruption
+                continue
+            await self.stream_service.buffer(response_index, audio)
+
+    async def _start(self, start: dict):
+        self.stream_sid = start['streamSid']
+        self.call_sid = call_sid = start['callSid']
+        # The call's admission reservation becomes a live session, its STT stream stays open until close
+        self.capacity.session_started(call_sid)
+        self.capacity.acquire("stt")
+        self._counted = True
+
+        if os.getenv("RECORD_CALLS") == "true" and self.twilio_client is not None:
+            self.spawn(self._record(call_sid))
+
+        # Adopt whatever /incoming or /start_call prepared for this call
+        prepared = self.prewarm.claim(call_sid) if self.prewarm is not None else None
+
+        # Decide if the call the call was initiated from the UI or is an inbound
+        call_context = await self.call_store.get(call_sid)
+        if call_context is None:
+            # Inbound call
+            call_context = CallContext()
+            call_context.system_message = os.environ.get("SYSTEM_MESSAGE")
+            call_context.initial_message = os.environ.get("INITIAL_MESSAGE")
+            call_context.call_sid = call_sid
+            call_context.from_number = prepared.customer_number if prepared else None
+        call_context.stream_sid = self.stream_sid
+        call_context.mark_tracker = self.marks
+        if not call_context.start_time:
+            call_context.start_time = datetime.utcnow().isoformat()
+        self.call_context = call_context
+        self.llm_service.set_call_context(call_context)
+        await self.save_context()
+        # Merged into the system message before the first LLM turn, the lookup started at /incoming
+        self._pending_profile = prepared if prepared is not None and prepared.profile is not None else None
+
+        # The greeting plays while STT connects, the caller's audio waits in the media queue until it is up
+        self.stream_service.set_stream_sid(self.stream_sid)
+        self.spawn(self._greet(call_context.initial_message, prepared))
+
+        connection = await prepared.take_stt_connection() if prepared else None
+        if connection is None and self.stt_connect is not None:
+            connection = await self.stt_connect()
+        await self.stt_service.connect(connection)
+        self.stt_service.set_stream_sid(self.stream_sid)
+        self.state = SessionState.ACTIVE
+        self.started.set()
+
+        logger.info(f"Twilio -> Starting Media Stream for {self.stream_sid}")
+        # Render tool preambles while the greeting plays so fast path replies skip TTS
+        self.spawn(self.tts_service.prerender(self.llm_service.intent_router.prerender_phrases()))
+
+    async def _greet(self, initial_message: Optional[str], prepared):
+        self.marks.hold()
+        try:
+            if prepared and prepared.greeting_text == initial_message:
+                greeting = await prepared.take_greeting()
+                if greeting:
+                    self.tts_service.phrase_cache[initial_message] = greeting
+            await self.tts_service.generate({
+                "partialResponseIndex": None,
+                "partialResponse": initial_message
+            }, 1)
+        finally:
+            await self.outbound.put(RELEASE)
+
+    async def save_context(self, latency_ms: Optional[float] = None):
+        """
+        Write the call's context to the call store so other workers see the latest transcript.
+
+        The database write is queued and batched with other calls', the session does not wait for it.
+
+        Args:
+            latency_ms (Optional[float]): How long the last reply took, stored with its transcript turns.
+        """
+        if self.call_context is None:
+            return
+        if self.database is not None:
+            try:
+                self.database.save_call_context(self.call_context, latency_ms=latency_ms)
+            except Exception as e:
+                logger.error(f"Error queuing the database write for {self.call_sid}: {e!r}")
+        try:
+            await self.call_store.put(self.call_context)
+        except Exception as e:
+            logger.error(f"Error saving call state for {self.call_sid}: {e!r}")
+
+    async def _record(self, call_sid: str):
+        try:
+            await self.twilio_client().calls(call_sid).recordings.create_async(recording_channels="dual")
+        except Exception as e:
+            logger.error(f"Error starting the recording of {call_sid}: {e!r}")
+
+    async def interrupt(self):
+        """Clear the audio Twilio is still playing and drop the reply in progress."""
+        logger.info("Intruption detected, clearing system.")
+        await self.websocket.send_json({
+            "streamSid": self.stream_sid,
+            "event": "clear"
+        })
+
+        # Replies queued or rendering for the old epoch are dropped, their holds released
+        self._epoch += 1
+        for _ in self.replies.drain():
+            self.marks.release()
+        for item in self.outbound.drain():
+            if item is RELEASE:
+                self.marks.release()
+
+        # reset states
+        self.stream_service.reset()
+        self.llm_service.reset()
+
+    async def handle_transcription(self, text):
+        if not text:
+            return
+        if self.marks.busy:
+            if self.barge_in.should_interrupt(text, playing=True,
+                                              pending_audio_seconds=self.marks.pending_audio_seconds,
+                                              pending_tokens=self.reply_tokens, final=True):
+                await self.interrupt()
+            elif self.barge_in.is_backchannel(text):
+                logger.info(f"Backchannel while speaking, not answering: {text}")
+                self.barge_in.reset()
+                return
+        self.barge_in.reset()
+        self.reply_tokens = 0
+        # Waits while the LLM is behind, which holds up STT's events rather than dropping what the caller said
+        await self.turns.put(text)
+
+    async def handle_utterance(self, text, stream_sid):
+        # Only the latest interim matters, older ones still queued are replaced
+        if text.strip():
+            self.interims.offer(text)
+
+    async def _watch_interims(self):
+        while True:
+            text = await self.interims.get()
+            try:
+                # Only clear the audio once the interim words are stable and not just a backchannel
+                if self.barge_in.should_interrupt(text, playing=self.marks.busy,
+                                                  pending_audio_seconds=self.marks.pending_audio_seconds,
+                                                  pending_tokens=self.reply_tokens):
+                    await self.interrupt()
+            except Exception as e:
+                logger.error(f"Error while handling utterance: {e}")
+
+    async def handle_llm_reply(self, llm_reply, icount):
+        self.reply_tokens += estimate_tokens(llm_reply['partialResponse'] or "")
+        logger.info(f"Interaction {icount}: LLM -> TTS: {llm_reply['partialResponse']}")
+        self.marks.hold()
+        await self.replies.put((llm_reply, icount, self._epoch))
+
+    async def handle_speech(self, response_index, audio, label, icount):
+        logger.info(f"Interaction {icount}: TTS -> TWILIO: {label}")
+        await self.outbound.put((current_epoch.get(), response_index, audio))
+
+    def handle_audio_sent(self, mark_label, seconds=0.0):
+        self.marks.sent(mark_label, seconds)
+
+    def buffer_metrics(self) -> dict:
+        """Size, high-water mark and drops of every stage of the call."""
+        metrics = {queue.name: queue.metrics() for queue in
+                   (self.media, self.interims, self.turns, self.replies, self.outbound)}
+        metrics["reorder"] = dict(self.stream_service.buffer_stats, size=len(self.stream_service.audio_buffer),
+                                  maxsize=self.stream_service.max_buffered)
+        return metrics
+
+    async def close(self):
+        """Release the call's services, safe to call more than once."""
+        if self.state in (SessionState.CLOSING, SessionState.CLOSED):
+            return
+        self.state = SessionState.CLOSING
+        self.barge_in.reset()
+        logger.info(f"Barge-in stats: {self.barge_in.metrics}")
+        logger.info(f"Stage buffers of {self.stream_sid}: {self.buffer_metrics()}")
+
+        results = await asyncio.gather(self.stt_service.disconnect(), self.tts_service.disconnect(),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error releasing call {self.stream_sid}: {result!r}")
+        self.llm_service.reset()
+        if self._counted:
+            self.capacity.release("stt")
+            self.capacity.session_ended()
+            self._counted = False
+        if self.call_context is not None:
+            self.call_context.mark_tracker = None
+            self.call_context.call_ended = True
+            self.call_context.end_time = datetime.utcnow().isoformat()
+            await self.save_context()
+
+        # Drop the callbacks so the services no longer reference this session
+        for service in (self.stt_service, self.llm_service, self.tts_service, self.stream_service):
+            service.off()
+            await service.cancel_background()
+        self.state = SessionState.CLOSED
@@ -0,0 +1,474 @@
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from EventHandlers import EventHandler
+from Utils import basic_logger
+from .call_details import CallContext
+
+logger = basic_logger("CallStore")
+
+'''
+Author: Sean Baker
+Date: 2024-09-18
+Description: Call state shared by every worker and node of a deployment, in process, SQLite or Redis
+'''
+
+
+class CallStoreError(Exception):
+    """Raised when the call state backend fails or answers with an error."""
+
+
+class AbstractCallStore(EventHandler, ABC):
+    """
+    Snapshots of ``CallContext`` keyed by CallSid.
+
+    The websocket, REST routes and tools of a call may run on different
+    workers, so contexts are stored as serialized snapshots and every read
+    returns a fresh copy. Writers ``put`` after every turn. A ``callchanged``
+    event with the CallSid is emitted for every write, including writes made
+    by other workers once ``start`` has begun watching the backend.
+    """
+
+    async def start(self):
+        """Open the backend and start watching for changes made elsewhere."""
+
+    async def close(self):
+        """Stop watching and release the backend."""
+
+    @abstractmethod
+    async def get(self, call_sid: str) -> Optional[CallContext]:
+        """Returns a copy of the call's context, or None if the call is unknown."""
+
+    @abstractmethod
+    async def put(self, context: CallContext):
+        """Store a snapshot of the context under its CallSid."""
+
+    @abstractmethod
+    async def delete(self, call_sid: str):
+        """Forget a call."""
+
+    @abstractmethod
+    async def all(self) -> List[CallContext]:
+        """Returns copies of every stored context."""
+
+    @staticmethod
+    def _dumps(context: CallContext) -> str:
+        if not context.call_sid:
+            raise ValueError("Call context has no call_sid")
+        # Tool results may hold values JSON does not know, they are stored as text
+        return json.dumps(context.to_dict(), default=str)
+
+    @staticmethod
+    def _loads(data) -> CallContext:
+        return CallContext.from_dict(json.loads(data))
+
+
+class MemoryCallStore(AbstractCallStore):
+    """
+    Call state of a single worker, the default when only one process serves calls.
+
+    A finished call is forgotten ``finished_ttl`` seconds after its last
+    write, its history stays in the database.
+
+    Args:
+        finished_ttl (float): Seconds a finished call is kept.
+    """
+
+    def __init__(self, finished_ttl: float = float(os.getenv("CALL_STORE_FINISHED_TTL", 900))):
+        super().__init__()
+        self.finished_ttl = finished_ttl
+        self._contexts: Dict[str, str] = {}
+        # call_sid -> when the finished call is forgotten, in the order the calls finished
+        self._finished: Dict[str, float] = {}
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._finished:
+            call_sid, expires_at = next(iter(self._finished.items()))
+            if expires_at > now:
+                break
+            del self._finished[call_sid]
+            self._contexts.pop(call_sid, None)
+
+    async def get(self, call_sid: str) -> Optional[CallContext]:
+        self._evict()
+        data = self._contexts.get(call_sid)
+        return self._loads(data) if data is not None else None
+
+    async def put(self, context: CallContext):
+        self._contexts[context.call_sid] = self._dumps(context)
+        self._finished.pop(context.call_sid, None)
+        if context.call_ended:
+            self._finished[context.call_sid] = time.monotonic() + self.finished_ttl
+        self._evict()
+        await self.createEvent('callchanged', context.call_sid)
+
+    async def delete(self, call_sid: str):
+        self._finished.pop(call_sid, None)
+        if self._contexts.pop(call_sid, None) is not None:
+            await self.createEvent('callchanged', call_sid)
+
+    async def all(self) -> List[CallContext]:
+        self._evict()
+        return [self._loads(data) for data in self._contexts.values()]
+
+
+class SQLiteCallStore(AbstractCallStore):
+    """
+    Call state in a SQLite file, shared by the workers of one host.
+
+    Every write takes the next value of a counter that deletes never rewind,
+    ``start`` polls for rows above the last value it saw to notice writes
+    from other workers. Deletes are only announced to subscribers of the
+    worker that made them. Finished calls are deleted ``finished_ttl``
+    seconds after their last write, by whichever worker writes next.
+
+    Args:
+        path (str): The database file.
+        poll_interval (float): Seconds between checks for changes made by other workers.
+        finished_ttl (float): Seconds a finished call is kept.
+    """
+
+    def __init__(self, path: str = "./DataLibrary/call_state.db", poll_interval: float = 0.2,
+                 finished_ttl: float = float(os.getenv("CALL_STORE_FINISHED_TTL", 900))):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.finished_ttl = finished_ttl
+        self._next_eviction = 0.0
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._opening = asyncio.Lock()
+        self._seen_seq = 0
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def _connection(self):
+        if self._db is not None:
+            return self._db
+        async with self._opening:
+            if self._db is None:
+                import aiosqlite  # Local import, only needed when this backend is configured
+                db = await aiosqlite.connect(self.path)
+                # Readers on other workers do not block the writer
+                await db.execute("PRAGMA journal_mode=WAL")
+                await db.execute("PRAGMA busy_timeout=5000")
+                await db.execute("CREATE TABLE IF NOT EXISTS call_state (call_sid TEXT PRIMARY KEY, data TEXT, "
+                                 "seq INTEGER NOT NULL, updated_at REAL NOT NULL)")
+                await db.execute("CREATE INDEX IF NOT EXISTS call_state_seq ON call_state (seq)")
+                # MAX(seq) + 1 would hand a deleted row's seq to the next write, which watchers already passed
+                await db.execute("CREATE TABLE IF NOT EXISTS call_state_counter "
+                                 "(id INTEGER PRIMARY KEY CHECK (id = 0), seq INTEGER NOT NULL)")
+                await db.execute("INSERT OR IGNORE INTO call_state_counter (id, seq) "
+                                 "SELECT 0, COALESCE(MAX(seq), 0) FROM call_state")
+                await db.commit()
+                self._db = db
+        return self._db
+
+    async def start(self):
+        db = await self._connection()
+        async with db.execute("SELECT seq FROM call_state_counter") as cursor:
+            self._seen_seq = (await cursor.fetchone())[0]
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                db = await self._connection()
+                async with db.execute("SELECT call_sid, seq FROM call_state WHERE seq > ? ORDER BY seq",
+                                      (self._seen_seq,)) as cursor:
+                    changed = await cursor.fetchall()
+            except Exception as e:
+                logger.error(f"Error polling call state: {e!r}")
+                continue
+            for call_sid, seq in changed:
+                self._seen_seq = max(self._seen_seq, seq)
+                await self.createEvent('callchanged', call_sid)
+
+    async def get(self, call_sid: str) -> Optional[CallContext]:
+        db = await self._connection()
+        async with db.execute("SELECT data FROM call_state WHERE call_sid = ?", (call_sid,)) as cursor:
+            row = await cursor.fetchone()
+        return self._loads(row[0]) if row else None
+
+    async def put(self, context: CallContext):
+        data = self._dumps(context)
+        db = await self._connection()
+        async with self._lock:
+            # Both statements run in one write transaction, the counter is taken in commit order
+            await db.execute("UPDATE call_state_counter SET seq = seq + 1")
+            await db.execute("INSERT INTO call_state (call_sid, data, seq, updated_at) "
+                             "VALUES (?, ?, (SELECT seq FROM call_state_counter), ?) "
+                             "ON CONFLICT (call_sid) DO UPDATE SET data = excluded.data, seq = excluded.seq, "
+                             "updated_at = excluded.updated_at", (context.call_sid, data, time.time()))
+            if time.monotonic() >= self._next_eviction:
+                # The table only holds live and recently finished calls, the scan is short
+                self._next_eviction = time.monotonic() + min(self.finished_ttl, 60)
+                await db.execute("DELETE FROM call_state WHERE updated_at < ? AND json_extract(data, '$.call_ended')",
+                                 (time.time() - self.finished_ttl,))
+            await db.commit()
+        if self._watcher is None:
+            await self.createEvent('callchanged', context.call_sid)
+
+    async def delete(self, call_sid: str):
+        db = await self._connection()
+        async with self._lock:
+            await db.execute("DELETE FROM call_state WHERE call_sid = ?", (call_sid,))
+            await db.commit()
+        await self.createEvent('callchanged', call_sid)
+
+    async def all(self) -> List[CallContext]:
+        db = await self._connection()
+        async with db.execute("SELECT data FROM call_state ORDER BY updated_at") as cursor:
+            rows = await cursor.fetchall()
+        return [self._loads(row[0]) for row in rows]
+
+
+class RespConnection:
+    """
+    A minimal client for the Redis serialization protocol (RESP2).
+
+    Only what the call store needs: commands are sent as arrays of bulk strings
+    and replies are parsed into str, int, None or lists. Commands on one
+    connection are serialized by a lock.
+
+    Args:
+        host (str): The server host.
+        port (int): The server port.
+        password (Optional[str]): Sent with AUTH after connecting.
+        db (int): Selected after connecting.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, password: Optional[str] = None, db: int = 0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RespConnection":
+        """Build a connection from a ``redis://[:password@]host[:port][/db]`` URL."""
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, parsed.password, db)
+
+    def copy(self) -> "RespConnection":
+        """A new, unconnected connection to the same server."""
+        return RespConnection(self.host, self.port, self.password, self.db)
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._command("AUTH", self.password)
+        if self.db:
+            await self._command("SELECT", self.db)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self._writer = self._reader = None
+
+    async def execute(self, *args: Any):
+        """Send a command and return its reply, reconnecting once if the connection was lost."""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if not self.connected:
+                        await self.connect()
+                    return await self._command(*args)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    await self.close()
+                    if attempt:
+                        raise CallStoreError(f"Lost connection to {self.host}:{self.port}: {e!r}") from e
+
+    async def send(self, *args: Any):
+        """Send a command without reading a reply, used once the connection is subscribed."""
+        if not self.connected:
+            await self.connect()
+        self._writer.write(self.encode(*args))
+        await self._writer.drain()
+
+    async def read(self):
+        """Read the next reply or pushed message."""
+        return await self._read_reply()
+
+    async def _command(self, *args: Any):
+        try:
+            self._writer.write(self.encode(*args))
+            await self._writer.drain()
+            return await self._read_reply()
+        except BaseException:
+            # A reply left unread, or half read, would be taken as the reply of the next command
+            self._abort()
+            raise
+
+    def _abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = self._reader = None
+
+    @staticmethod
+    def encode(*args: Any) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readuntil(b"\r\n")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise CallStoreError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2].decode()
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise CallStoreError(f"Unexpected reply from {self.host}:{self.port}: {line!r}")
+
+
+class RedisCallStore(AbstractCallStore):
+    """
+    Call state in Redis, or anything speaking its protocol, shared across hosts.
+
+    Each context is a key with a TTL, a set indexes the known CallSids and
+    writes are announced on a pub/sub channel that ``start`` subscribes to.
+
+    Args:
+        url (str): ``redis://[:password@]host[:port][/db]``.
+        prefix (str): Prefix of every key and of the change channel.
+        ttl (int): Seconds a call's state is kept after its last write.
+        resubscribe_interval (float): Seconds between attempts to subscribe again after losing the connection.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "gptphone", ttl: int = 86400,
+                 resubscribe_interval: float = 1.0):
+        super().__init__()
+        self.connection = RespConnection.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.resubscribe_interval = resubscribe_interval
+        self.channel = f"{prefix}:callchanged"
+        self._subscriber: Optional[RespConnection] = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    def _key(self, call_sid: str) -> str:
+        return f"{self.prefix}:call:{call_sid}"
+
+    @property
+    def _index(self) -> str:
+        return f"{self.prefix}:calls"
+
+    async def start(self):
+        if self._watcher is None:
+            self._subscriber = self.connection.copy()
+            await self._subscribe()
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def _subscribe(self):
+        await self._subscriber.send("SUBSCRIBE", self.channel)
+        await self._subscriber.read()
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        if self._subscriber is not None:
+            await self._subscriber.close()
+            self._subscriber = None
+        await self.connection.close()
+
+    async def _watch(self):
+        while True:
+            try:
+                if not self._subscriber.connected:
+                    await self._subscribe()
+                message = await self._subscriber.read()
+            except Exception as e:
+                logger.error(f"Lost call state subscription, resubscribing: {e!r}")
+                await self._subscriber.close()
+                await asyncio.sleep(self.resubscribe_interval)
+                continue
+            if isinstance(message, list) and len(message) == 3 and message[0] == "message":
+                await self.createEvent('callchanged', message[2])
+
+    async def get(self, call_sid: str) -> Optional[CallContext]:
+        data = await self.connection.execute("GET", self._key(call_sid))
+        return self._loads(data) if data is not None else None
+
+    async def put(self, context: CallContext):
+        data = self._dumps(context)
+        await self.connection.execute("SET", self._key(context.call_sid), data, "EX", self.ttl)
+        await self.connection.execute("SADD", self._index, context.call_sid)
+        await self.connection.execute("PUBLISH", self.channel, context.call_sid)
+        if self._watcher is None:
+            await self.createEvent('callchanged', context.call_sid)
+
+    async def delete(self, call_sid: str):
+        await self.connection.execute("DEL", self._key(call_sid))
+        await self.connection.execute("SREM", self._index, call_sid)
+        await self.connection.execute("PUBLISH", self.channel, call_sid)
+        if self._watcher is None:
+            await self.createEvent('callchanged', call_sid)
+
+    async def all(self) -> List[CallContext]:
+        call_sids = await self.connection.execute("SMEMBERS", self._index)
+        if not call_sids:
+            return []
+        values = await self.connection.execute("MGET", *(self._key(call_sid) for call_sid in call_sids))
+        expired = [call_sid for call_sid, data in zip(call_sids, values) if data is None]
+        if expired:
+            # Their keys timed out, drop them from the index as well
+            await self.connection.execute("SREM", self._index, *expired)
+        return [self._loads(data) for data in values if data is not None]
+
+
+class CallStoreFactory:
+    @staticmethod
+    def get_call_store(store_name: str) -> AbstractCallStore:
+        if store_name.lower() == "memory":
+            return MemoryCallStore()
+        elif store_name.lower() == "sqlite":
+            return SQLiteCallStore(os.getenv("CALL_STORE_PATH", "./DataLibrary/call_state.db"))
+        elif store_name.lower() == "redis":
+            return RedisCallStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+                                  ttl=int(os.getenv("CALL_STATE_TTL", 86400)))
+        else:
+            raise ValueError(f"Unsupported call store: {store_name}")
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from functions.tool_http import TTLCache
+from Utils import basic_logger
+
+logger = basic_logger("CallerProfiles")
+
+'''
+Author: Sean Baker
+Date: 2024-09-25
+Description: Caller profiles (contact, preferences, recent calls) prefetched at /incoming and cached for the first LLM turn
+'''
+
+
+def personalize(system_message: Optional[str], profile: Optional[dict]) -> Optional[str]:
+    """
+    Append what is known about the caller to the system message.
+
+    Args:
+        system_message (Optional[str]): The call's system message.
+        profile (Optional[dict]): ``DatabaseManager.get_caller_profile`` output.
+
+    Returns:
+        Optional[str]: The system message, unchanged if nothing is known about the caller.
+    """
+    if not profile or not (profile.get("name") or profile.get("preferences") or profile.get("recent_calls")):
+        return system_message
+    lines = ["Known about this caller from previous calls, use it to help them but do not read it out:"]
+    if profile.get("name"):
+        lines.append(f"- Name: {profile['name']}")
+    if profile.get("preferences"):
+        lines.append("- Preferences: " + "; ".join(f"{key}: {value}" for key, value in profile["preferences"].items()))
+    for call in profile.get("recent_calls") or []:
+        details = [call.get("final_status") or "ended"]
+        if call.get("duration_s") is not None:
+            details.append(f"{call['duration_s'] / 60:.0f} min")
+        line = f"- Call on {(call.get('start_time') or 'unknown date')[:10]} ({', '.join(details)})"
+        if call.get("first_request"):
+            line += f', they said: "{call["first_request"][:160]}"'
+        lines.append(line)
+    return "\n\n".join(part for part in (system_message, "\n".join(lines)) if part)
+
+
+class CallerProfileCache:
+    """
+    Caller profiles keyed by phone number, in a TTL bounded LRU.
+
+    ``/incoming`` starts ``load`` for the caller's number as soon as Twilio
+    posts it, so the lookup runs while the media stream is being opened and
+    the session finds it finished when it builds the first prompt. Lookups
+    of a number already being loaded join the one in flight. Entries are
+    dropped on the database's ``contactchanged`` event, when the contact is
+    updated or one of the number's calls ends. Other workers' caches only
+    notice after their TTL.
+
+    Args:
+        lookup (Callable): Coroutine function returning the profile of a phone number.
+        max_size (int): Profiles kept at most.
+        ttl (float): Seconds a profile is used before it is looked up again.
+    """
+
+    def __init__(self, lookup: Callable[[str], Awaitable[dict]],
+                 max_size: int = int(os.getenv("CALLER_PROFILE_CACHE_SIZE", 1024)),
+                 ttl: float = float(os.getenv("CALLER_PROFILE_TTL", 600))):
+        self.lookup = lookup
+        self.cache = TTLCache(max_size=max_size, ttl=ttl)
+        self._loading: Dict[str, asyncio.Task] = {}
+        self.lookups = 0
+        self.joined = 0
+        self.errors = 0
+        self.invalidations = 0
+        self.total_lookup_ms = 0.0
+        self.max_lookup_ms = 0.0
+
+    async def load(self, phone_number: Optional[str]) -> Optional[dict]:
+        """
+        The profile of a phone number, from the cache or looked up.
+
+        Returns:
+            Optional[dict]: The profile, or None if there is no number or the lookup failed.
+        """
+        if not phone_number:
+            return None
+        profile = self.cache.get(phone_number)
+        if profile is not None:
+            return profile
+        task = self._loading.get(phone_number)
+        if task is None:
+            task = self._loading[phone_number] = asyncio.create_task(self._lookup(phone_number))
+            task.add_done_callback(lambda done: self._forget(phone_number, done))
+        else:
+            self.joined += 1
+        # A caller that gives up waiting does not cancel the lookup others may be waiting for
+        return await asyncio.shield(task)
+
+    async def _lookup(self, phone_number: str) -> Optional[dict]:
+        started = time.perf_counter()
+        try:
+            profile = await self.lookup(phone_number)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error looking up the caller profile of {phone_number}: {e!r}")
+            return None
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.lookups += 1
+            self.total_lookup_ms += elapsed_ms
+            self.max_lookup_ms = max(self.max_lookup_ms, elapsed_ms)
+        # A profile read before an invalidation may predate the change, it is returned but not cached
+        if self._loading.get(phone_number) is asyncio.current_task():
+            self.cache.set(phone_number, profile)
+        return profile
+
+    def _forget(self, phone_number: str, task: asyncio.Task):
+        if self._loading.get(phone_number) is task:
+            del self._loading[phone_number]
+
+    def invalidate(self, phone_number: str):
+        """Forget a number's profile, a lookup in flight is not cached when it finishes."""
+        self.invalidations += 1
+        self.cache.invalidate(phone_number)
+        self._loading.pop(phone_number, None)
+
+    def metrics(self) -> Dict:
+        return {"size": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses,
+                "hit_rate": round(self.cache.hit_rate, 3), "joined": self.joined, "lookups": self.lookups,
+                "errors": self.errors, "invalidations": self.invalidations,
+                "mean_lookup_ms": round(self.total_lookup_ms / self.lookups, 2) if self.lookups else 0.0,
+                "max_lookup_ms": round(self.max_lookup_ms, 2)}
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from twilio.twiml.voice_response import VoiceResponse
+
+from Utils import basic_logger
+
+logger = basic_logger("Capacity")
+
+'''
+Author: Sean Baker
+Date: 2024-09-20
+Description: Admission control for new calls, tracks live sessions, event loop lag and provider concurrency per worker
+'''
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Parse ``"stt=100,tts=15"`` into ``{"stt": 100, "tts": 15}``."""
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, limit = part.split("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes a sleeping task.
+
+    A worker whose loop is late delays every audio frame of every call it
+    serves, so lag is the most direct measure of a hot worker.
+
+    Args:
+        interval (float): Seconds between samples.
+        smoothing (float): Weight of the newest sample in the moving average.
+    """
+
+    def __init__(self, interval: float = 0.1, smoothing: float = 0.2):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.sample((time.perf_counter() - started - self.interval) * 1000)
+
+    def sample(self, lag_ms: float):
+        lag_ms = max(lag_ms, 0.0)
+        self.lag_ms += self.smoothing * (lag_ms - self.lag_ms)
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+
+class CapacityManager:
+    """
+    Decides whether this worker should take another call.
+
+    ``/incoming`` calls ``admit`` before answering with the media stream TwiML,
+    ``/start_call`` before placing an outbound call. An admitted call holds a
+    reservation until its media stream starts, so a burst of calls cannot all
+    pass the check before the first websocket arrives. Calls are turned away while live sessions plus reservations reach
+    ``max_sessions``, while the loop lag average is above ``max_loop_lag_ms``
+    or while a provider is at its concurrency limit.
+
+    Args:
+        max_sessions (int): Live calls this worker serves at most.
+        max_loop_lag_ms (float): Smoothed loop lag above which new calls are refused.
+        provider_limits (Optional[Dict[str, int]]): Concurrent requests or streams allowed per provider.
+        reservation_ttl (float): Seconds an admitted call may take to open its media stream.
+        lag_monitor (Optional[LoopLagMonitor]): Supplies the loop lag.
+    """
+
+    def __init__(self, max_sessions: int = int(os.getenv("MAX_CALLS_PER_WORKER", 20)),
+                 max_loop_lag_ms: float = float(os.getenv("MAX_LOOP_LAG_MS", 50)),
+                 provider_limits: Optional[Dict[str, int]] = None, reservation_ttl: float = 30.0,
+                 lag_monitor: Optional[LoopLagMonitor] = None):
+        self.max_sessions = max_sessions
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.provider_limits = provider_limits if provider_limits is not None else \
+            parse_limits(os.getenv("PROVIDER_LIMITS", ""))
+        self.reservation_ttl = reservation_ttl
+        self.lag_monitor = lag_monitor or LoopLagMonitor()
+
+        self.sessions = 0
+        self._reservations: Dict[str, float] = {}
+        self.providers: Dict[str, int] = {name: 0 for name in self.provider_limits}
+        self.metrics = {"admitted": 0, "rejected_sessions": 0, "rejected_loop_lag": 0, "rejected_provider": 0,
+                        "expired_reservations": 0}
+
+    @property
+    def reserved(self) -> int:
+        self._expire()
+        return len(self._reservations)
+
+    def _expire(self):
+        now = time.monotonic()
+        for call_sid in [sid for sid, expires_at in self._reservations.items() if expires_at < now]:
+            del self._reservations[call_sid]
+            self.metrics["expired_reservations"] += 1
+
+    def refusal(self) -> Optional[str]:
+        """Returns why a new call would be refused right now, or None if it would be admitted."""
+        if self.sessions + self.reserved >= self.max_sessions:
+            return "sessions"
+        if self.lag_monitor.lag_ms > self.max_loop_lag_ms:
+            return "loop_lag"
+        for name, limit in self.provider_limits.items():
+            if self.providers.get(name, 0) >= limit:
+                return "provider"
+        return None
+
+    def admit(self, call_sid: Optional[str], ttl: Optional[float] = None) -> bool:
+        """
+        Admit a new call and hold a place for it until its media stream starts.
+
+        Args:
+            call_sid (Optional[str]): The Twilio call SID.
+            ttl (Optional[float]): Seconds the place is held, ``reservation_ttl`` by default.
+
+        Returns:
+            bool: True if the call should be connected to this worker.
+        """
+        if call_sid in self._reservations:
+            return True
+        reason = self.refusal()
+        if reason is not None:
+            self.metrics[f"rejected_{reason}"] += 1
+            logger.warning(f"Refusing call {call_sid}: {reason}, load {self.load()}")
+            return False
+        if call_sid:
+            self._reservations[call_sid] = time.monotonic() + (self.reservation_ttl if ttl is None else ttl)
+        self.metrics["admitted"] += 1
+        return True
+
+    def move_reservation(self, old: str, new: str):
+        """Hold a reservation under another key, an outbound call is admitted before Twilio gives it a SID."""
+        expires_at = self._reservations.pop(old, None)
+        if expires_at is not None:
+            self._reservations[new] = expires_at
+
+    def cancel_reservation(self, call_sid: str):
+        """Give back the place of an admitted call that will not start after all."""
+        self._reservations.pop(call_sid, None)
+
+    def session_started(self, call_sid: Optional[str] = None):
+        """A media stream started, its reservation becomes a live session."""
+        self._reservations.pop(call_sid, None)
+        self.sessions += 1
+
+    def session_ended(self):
+        self.sessions = max(self.sessions - 1, 0)
+
+    def acquire(self, name: str):
+        """A request or stream to a provider started."""
+        self.providers[name] = self.providers.get(name, 0) + 1
+
+    def release(self, name: str):
+        self.providers[name] = max(self.providers.get(name, 0) - 1, 0)
+
+    @contextmanager
+    def provider(self, name: str):
+        """Count a request to a provider for as long as the block runs."""
+        self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def load(self) -> Dict:
+        """Current load of the worker, served at /health."""
+        reserved = self.reserved
+        return {
+            "accepting": self.refusal() is None,
+            "sessions": self.sessions,
+            "reserved": reserved,
+            "max_sessions": self.max_sessions,
+            "utilization": round((self.sessions + reserved) / self.max_sessions, 3) if self.max_sessions else 1.0,
+            "loop_lag_ms": round(self.lag_monitor.lag_ms, 2),
+            "max_loop_lag_ms": round(self.lag_monitor.max_lag_ms, 2),
+            "providers": {name: {"in_use": count, "limit": self.provider_limits.get(name)}
+                          for name, count in self.providers.items()},
+            "metrics": dict(self.metrics),
+        }
+
+
+def overflow_twiml(overflow_number: Optional[str] = None, queue_name: Optional[str] = None,
+                   wait_url: Optional[str] = None, retry_url: Optional[str] = None) -> str:
+    """
+    TwiML for a call this worker refused.
+
+    The call is forwarded to ``overflow_number`` if one is set. Otherwise it
+    waits in the ``queue_name`` Twilio queue, Twilio fetches ``wait_url``
+    for its hold audio and, once a worker has room, the caller leaves the
+    queue and is sent back to ``retry_url``. Without either the caller hears
+    a short apology.
+
+    Returns:
+        str: The TwiML document.
+    """
+    response = VoiceResponse()
+    if overflow_number:
+        response.dial(overflow_number)
+    elif queue_name:
+        response.enqueue(queue_name, wait_url=wait_url)
+        if retry_url:
+            response.redirect(retry_url)
+    else:
+        response.say("All of our lines are busy right now, please call again in a few minutes.")
+        response.hangup()
+    return str(response)
+
+
+def hold_twiml(admitted: bool, hold_audio_url: str) -> str:
+    """
+    TwiML Twilio runs for a queued caller, again every time the hold audio ends.
+
+    Args:
+        admitted (bool): Whether a worker has room for the call now.
+        hold_audio_url (str): Audio played while the caller waits.
+
+    Returns:
+        str: ``<Leave/>`` once admitted, otherwise the hold audio.
+    """
+    response = VoiceResponse()
+    if admitted:
+        response.leave()
+    else:
+        response.play(hold_audio_url)
+    return str(response)
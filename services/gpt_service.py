@@ -1,15 +1,17 @@
+import asyncio
 import importlib
 import json
 import re
 from abc import ABC, abstractmethod
 from .call_details import CallContext
+from .intent_router import IntentRouter
 from EventHandlers import EventHandler
 from functions.function_manifest import tools
-from Utils import configure_logger
+from Utils import basic_logger
 
 
 
-logger = configure_logger("LLMService")
+logger = basic_logger("LLMService")
 
 '''
 Author: Sean Baker
@@ -40,6 +42,7 @@ class AbstractLLMService(EventHandler, ABC):
             module = importlib.import_module(f'functions.{function_name}')
             self.available_functions[function_name] = getattr(module, function_name)
         self.sentence_buffer = ""
+        self.intent_router = IntentRouter(tools)
         context.user_context = self.user_context
     @abstractmethod
     async def completion(self, text: str, interaction_count: int, role: str = 'user', name: str = 'user'):
@@ -59,6 +62,53 @@ class AbstractLLMService(EventHandler, ABC):
     def reset(self):
         self.partial_response_index = 0
 
+    async def fast_path(self, text: str, interaction_count: int) -> bool:
+        """
+        Serve a final transcript from the intent router instead of the LLM.
+
+        The synthetic exchange is written to user_context so the next completion
+        still sees what was said and done.
+
+        Returns:
+            bool: True if the text was handled and must not be sent to completion.
+        """
+        match = self.intent_router.match(text)
+        if match is None:
+            return False
+
+        logger.info(f"Intent fast path: {match.intent} ({match.confidence:.2f}) for '{text}'")
+        self.user_context.append({"role": "user", "content": text, "name": "user"})
+
+        if match.intent == "stop":
+            return True
+
+        if match.intent == "repeat":
+            last_reply = next((message["content"] for message in reversed(self.user_context)
+                               if message["role"] == "assistant" and message.get("content")), None)
+            if not last_reply:
+                # Nothing to repeat yet, let the LLM answer instead
+                self.user_context.pop()
+                return False
+            await self.createEvent('llmreply', {
+                "partialResponseIndex": None,
+                "partialResponse": last_reply
+            }, interaction_count)
+            self.user_context.append({"role": "assistant", "content": last_reply})
+            return True
+
+        preamble = asyncio.create_task(self.createEvent('llmreply', {
+            "partialResponseIndex": None,
+            "partialResponse": match.say
+        }, interaction_count))
+        if self.context.mark_tracker is not None:
+            self.context.mark_tracker.track(preamble)
+        self.user_context.append({"role": "assistant", "content": match.say})
+
+        function_response = await self.available_functions[match.tool](self.context, {})
+        await preamble
+        self.user_context.append({"role": "function", "content": function_response, "name": match.tool})
+        return True
+
 
     def validate_function_args(self, args):
         try:
@@ -103,3 +153,10 @@ class LLMFactory:
             return GeminiService(context)
         else:
             raise ValueError(f"Unsupported LLM service: {service_name}")
+
+    @staticmethod
+    async def warm_up(service_name: str):
+        """Warm the client of the given service so the first completion skips the connection setup."""
+        if service_name.lower() == "openai":
+            from .openai_service import OpenAIService  # Local import
+            await OpenAIService.warm_up()
@@ -0,0 +1,122 @@
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from Utils.llm_data_fillers import ACCIDENTAL_INTERRUPTION_PHRASES
+
+'''
+Author: Sean Baker
+Date: 2024-09-02
+Description: Rule based intent matcher, lets obvious end/transfer/repeat requests skip the LLM round trip
+'''
+
+# Words that are a valid answer to a question the assistant just asked, these always go to the LLM
+ANSWER_PHRASES = {"no", "wrong", "incorrect", "listen", "excuse", "excuse me", "break"}
+
+LEADING_FILLERS = r"(?:(?:uh|um|uhm|oh|ok|okay|so|well|yeah|alright|hey|please|sorry)\s+)*"
+TRAILING_FILLERS = r"(?:\s+(?:please|now|then|thanks|thank you|right now|already))*"
+
+REPEAT_PATTERNS = [
+    r"(?:can|could|would) you (?:please )?(?:repeat|say) (?:that|it|this)(?: again)?",
+    r"(?:can|could|would) you (?:please )?repeat",
+    r"repeat (?:that|it|please|yourself)",
+    r"say (?:that|it) again",
+    r"(?:sorry |pardon )?(?:what was that|what did you say)",
+    r"come again",
+    r"(?:i )?(?:beg your )?pardon",
+    r"(?:sorry )?i didn'?t (?:catch|hear|get) (?:that|you)",
+]
+
+
+class IntentMatch(NamedTuple):
+    intent: str
+    tool: Optional[str]
+    say: Optional[str]
+    confidence: float
+
+
+class IntentRouter:
+    """
+    Matches final transcripts against compiled keyword/regex intents so that
+    requests like "transfer me to a person" or "goodbye" can be served without
+    waiting on the LLM.
+
+    Intents are built from:
+        - the ``intents`` list of each tool in the function manifest (the tool is triggered directly)
+        - ``repeat``: the caller asks for the last reply again
+        - ``stop``: ``ACCIDENTAL_INTERRUPTION_PHRASES`` said on their own, the assistant stays quiet
+
+    A whole utterance match scores 1.0, a match embedded in a longer utterance
+    scores the share of the utterance it covers. Anything under
+    ``min_confidence`` falls through to the LLM.
+
+    Args:
+        tools (List[Dict]): The function manifest.
+        min_confidence (float): Matches below this confidence are ignored.
+        max_words (int): Utterances longer than this are never routed.
+    """
+
+    def __init__(self, tools: List[Dict], min_confidence: float = 0.9, max_words: int = 12):
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self.intents: Dict[str, IntentMatch] = {}
+        self._patterns: List[tuple] = []
+
+        for tool in tools:
+            function = tool['function']
+            patterns = function.get('intents')
+            if not patterns:
+                continue
+            self._add_intent(function['name'], patterns, tool=function['name'], say=function.get('say'))
+
+        self._add_intent("repeat", REPEAT_PATTERNS)
+
+        # Phrases like "bye" already belong to a tool intent, keep them there
+        stop_phrases = [phrase for phrase in ACCIDENTAL_INTERRUPTION_PHRASES
+                        if phrase not in ANSWER_PHRASES and self.match(phrase) is None]
+        self._add_intent("stop", [re.escape(phrase) for phrase in stop_phrases])
+
+    def _add_intent(self, name: str, patterns: List[str], tool: Optional[str] = None, say: Optional[str] = None):
+        alternation = "|".join(f"(?:{pattern})" for pattern in patterns)
+        full = re.compile(rf"^{LEADING_FILLERS}(?:{alternation}){TRAILING_FILLERS}$")
+        partial = re.compile(rf"\b(?:{alternation})\b")
+        self._patterns.append((name, full, partial))
+        self.intents[name] = IntentMatch(name, tool, say, 1.0)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lowercase the transcript and strip punctuation so patterns only deal with words."""
+        text = text.lower().replace("’", "'")
+        text = re.sub(r"[^\w\s']", " ", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    def match(self, text: str) -> Optional[IntentMatch]:
+        """
+        Match a final transcript against the known intents.
+
+        Args:
+            text (str): The final transcript.
+
+        Returns:
+            Optional[IntentMatch]: The matched intent, or None if the LLM should handle the text.
+        """
+        normalized = self.normalize(text or "")
+        if not normalized or len(normalized.split()) > self.max_words:
+            return None
+
+        best = None
+        for name, full, partial in self._patterns:
+            if full.match(normalized):
+                return self.intents[name]
+            found = partial.search(normalized)
+            if found:
+                confidence = len(found.group(0)) / len(normalized)
+                if best is None or confidence > best.confidence:
+                    best = self.intents[name]._replace(confidence=confidence)
+
+        if best is not None and best.confidence >= self.min_confidence:
+            return best
+        return None
+
+    def prerender_phrases(self) -> List[str]:
+        """Returns the spoken preambles of every routable tool so TTS can render them ahead of time."""
+        return [intent.say for intent in self.intents.values() if intent.say]
@@ -1,11 +1,34 @@
+import asyncio
 import os
+import time
 
 from functions.function_manifest import tools
 from .call_details import CallContext
+from .tool_call_parser import IncrementalArgumentParser
 from .gpt_service import AbstractLLMService, logger
 from openai import AsyncOpenAI
 
 
+# Seconds the client's connection pool keeps an idle connection open, httpx's keep-alive expiry
+KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", 5))
+
+_shared_client = None
+_last_request_at = float("-inf")
+
+
+def shared_openai_client() -> AsyncOpenAI:
+    """One AsyncOpenAI client per process so every call reuses its pooled connections."""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _shared_client
+
+
+def _mark_request():
+    global _last_request_at
+    _last_request_at = time.monotonic()
+
+
 class OpenAIService(AbstractLLMService):
     """
 
@@ -28,16 +51,38 @@ class OpenAIService(AbstractLLMService):
                 interaction_count (int): The number of interactions with the API.
                 role (str, optional): The role of the input. Default is 'user'.
                 name (str, optional): The name of the role. Default is 'user'.
+
+        start_tool_call(self, function_name: str, function_args: dict, interaction_count: int)
+            Starts a tool call in the background, tool calls are dispatched as soon as their
+            streamed arguments form a complete JSON object rather than at the end of the stream.
+
+            Parameters:
+                function_name (str): The name of the tool.
+                function_args (dict): The parsed tool arguments.
+                interaction_count (int): The number of interactions with the API.
     """
     def __init__(self, context: CallContext):
         super().__init__(context)
-        self.openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.openai = shared_openai_client()
+
+    @staticmethod
+    async def warm_up():
+        """Open a connection to the API ahead of the first completion, unless the pool still has one open."""
+        if time.monotonic() - _last_request_at < KEEPALIVE_SECONDS:
+            return
+        # Marked first, calls arriving together share one warm up request
+        _mark_request()
+        try:
+            await shared_openai_client().models.retrieve("gpt-4o")
+        except Exception as e:
+            logger.error(f"Error warming up OpenAI client: {str(e)}")
 
     async def completion(self, text: str, interaction_count: int, role: str = 'user', name: str = 'user'):
         try:
             self.user_context.append({"role": role, "content": text, "name": name})
             messages = [{"role": "system", "content": self.system_message}] + self.user_context
 
+            _mark_request()
             stream = await self.openai.chat.completions.create(
                 model="gpt-4o",
                 messages=messages,
@@ -46,49 +91,57 @@ class OpenAIService(AbstractLLMService):
             )
 
             complete_response = ""
-            function_name = ""
-            function_args = ""
-
-            async for chunk in stream:
-                delta = chunk.choices[0].delta
-                content = delta.content or ""
-                tool_calls = delta.tool_calls
-
-                if tool_calls:
-                    for tool_call in tool_calls:
-                        if tool_call.function and tool_call.function.name:
-                            logger.info(f"Function call detected: {tool_call.function.name}")
-                            function_name = tool_call.function.name
-                            function_args += tool_call.function.arguments or ""
-                else:
-                    complete_response += content
-                    await self.emit_complete_sentences(content, interaction_count)
-
-                if chunk.choices[0].finish_reason == "tool_calls":
-                    logger.info(f"Function call detected: {function_name}")
-                    function_to_call = self.available_functions[function_name]
-                    function_args = self.validate_function_args(function_args)
-
-                    tool_data = next((tool for tool in tools if tool['function']['name'] == function_name), None)
-                    say = tool_data['function']['say']
-
-                    await self.emit('llmreply', {
-                        "partialResponseIndex": None,
-                        "partialResponse": say
-                    }, interaction_count)
-
-                    self.user_context.append({"role": "assistant", "content": say})
-
-                    function_response = await function_to_call(self.context, function_args)
-
-                    logger.info(f"Function {function_name} called with args: {function_args}")
-
-                    if function_name != "end_call":
-                        await self.completion(function_response, interaction_count, 'function', function_name)
+            # Tool calls by stream index, each dispatched as soon as its arguments are complete
+            pending_calls = {}
+
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta
+                    content = delta.content or ""
+                    tool_calls = delta.tool_calls
+
+                    if tool_calls:
+                        for tool_call in tool_calls:
+                            call = pending_calls.setdefault(tool_call.index, {
+                                "name": "",
+                                "parser": IncrementalArgumentParser(),
+                                "task": None,
+                                "used": False
+                            })
+                            if tool_call.function and tool_call.function.name:
+                                logger.info(f"Function call detected: {tool_call.function.name}")
+                                call["name"] = tool_call.function.name
+                            if tool_call.function and tool_call.function.arguments:
+                                if call["parser"].feed(tool_call.function.arguments) and call["task"] is None:
+                                    logger.info(f"Arguments complete for {call['name']}, dispatching while streaming")
+                                    call["task"] = self.start_tool_call(call["name"], call["parser"].arguments,
+                                                                        interaction_count)
+                    else:
+                        complete_response += content
+                        await self.emit_complete_sentences(content, interaction_count)
+
+                    if chunk.choices[0].finish_reason == "tool_calls":
+                        for call in pending_calls.values():
+                            if call["task"] is None:
+                                function_args = call["parser"].arguments
+                                if function_args is None:
+                                    function_args = self.validate_function_args(call["parser"].buffer or "{}")
+                                call["task"] = self.start_tool_call(call["name"], function_args, interaction_count)
+
+                        for call in pending_calls.values():
+                            # Awaited from here on, cancelling this reply cancels the tool with it
+                            call["used"] = True
+                            function_response = await call["task"]
+                            if call["name"] != "end_call":
+                                await self.completion(function_response, interaction_count, 'function', call["name"])
+            finally:
+                await self._abandon_tool_calls(pending_calls)
+            # The connection went back to the pool when the stream ended
+            _mark_request()
 
             # Emit any remaining content in the buffer
             if self.sentence_buffer.strip():
-                await self.emit('llmreply', {
+                await self.createEvent('llmreply', {
                     "partialResponseIndex": self.partial_response_index,
                     "partialResponse": self.sentence_buffer.strip()
                 }, interaction_count)
@@ -98,3 +151,51 @@ class OpenAIService(AbstractLLMService):
 
         except Exception as e:
             logger.error(f"Error in OpenAIService completion: {str(e)}")
+
+    @staticmethod
+    async def _abandon_tool_calls(pending_calls: dict):
+        """Cancel the tool calls of a reply that failed or was interrupted before their results were used."""
+        abandoned = [call for call in pending_calls.values() if call["task"] is not None and not call["used"]]
+        for call in abandoned:
+            call["task"].cancel()
+        results = await asyncio.gather(*(call["task"] for call in abandoned), return_exceptions=True)
+        for call, result in zip(abandoned, results):
+            if isinstance(result, asyncio.CancelledError):
+                logger.warning(f"Cancelled tool call {call['name']}, its reply was abandoned")
+            else:
+                logger.warning(f"Dropped the result of tool call {call['name']}, its reply was abandoned: {result!r}")
+
+    def start_tool_call(self, function_name: str, function_args: dict, interaction_count: int) -> asyncio.Task:
+        """
+        Start a tool call in the background and speak its preamble while it runs.
+
+        Args:
+            function_name (str): The name of the tool to call.
+            function_args (dict): The parsed arguments for the tool.
+            interaction_count (int): The current interaction count.
+
+        Returns:
+            asyncio.Task: Resolves to the tool response once the tool and its preamble are done.
+        """
+        function_to_call = self.available_functions[function_name]
+        tool_data = next((tool for tool in tools if tool['function']['name'] == function_name), None)
+        say = tool_data['function'].get('say') if tool_data else None
+
+        preamble = None
+        if say:
+            preamble = asyncio.create_task(self.createEvent('llmreply', {
+                "partialResponseIndex": None,
+                "partialResponse": say
+            }, interaction_count))
+            if self.context.mark_tracker is not None:
+                self.context.mark_tracker.track(preamble)
+            self.user_context.append({"role": "assistant", "content": say})
+
+        async def run():
+            function_response = await function_to_call(self.context, function_args)
+            logger.info(f"Function {function_name} called with args: {function_args}")
+            if preamble is not None:
+                await preamble
+            return function_response
+
+        return asyncio.create_task(run())
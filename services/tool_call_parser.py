@@ -0,0 +1,81 @@
+import json
+from typing import Any, Dict, Optional
+
+'''
+Author: Sean Baker
+Date: 2024-09-04
+Description: Incremental parser for streamed tool call arguments, tells us the moment the JSON object is complete
+'''
+
+
+class IncrementalArgumentParser:
+    """
+    Consumes the argument fragments of a streamed tool call and detects when the
+    top level JSON object has closed.
+
+    Only the new fragment is scanned on each feed, tracking brace depth and
+    whether we are inside a string, so the check is linear in the total
+    argument length no matter how the model chunks it.
+
+    Attributes:
+        buffer (str): All argument text received so far.
+        arguments (Optional[Dict[str, Any]]): The parsed arguments once complete and valid.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.arguments: Optional[Dict[str, Any]] = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+
+    @property
+    def complete(self) -> bool:
+        return self.arguments is not None
+
+    def feed(self, fragment: str) -> bool:
+        """
+        Add a fragment of the arguments.
+
+        Args:
+            fragment (str): The next piece of the arguments string.
+
+        Returns:
+            bool: True once the arguments object has closed and parsed as valid JSON.
+        """
+        if self.complete or not fragment:
+            return self.complete
+
+        closed_at = None
+        for position, char in enumerate(fragment):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+                self._started = True
+            elif char == '}':
+                self._depth -= 1
+                if self._started and self._depth == 0:
+                    closed_at = position
+                    break
+
+        if closed_at is None:
+            self.buffer += fragment
+            return False
+
+        self.buffer += fragment[:closed_at + 1]
+        try:
+            arguments = json.loads(self.buffer)
+        except json.JSONDecodeError:
+            return False
+        if isinstance(arguments, dict):
+            self.arguments = arguments
+        return self.complete
@@ -1 +1,6 @@
-from .speach_to_text import TranscriptionService
\ No newline at end of file
+from .abstract_base import AbstractSTTService
+from .speach_to_text import TranscriptionService
+from .connection_pool import DeepgramConnectionPool
+from .turn_detector import TurnDetector
+from .interim_stabilizer import InterimStabilizer
+from .stt_factory import STTFactory
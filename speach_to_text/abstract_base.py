@@ -0,0 +1,81 @@
+from abc import ABC, abstractmethod
+
+from EventHandlers import EventHandler
+
+'''
+Author: Sean Baker
+Date: 2024-09-13
+Description: Base class for STT backends, mirrors the TTS one so the media stream does not care which engine listens
+'''
+
+
+class AbstractSTTService(EventHandler, ABC):
+    """
+    Abstract base class for Speech-to-Text (STT) services.
+
+    Implementations emit ``utterance`` (text, stream_sid) for interim results,
+    which drives barge-in, and ``transcription`` (text) once the caller's turn
+    is over.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stream_sid = None
+        self.is_connected = False
+        # Monotonic time the backend last returned a result, empty ones included
+        self.last_result_at = None
+
+    def set_stream_sid(self, stream_id):
+        """
+        Sets the stream ID associated with the transcription.
+
+        Args:
+            stream_id (str): The stream ID.
+        """
+        self.stream_sid = stream_id
+
+    def get_stream_sid(self):
+        """
+        Returns the stream ID associated with the transcription.
+
+        Returns:
+            str: The stream ID.
+        """
+        return self.stream_sid
+
+    @abstractmethod
+    async def connect(self, connection=None):
+        """Start listening.
+
+        Args:
+            connection: A backend specific connection prepared ahead of time, backends that
+                can't use it close it.
+
+        Returns:
+            None
+        """
+
+        pass
+
+    @abstractmethod
+    async def send(self, payload: bytes):
+        """Feed 8 kHz mu-law audio from the call.
+
+        Args:
+            payload (bytes): The audio data.
+
+        Returns:
+            None
+        """
+
+        pass
+
+    @abstractmethod
+    async def disconnect(self):
+        """Stop listening and release the backend.
+
+        Returns:
+            None
+        """
+
+        pass
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional
+
+from deepgram import DeepgramClient, LiveOptions
+
+from Utils import basic_logger
+from .speach_to_text import LIVE_OPTIONS
+
+logger = basic_logger("STTPool")
+
+'''
+Author: Sean Baker
+Date: 2024-09-09
+Description: Warm pool of pre-connected Deepgram live sockets, takes the websocket handshake off the first utterance
+'''
+
+
+class PooledConnection(NamedTuple):
+    connection: object
+    opened_at: float
+
+
+class DeepgramConnectionPool:
+    """
+    Keeps a few live Deepgram connections open and ready so a new call can take
+    one instantly instead of waiting on the websocket handshake and option
+    negotiation.
+
+    Idle connections are kept alive with KeepAlive messages and recycled once
+    they are older than ``max_age`` or report as disconnected. Taking a
+    connection wakes the maintenance task, which opens a replacement in the
+    background.
+
+    Args:
+        size (int): Number of idle connections to keep ready, 0 disables pooling.
+        max_age (float): Seconds an idle connection may live before it is replaced.
+        keepalive_interval (float): Seconds between KeepAlive messages on idle connections.
+    """
+
+    def __init__(self, size: int = int(os.getenv("STT_POOL_SIZE", 2)), max_age: float = 120.0,
+                 keepalive_interval: float = 5.0):
+        self.size = size
+        self.max_age = max_age
+        self.keepalive_interval = keepalive_interval
+        self.client = DeepgramClient(os.getenv("DEEPGRAM_API_KEY"))
+        self._idle: Deque[PooledConnection] = deque()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.metrics: Dict[str, int] = {"hits": 0, "misses": 0, "opened": 0, "recycled": 0, "failed": 0}
+
+    async def open_connection(self):
+        """
+        Open and start a new live connection.
+
+        Returns:
+            The started Deepgram live client, or None if the connection failed.
+        """
+        connection = self.client.listen.asyncwebsocket.v("1")
+        if not await connection.start(LiveOptions(**LIVE_OPTIONS)):
+            self.metrics["failed"] += 1
+            return None
+        self.metrics["opened"] += 1
+        return connection
+
+    async def start(self):
+        """Start the background task that fills the pool and keeps it alive."""
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def acquire(self):
+        """
+        Take a ready connection, or open one on the spot if the pool is empty.
+
+        Returns:
+            A started Deepgram live client, or None if no connection could be opened.
+        """
+        while self._idle:
+            pooled = self._idle.popleft()
+            if self._usable(pooled) and await pooled.connection.is_connected():
+                self.metrics["hits"] += 1
+                self._wake.set()
+                return pooled.connection
+            await self._recycle(pooled)
+
+        self.metrics["misses"] += 1
+        self._wake.set()
+        return await self.open_connection()
+
+    def _usable(self, pooled: PooledConnection) -> bool:
+        return time.monotonic() - pooled.opened_at < self.max_age
+
+    async def _recycle(self, pooled: PooledConnection):
+        self.metrics["recycled"] += 1
+        try:
+            await pooled.connection.finish()
+        except Exception as e:
+            logger.error(f"Error closing stale Deepgram connection: {e}")
+
+    async def _maintain(self):
+        while True:
+            # Cleared before the work, an acquire during it is served by another round right away
+            self._wake.clear()
+            try:
+                # Replace stale sockets and keep the rest alive
+                for pooled in list(self._idle):
+                    healthy = self._usable(pooled) and await pooled.connection.is_connected()
+                    if pooled not in self._idle:
+                        # Taken by acquire while it was being checked
+                        continue
+                    if not healthy:
+                        self._idle.remove(pooled)
+                        await self._recycle(pooled)
+                    else:
+                        await pooled.connection.keep_alive()
+
+                missing = self.size - len(self._idle)
+                if missing > 0:
+                    opened = await asyncio.gather(*(self.open_connection() for _ in range(missing)),
+                                                  return_exceptions=True)
+                    for connection in opened:
+                        if isinstance(connection, Exception):
+                            self.metrics["failed"] += 1
+                            logger.error(f"Error opening pooled Deepgram connection: {connection}")
+                        elif connection is not None:
+                            self._idle.append(PooledConnection(connection, time.monotonic()))
+            except Exception as e:
+                logger.error(f"Error maintaining Deepgram pool: {e}")
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.keepalive_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """Stop maintenance and close every idle connection."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._idle:
+            await self._recycle(self._idle.popleft())
+
+    def stats(self) -> Dict[str, int]:
+        """Pool size and hit/miss/recycle counters."""
+        return {"idle": len(self._idle), "target_size": self.size, **self.metrics}
@@ -0,0 +1,137 @@
+import re
+import time
+from typing import List, Optional, Tuple
+
+from Utils.llm_data_fillers import ACCIDENTAL_INTERRUPTION_PHRASES
+
+'''
+Author: Sean Baker
+Date: 2024-09-14
+Description: Debounces barge-in, interim hypotheses have to settle on real words before we clear the caller's audio
+'''
+
+BACKCHANNELS = {
+    "mm", "mhm", "mmhmm", "mm-hmm", "hmm", "uh", "um", "uh-huh", "uhhuh", "ah", "oh", "yeah", "yep", "yes", "ok",
+    "okay", "right", "sure", "huh", "alright", "cool",
+}
+# Sounds that never answer anything, a final made only of these is not sent to the LLM while audio plays.
+# "yes" or "okay" keep the assistant talking but may answer its question, so they are still answered.
+NON_LEXICAL_BACKCHANNELS = {"mm", "mhm", "mmhmm", "mm-hmm", "hmm", "uh", "um", "uh-huh", "uhhuh", "ah", "huh"}
+# Single words from the interruption list are too easily a cough or a mumble on their own,
+# the multi word phrases are deliberate enough to interrupt as soon as they are stable
+ACCIDENTAL_WORDS = {phrase for phrase in ACCIDENTAL_INTERRUPTION_PHRASES if " " not in phrase}
+INTERRUPT_PHRASES = [phrase for phrase in ACCIDENTAL_INTERRUPTION_PHRASES if " " in phrase]
+WORD = re.compile(r"[\w'-]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count, about four characters per token."""
+    return (len(text) + 3) // 4
+
+
+class InterimStabilizer:
+    """
+    Decides when interim transcripts are a real barge-in.
+
+    Deepgram revises interim hypotheses as audio comes in, and a cough or a
+    "mm-hmm" produces a short one that is gone a moment later. A word counts as
+    stable once it has kept its place in the hypothesis for ``min_stable_ms``;
+    the caller is interrupting once ``min_stable_words`` stable words are not
+    backchannels or single accidental words, or a multi word stop phrase such
+    as "hold on" is stable. A final transcript interrupts with one word that
+    is not a backchannel.
+
+    Args:
+        min_stable_words (int): Stable content words needed to interrupt.
+        min_stable_ms (float): Time a word must survive revisions to count as stable.
+
+    Attributes:
+        metrics (dict): interim results seen, barge-ins declared, barge-ins suppressed and
+            the audio seconds and reply tokens the suppressed ones did not throw away.
+    """
+
+    def __init__(self, min_stable_words: int = 2, min_stable_ms: float = 250.0):
+        self.min_stable_words = min_stable_words
+        self.min_stable_ms = min_stable_ms
+        self.metrics = {"interim_results": 0, "barge_ins": 0, "suppressed": 0,
+                        "audio_seconds_saved": 0.0, "tokens_saved": 0}
+        self._at_risk: Optional[Tuple[float, int]] = None
+        self._interrupted = False
+        self._words: List[Tuple[str, float]] = []
+
+    def reset(self):
+        """End of the caller's utterance, count it as suppressed if it never interrupted playing audio."""
+        if self._at_risk is not None and not self._interrupted:
+            audio_seconds, tokens = self._at_risk
+            self.metrics["suppressed"] += 1
+            self.metrics["audio_seconds_saved"] += audio_seconds
+            self.metrics["tokens_saved"] += tokens
+        self._words = []
+        self._interrupted = False
+        self._at_risk = None
+
+    @staticmethod
+    def words(text: str) -> List[str]:
+        return WORD.findall(text.lower())
+
+    def is_backchannel(self, text: str) -> bool:
+        """Whether a final transcript is only non-lexical backchannels such as "mm-hmm"."""
+        return all(word in NON_LEXICAL_BACKCHANNELS for word in self.words(text))
+
+    def update(self, text: str, now: Optional[float] = None) -> List[str]:
+        """
+        Track an interim hypothesis.
+
+        Returns:
+            List[str]: The words that have been stable for ``min_stable_ms``.
+        """
+        now = now if now is not None else time.monotonic()
+        previous = self._words
+        self._words = []
+        prefix_unchanged = True
+        for i, word in enumerate(self.words(text)):
+            # Words keep their first seen time for as long as the hypothesis up to them is unchanged
+            prefix_unchanged = prefix_unchanged and i < len(previous) and previous[i][0] == word
+            self._words.append(previous[i] if prefix_unchanged else (word, now))
+        return [word for word, seen in self._words if (now - seen) * 1000 >= self.min_stable_ms]
+
+    @staticmethod
+    def content_words(words: List[str], final: bool = False) -> List[str]:
+        """Words that count towards an interruption, a finalized "stop" or "wait" is meant and counts."""
+        return [word for word in words if word not in BACKCHANNELS and (final or word not in ACCIDENTAL_WORDS)]
+
+    @staticmethod
+    def _has_interrupt_phrase(text: str) -> bool:
+        text = " ".join(InterimStabilizer.words(text))
+        return any(re.search(rf"\b{re.escape(phrase)}\b", text) for phrase in INTERRUPT_PHRASES)
+
+    def should_interrupt(self, text: str, playing: bool, pending_audio_seconds: float = 0.0,
+                         pending_tokens: int = 0, final: bool = False, now: Optional[float] = None) -> bool:
+        """
+        Feed a transcript and decide whether to cut the assistant off.
+
+        Args:
+            text (str): The interim (or final) transcript of the caller's current utterance.
+            playing (bool): Whether assistant audio is still playing.
+            pending_audio_seconds (float): Audio that an interruption would clear.
+            pending_tokens (int): Reply tokens that an interruption would force to be regenerated.
+            final (bool): The text is final, all of its words count as stable and one content word is enough.
+            now (Optional[float]): Monotonic time, for tests.
+
+        Returns:
+            bool: True once per utterance, when the caller is really interrupting playing audio.
+        """
+        if not final:
+            self.metrics["interim_results"] += 1
+        stable = self.update(text, now) if not final else self.words(text)
+        if not playing or self._interrupted:
+            return False
+        if self._at_risk is None:
+            self._at_risk = (pending_audio_seconds, pending_tokens)
+
+        needed = 1 if final else self.min_stable_words
+        if len(self.content_words(stable, final)) >= needed or self._has_interrupt_phrase(" ".join(stable)):
+            self._interrupted = True
+            self.metrics["barge_ins"] += 1
+            return True
+        return False
@@ -0,0 +1,370 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Utils import basic_logger
+from .abstract_base import AbstractSTTService
+from .turn_detector import mulaw_to_linear
+
+logger = basic_logger("OfflineSTT")
+
+'''
+Author: Sean Baker
+Date: 2024-09-13
+Description: CPU only streaming STT, decoders run in worker processes and read the call audio from shared memory rings
+'''
+
+SAMPLE_RATE = 8000
+
+
+class SharedAudioRing:
+    """
+    Fixed size ring of mu-law audio in shared memory.
+
+    The event loop writes into it and hands worker processes ``(start, end)``
+    byte offsets, so only a few integers are pickled per chunk. Offsets count
+    every byte ever written; the writer drops the oldest unread audio if the
+    readers fall a full ring behind.
+
+    Args:
+        capacity (int): Ring size in bytes, one byte per 8 kHz sample.
+    """
+
+    def __init__(self, capacity: int = SAMPLE_RATE * 10):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=capacity)
+        self.written = 0
+        self.read = 0
+        self.dropped = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def pending(self) -> int:
+        return self.written - self.read
+
+    def write(self, payload: bytes):
+        """Append audio, overwriting the oldest unread audio when the ring is full."""
+        if len(payload) > self.capacity:
+            self.written += len(payload) - self.capacity
+            payload = payload[-self.capacity:]
+        position = self.written % self.capacity
+        first = min(len(payload), self.capacity - position)
+        self.shm.buf[position:position + first] = payload[:first]
+        self.shm.buf[:len(payload) - first] = payload[first:]
+        self.written += len(payload)
+        if self.pending > self.capacity:
+            self.dropped += self.pending - self.capacity
+            self.read = self.written - self.capacity
+
+    def take(self, max_bytes: int) -> Tuple[int, int]:
+        """Claim up to max_bytes of unread audio, returns its (start, end) offsets."""
+        start = self.read
+        self.read = min(self.written, start + max_bytes)
+        return start, self.read
+
+    def rewind(self, nbytes: int):
+        """Make up to nbytes of already read (or skipped) audio unread again."""
+        self.read = max(self.written - self.capacity, self.read - nbytes, 0)
+
+    def skip(self):
+        """Mark everything written so far as read."""
+        self.read = self.written
+
+    @staticmethod
+    def read_range(buffer, capacity: int, start: int, end: int) -> bytes:
+        """Copy the audio between two offsets out of a ring buffer, also used by the worker processes."""
+        position = start % capacity
+        length = end - start
+        first = min(length, capacity - position)
+        return bytes(buffer[position:position + first]) + bytes(buffer[:length - first])
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Worker process state: the loaded model, one recognizer and one attached ring per call
+_recognizer_factory: Optional[Callable] = None
+_recognizers: Dict[str, object] = {}
+_rings: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def init_vosk_worker(model_path: str):
+    """Process pool initializer, loads the Vosk model once per worker."""
+    global _recognizer_factory
+    from vosk import KaldiRecognizer, Model, SetLogLevel  # Local import, only the workers need vosk
+    SetLogLevel(-1)
+    model = Model(model_path)
+    _recognizer_factory = lambda: KaldiRecognizer(model, SAMPLE_RATE)
+
+
+def decode_chunk(session_id: str, ring_name: str, capacity: int, start: int, end: int) -> Tuple[str, str]:
+    """
+    Decode one chunk of a call's audio in a worker process.
+
+    Returns:
+        Tuple[str, str]: (partial text, final text), final is set when the recognizer found an endpoint.
+    """
+    ring = _rings.get(session_id)
+    if ring is None:
+        # Workers share the parent's resource tracker, the parent unlinks the segment when the call ends
+        ring = _rings[session_id] = shared_memory.SharedMemory(name=ring_name)
+    recognizer = _recognizers.get(session_id)
+    if recognizer is None:
+        recognizer = _recognizers[session_id] = _recognizer_factory()
+
+    pcm = mulaw_to_linear(SharedAudioRing.read_range(ring.buf, capacity, start, end)).tobytes()
+    if recognizer.AcceptWaveform(pcm):
+        return "", json.loads(recognizer.Result()).get("text", "")
+    return json.loads(recognizer.PartialResult()).get("partial", ""), ""
+
+
+def close_session(session_id: str) -> str:
+    """Drop a call's recognizer and ring in the worker, returns any text it was still holding."""
+    ring = _rings.pop(session_id, None)
+    if ring is not None:
+        ring.close()
+    recognizer = _recognizers.pop(session_id, None)
+    return json.loads(recognizer.FinalResult()).get("text", "") if recognizer is not None else ""
+
+
+class DecoderPool:
+    """
+    Worker processes running the CPU recognizer.
+
+    Each worker is a single process executor so a call's recognizer state
+    stays in the process that created it; calls are spread round robin.
+
+    Args:
+        workers (int): Number of worker processes.
+        initializer (Callable): Loads the model in each worker and sets the recognizer factory.
+        initargs (tuple): Arguments for the initializer.
+    """
+
+    def __init__(self, workers: int = int(os.getenv("OFFLINE_STT_WORKERS", os.cpu_count() or 1)),
+                 initializer: Callable = init_vosk_worker,
+                 initargs: tuple = (os.getenv("VOSK_MODEL_PATH", "models/vosk-model-small-en-us-0.15"),)):
+        self.executors: List[ProcessPoolExecutor] = [
+            ProcessPoolExecutor(max_workers=1, initializer=initializer, initargs=initargs) for _ in range(workers)
+        ]
+        self._next = itertools.cycle(self.executors)
+
+    def assign(self) -> ProcessPoolExecutor:
+        return next(self._next)
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_shared_pool: Optional[DecoderPool] = None
+
+
+def shared_decoder_pool() -> DecoderPool:
+    """The process wide decoder pool, started on first use."""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = DecoderPool()
+    return _shared_pool
+
+
+def shutdown_decoder_pool():
+    """Stop the shared decoder pool if it was started."""
+    global _shared_pool
+    if _shared_pool is not None:
+        _shared_pool.shutdown()
+        _shared_pool = None
+
+
+class OfflineTranscriptionService(AbstractSTTService):
+    """
+    Streaming STT that runs entirely on local CPU.
+
+    Audio is written into a shared memory ring and decoded in chunks by a
+    worker process, at most one chunk per call in flight, so decoding never
+    blocks the event loop. Emits the same ``utterance``/``transcription``
+    events as the Deepgram service, with the recognizer's own endpointing.
+
+    Args:
+        pool (Optional[DecoderPool]): The worker pool, defaults to the shared one.
+        chunk_ms (int): Audio collected before a chunk is sent to the worker.
+        ring_seconds (int): Seconds of audio the ring holds.
+        active (bool): Whether to decode right away. An inactive service only
+            buffers audio, see ``activate``.
+    """
+
+    def __init__(self, pool: Optional[DecoderPool] = None, chunk_ms: int = 100, ring_seconds: int = 10,
+                 active: bool = True):
+        super().__init__()
+        self.pool = pool or shared_decoder_pool()
+        self.executor = self.pool.assign()
+        self.session_id = uuid.uuid4().hex
+        self.ring = SharedAudioRing(SAMPLE_RATE * ring_seconds)
+        self.chunk_bytes = SAMPLE_RATE * chunk_ms // 1000
+        self.active = active
+        self.last_partial = ""
+        self._decoding: Optional[asyncio.Task] = None
+        # Whether a worker holds a recognizer and ring attachment of this call
+        self._submitted = False
+        self.metrics = {"chunks": 0, "decode_ms": 0.0, "audio_ms": 0.0}
+
+    async def connect(self, connection=None):
+        if connection is not None:
+            # A pre-connected socket for another backend is of no use here
+            await connection.finish()
+        self.is_connected = True
+
+    def activate(self, backfill_seconds: float = 0.0):
+        """
+        Start decoding, e.g. when taking over from another backend.
+
+        Args:
+            backfill_seconds (float): Seconds of already buffered audio to decode first.
+        """
+        self.ring.skip()
+        self.ring.rewind(int(SAMPLE_RATE * backfill_seconds))
+        self.active = True
+        self._schedule()
+
+    async def send(self, payload: bytes):
+        self.ring.write(payload)
+        self._schedule()
+
+    def _schedule(self):
+        if self.active and self.is_connected and self._decoding is None and self.ring.pending >= self.chunk_bytes:
+            self._decoding = asyncio.create_task(self._decode_pending())
+
+    async def _decode_pending(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.is_connected and self.ring.pending >= self.chunk_bytes:
+                # Catch up in larger chunks if the worker fell behind
+                start, end = self.ring.take(self.chunk_bytes * 10)
+                started = time.perf_counter()
+                self._submitted = True
+                partial, final = await loop.run_in_executor(
+                    self.executor, decode_chunk, self.session_id, self.ring.name, self.ring.capacity, start, end)
+                self.metrics["chunks"] += 1
+                self.metrics["decode_ms"] += (time.perf_counter() - started) * 1000
+                self.metrics["audio_ms"] += (end - start) * 1000 / SAMPLE_RATE
+
+                if partial and partial != self.last_partial:
+                    self.last_partial = partial
+                    await self.createEvent('utterance', partial, self.stream_sid)
+                if final.strip():
+                    self.last_partial = ""
+                    await self.createEvent('transcription', final)
+        except Exception as e:
+            logger.error(f"Error while decoding audio: {e}")
+        finally:
+            self._decoding = None
+
+    @property
+    def real_time_factor(self) -> float:
+        """Decode time per second of audio, below 1.0 keeps up with the call."""
+        return self.metrics["decode_ms"] / self.metrics["audio_ms"] if self.metrics["audio_ms"] else 0.0
+
+    async def disconnect(self):
+        self.is_connected = False
+        if self._decoding is not None:
+            await asyncio.gather(self._decoding, return_exceptions=True)
+        # A fallback that never took over has nothing in a worker, and must not start one to load the model
+        if self._submitted:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, close_session, self.session_id)
+            except Exception as e:
+                logger.error(f"Error closing offline STT session: {e}")
+        self.ring.close()
+        logger.info(f"Offline STT stats: {self.metrics}, dropped {self.ring.dropped} bytes")
+
+
+class FailoverTranscriptionService(AbstractSTTService):
+    """
+    Uses a primary STT backend and switches to a fallback when it fails or stalls.
+
+    The fallback buffers the call audio from the start but only decodes once
+    it takes over, beginning with the last ``backfill_seconds`` so the words
+    the primary never returned are not lost. The switch is one way for the
+    rest of the call, which avoids the same turn being emitted twice.
+
+    Args:
+        primary (AbstractSTTService): The preferred backend, usually Deepgram.
+        fallback (OfflineTranscriptionService): The backend to switch to.
+        timeout (float): Seconds of streamed audio without any result from the primary that count as a stall.
+        backfill_seconds (float): Audio replayed into the fallback when it takes over.
+    """
+
+    def __init__(self, primary: AbstractSTTService, fallback: OfflineTranscriptionService,
+                 timeout: float = float(os.getenv("STT_FAILOVER_TIMEOUT", 3.0)), backfill_seconds: float = 2.0):
+        super().__init__()
+        self.primary = primary
+        self.fallback = fallback
+        self.fallback.active = False
+        self.timeout = timeout
+        self.backfill_seconds = backfill_seconds
+        self.failed_over = False
+        self.connected_at = time.monotonic()
+
+        for service in (primary, fallback):
+            service.on('utterance', self._forward('utterance', service))
+            service.on('transcription', self._forward('transcription', service))
+
+    def _forward(self, event: str, service: AbstractSTTService):
+        async def forward(*args):
+            if (service is self.fallback) == self.failed_over:
+                await self.createEvent(event, *args)
+
+        return forward
+
+    def set_stream_sid(self, stream_id):
+        super().set_stream_sid(stream_id)
+        self.primary.set_stream_sid(stream_id)
+        self.fallback.set_stream_sid(stream_id)
+
+    async def connect(self, connection=None):
+        await self.fallback.connect()
+        try:
+            await self.primary.connect(connection)
+        except Exception as e:
+            logger.error(f"Primary STT failed to connect: {e}")
+            self.fail_over("connect failed")
+        self.connected_at = time.monotonic()
+        self.is_connected = True
+
+    def fail_over(self, reason: str):
+        """Switch to the fallback backend for the rest of the call."""
+        if self.failed_over:
+            return
+        logger.warning(f"Switching STT to the offline backend: {reason}")
+        self.failed_over = True
+        self.fallback.activate(self.backfill_seconds)
+
+    async def send(self, payload: bytes):
+        await self.fallback.send(payload)
+        if self.failed_over:
+            return
+
+        # Deepgram returns results, empty ones included, every few hundred ms while audio flows,
+        # and has nothing to answer while silence is being held back
+        gate = getattr(self.primary, "silence_gate", None)
+        last_result = max(self.primary.last_result_at or 0.0, self.connected_at,
+                          gate.last_suppressed_at if gate else 0.0)
+        if not self.primary.is_connected and not getattr(self.primary, "reconnecting", False):
+            self.fail_over("primary disconnected")
+        elif time.monotonic() - last_result > self.timeout:
+            self.fail_over(f"no primary result for {self.timeout:.1f}s")
+        else:
+            await self.primary.send(payload)
+
+    async def disconnect(self):
+        await asyncio.gather(self.primary.disconnect(), self.fallback.disconnect(), return_exceptions=True)
+        self.is_connected = False
@@ -0,0 +1,100 @@
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+import numpy as np
+
+from .turn_detector import MULAW_TO_LINEAR, SAMPLE_RATE
+
+'''
+Author: Sean Baker
+Date: 2024-09-15
+Description: Energy gate for inbound call audio, long silences are not streamed to the STT provider
+'''
+
+# Squared linear value of every mu-law byte, the energy of a frame is a table lookup and a mean
+MULAW_SQUARED = MULAW_TO_LINEAR.astype(np.float64) ** 2
+
+
+def frame_energy_db(payload: bytes) -> float:
+    """Energy of a mu-law frame in dBFS."""
+    if not payload:
+        return -100.0
+    mean_square = float(MULAW_SQUARED[np.frombuffer(payload, dtype=np.uint8)].mean())
+    return 10 * np.log10(mean_square / 32768.0 ** 2) if mean_square > 0 else -100.0
+
+
+class SilenceGate:
+    """
+    Decides which inbound frames are worth sending to the STT provider.
+
+    Audio keeps flowing for ``hangover_ms`` after the last loud frame so the
+    provider still sees the trailing silence its endpointing and UtteranceEnd
+    need. After that frames are held back; the last ``preroll_ms`` are kept and
+    sent ahead of the first loud frame so word onsets are not clipped.
+
+    Args:
+        threshold_db (float): Frames at or above this energy count as speech.
+        hangover_ms (float): Silence still forwarded after speech, keep it above utterance_end_ms.
+        preroll_ms (float): Audio replayed in front of resumed speech.
+        keepalive_interval (float): Seconds between KeepAlive messages while suppressing.
+    """
+
+    def __init__(self, threshold_db: float = -45.0, hangover_ms: float = 1200.0, preroll_ms: float = 200.0,
+                 keepalive_interval: float = 5.0):
+        self.threshold_db = threshold_db
+        self.hangover_ms = hangover_ms
+        self.preroll_ms = preroll_ms
+        self.keepalive_interval = keepalive_interval
+
+        self._preroll: Deque[bytes] = deque()
+        self._preroll_bytes = 0
+        self._silent_ms = 0.0
+        self._last_keepalive = time.monotonic()
+        self.suppressing = False
+        self.last_suppressed_at = 0.0
+        self.metrics = {"forwarded_seconds": 0.0, "suppressed_seconds": 0.0, "keepalives": 0}
+
+    def process(self, payload: bytes, now: Optional[float] = None) -> List[bytes]:
+        """
+        Feed one inbound frame.
+
+        Returns:
+            List[bytes]: The audio to forward now, empty while suppressing.
+        """
+        now = now if now is not None else time.monotonic()
+        duration_ms = len(payload) * 1000 / SAMPLE_RATE
+        if frame_energy_db(payload) >= self.threshold_db:
+            self._silent_ms = 0.0
+        else:
+            self._silent_ms += duration_ms
+
+        if self._silent_ms <= self.hangover_ms:
+            chunks = list(self._preroll) + [payload]
+            self.metrics["forwarded_seconds"] += sum(len(chunk) for chunk in chunks) / SAMPLE_RATE
+            # Pre-roll audio was counted as suppressed when it was held back
+            self.metrics["suppressed_seconds"] -= self._preroll_bytes / SAMPLE_RATE
+            self._preroll.clear()
+            self._preroll_bytes = 0
+            self.suppressing = False
+            # Audio keeps the socket open as well as a KeepAlive does
+            self._last_keepalive = now
+            return chunks
+
+        self.suppressing = True
+        self.last_suppressed_at = now
+        self.metrics["suppressed_seconds"] += len(payload) / SAMPLE_RATE
+        self._preroll.append(payload)
+        self._preroll_bytes += len(payload)
+        while self._preroll_bytes - len(self._preroll[0]) >= self.preroll_ms * SAMPLE_RATE / 1000:
+            self._preroll_bytes -= len(self._preroll.popleft())
+        return []
+
+    def keepalive_due(self, now: Optional[float] = None) -> bool:
+        """Whether a KeepAlive should be sent to hold the socket open while suppressing."""
+        now = now if now is not None else time.monotonic()
+        if not self.suppressing or now - self._last_keepalive < self.keepalive_interval:
+            return False
+        self._last_keepalive = now
+        self.metrics["keepalives"] += 1
+        return True
@@ -1,18 +1,46 @@
+import asyncio
+import json
 import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple
 
 from deepgram import DeepgramClient, LiveOptions, LiveTranscriptionEvents
 
 from Utils import basic_logger
-from EventHandlers import EventHandler
+from .abstract_base import AbstractSTTService
+from .silence_gate import SilenceGate
+from .turn_detector import TurnDetector
 
 logger = basic_logger("Transcription")
 
+LIVE_OPTIONS = dict(
+    model="nova-2",
+    language="en-US",
+    encoding="mulaw",
+    sample_rate=8000,
+    channels=1,
+    punctuate=True,
+    interim_results=True,
+    endpointing=int(os.getenv("STT_ENDPOINTING_MS", 200)),
+    utterance_end_ms=int(os.getenv("STT_UTTERANCE_END_MS", 1000))
+)
+# Local end of turn prediction, ends the turn before UtteranceEnd when the caller is clearly done
+TURN_PREDICTOR = os.getenv("TURN_PREDICTOR", "true") == "true"
+TURN_TRACE_DIR = os.getenv("STT_TURN_TRACE_DIR")
+# Hold back long silences instead of streaming them, Deepgram gets KeepAlives meanwhile
+SILENCE_SUPPRESSION = os.getenv("STT_SILENCE_SUPPRESSION", "true") == "true"
+# Seconds of not yet finalized audio kept to replay into a new socket after a drop
+REPLAY_SECONDS = float(os.getenv("STT_REPLAY_SECONDS", 5))
+SAMPLE_RATE = LIVE_OPTIONS["sample_rate"]
+
 '''
 Author: Sean Baker
 Date: 2024-07-22 
 Description: Transcription service utilizing deepgram helps with logger and user input to pass to gpt 
 '''
-class TranscriptionService(EventHandler):
+class TranscriptionService(AbstractSTTService):
     """
     A class that handles live transcription using the Deepgram API.
 
@@ -22,11 +50,16 @@ class TranscriptionService(EventHandler):
         final_result (str): The final transcription result.
         speech_final (bool): Indicates if the speech is final or not.
         stream_sid (str): The stream ID associated with the transcription.
+        turn_detector (Optional[TurnDetector]): Local end of turn predictor, None when disabled.
+        silence_gate (Optional[SilenceGate]): Holds back silent audio, None when disabled.
+        connection_factory (Optional[Callable]): Coroutine function returning a started connection,
+            used to reconnect (e.g. the warm pool's acquire). Opens a new socket when None.
+        connection_metrics (dict): Reconnects, failed attempts, gap durations and replayed audio.
 
     Methods:
         set_stream_sid: Sets the stream ID.
         get_stream_sid: Returns the stream ID.
-        connect: Connects to the Deepgram API and starts live transcription.
+        connect: Connects to the Deepgram API, or adopts a pooled connection, and starts live transcription.
         handle_utterance_end: Handles the event when an utterance ends.
         handle_transcription: Handles the event when a transcription is received.
         handle_error: Handles the event when an error occurs.
@@ -37,48 +70,47 @@ class TranscriptionService(EventHandler):
         disconnect: Disconnects from the Deepgram API.
     """
 
-    def __init__(self):
+    def __init__(self, connection_factory: Optional[Callable[[], Awaitable]] = None):
         super().__init__()
         self.client = DeepgramClient(os.getenv("DEEPGRAM_API_KEY"))
+        self.connection_factory = connection_factory
         self.deepgram_live = None
         self.final_result = ""
         self.speech_final = False
-        self.stream_sid = None
+        self.turn_detector = TurnDetector(max_silence_ms=LIVE_OPTIONS["utterance_end_ms"],
+                                          record=bool(TURN_TRACE_DIR)) if TURN_PREDICTOR else None
+        self._turn_watch = None
+        # The hangover covers utterance_end_ms so Deepgram still sees the silence that ends a turn
+        self.silence_gate = SilenceGate(hangover_ms=LIVE_OPTIONS["utterance_end_ms"] + 200) \
+            if SILENCE_SUPPRESSION else None
 
-    def set_stream_sid(self, stream_id):
-        """
-        Sets the stream ID associated with the transcription.
+        # Audio sent on the current socket that Deepgram has not finalized yet, as (end offset, chunk)
+        self._unconfirmed: Deque[Tuple[int, bytes]] = deque()
+        self._unconfirmed_bytes = 0
+        self._stream_bytes = 0
+        # Audio received while reconnecting
+        self._backlog: Deque[bytes] = deque()
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.connection_metrics = {"reconnects": 0, "failed_attempts": 0, "gap_ms_total": 0.0, "gap_ms_max": 0.0,
+                                   "replayed_seconds": 0.0, "lost_seconds": 0.0}
 
-        Args:
-            stream_id (str): The stream ID.
-        """
-        self.stream_sid = stream_id
+    @property
+    def reconnecting(self) -> bool:
+        return self._reconnect_task is not None
 
-    def get_stream_sid(self):
-        """
-        Returns the stream ID associated with the transcription.
-
-        Returns:
-            str: The stream ID.
-        """
-        return self.stream_sid
-
-    async def connect(self):
+    async def connect(self, connection=None):
         """
         Connects to the Deepgram API and starts live transcription.
+
+        Args:
+            connection: An already started Deepgram live client (e.g. from the warm pool) to adopt
+                instead of opening a new one.
         """
-        self.deepgram_live = self.client.listen.asynclive.v("1")
-        await self.deepgram_live.start(LiveOptions(
-            model="nova-2",
-            language="en-US",
-            encoding="mulaw",
-            sample_rate=8000,
-            channels=1,
-            punctuate=True,
-            interim_results=True,
-            endpointing=200,
-            utterance_end_ms=1000
-        ))
+        if connection is None:
+            connection = await self._open_connection()
+        self.deepgram_live = connection
+        self._stream_bytes = 0
 
         self.deepgram_live.on(LiveTranscriptionEvents.Transcript, self.handle_transcription)
         self.deepgram_live.on(LiveTranscriptionEvents.Error, self.handle_error)
@@ -86,6 +118,101 @@ class TranscriptionService(EventHandler):
         self.deepgram_live.on(LiveTranscriptionEvents.Warning, self.handle_warning)
         self.deepgram_live.on(LiveTranscriptionEvents.Metadata, self.handle_metadata)
         self.deepgram_live.on(LiveTranscriptionEvents.UtteranceEnd, self.handle_utterance_end)
+        self.is_connected = True
+
+    async def _open_connection(self):
+        if self.connection_factory is not None:
+            connection = await self.connection_factory()
+            if connection is None:
+                raise ConnectionError("No Deepgram connection available")
+            return connection
+        connection = self.client.listen.asyncwebsocket.v("1")
+        if not await connection.start(LiveOptions(**LIVE_OPTIONS)):
+            raise ConnectionError("Deepgram connection failed to start")
+        return connection
+
+    def _remember(self, chunk: bytes, end: int):
+        self._unconfirmed.append((end, chunk))
+        self._unconfirmed_bytes += len(chunk)
+        while self._unconfirmed_bytes > REPLAY_SECONDS * SAMPLE_RATE:
+            self._unconfirmed_bytes -= len(self._unconfirmed.popleft()[1])
+
+    def _hold(self, chunks):
+        """Keep audio that arrives while reconnecting, up to REPLAY_SECONDS of it."""
+        self._backlog.extend(chunks)
+        while sum(len(chunk) for chunk in self._backlog) > REPLAY_SECONDS * SAMPLE_RATE:
+            self.connection_metrics["lost_seconds"] += len(self._backlog.popleft()) / SAMPLE_RATE
+
+    def _confirm(self, result):
+        """Forget audio Deepgram has finalized, it never needs to be replayed."""
+        try:
+            confirmed = int((result.start + result.duration) * SAMPLE_RATE)
+        except (AttributeError, TypeError):
+            return
+        while self._unconfirmed and 0 < self._unconfirmed[0][0] <= confirmed:
+            self._unconfirmed_bytes -= len(self._unconfirmed.popleft()[1])
+
+    async def _forward(self, chunk: bytes):
+        self._stream_bytes += len(chunk)
+        self._remember(chunk, self._stream_bytes)
+        await self.deepgram_live.send(chunk)
+
+    def _connection_lost(self, reason: str):
+        self.is_connected = False
+        if self._closing or self.reconnecting:
+            return
+        logger.warning(f"Deepgram connection lost ({reason}), reconnecting")
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self, attempts: int = 6, base_delay: float = 0.1, max_delay: float = 2.0):
+        """Reconnect with jittered exponential backoff and replay the audio Deepgram never finalized."""
+        lost_at = time.monotonic()
+        old_connection, self.deepgram_live = self.deepgram_live, None
+        if old_connection is not None:
+            asyncio.create_task(self._finish_quietly(old_connection))
+
+        try:
+            for attempt in range(attempts):
+                try:
+                    await self.connect(await self._open_connection())
+                    break
+                except Exception as e:
+                    self.connection_metrics["failed_attempts"] += 1
+                    delay = min(base_delay * 2 ** attempt, max_delay) * random.uniform(0.5, 1.5)
+                    logger.warning(f"Deepgram reconnect attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+            else:
+                logger.error(f"Could not reconnect to Deepgram after {attempts} attempts")
+                self.connection_metrics["lost_seconds"] += sum(len(chunk) for chunk in self._backlog) / SAMPLE_RATE
+                self._backlog.clear()
+                return
+
+            # Unfinalized audio from the old socket, then what arrived since. send keeps appending
+            # to the backlog until it is drained, so the new socket gets everything in order
+            self._backlog.extendleft(chunk for _, chunk in reversed(self._unconfirmed))
+            self._unconfirmed.clear()
+            self._unconfirmed_bytes = 0
+            replayed = 0
+            while self._backlog:
+                chunk = self._backlog.popleft()
+                replayed += len(chunk)
+                await self._forward(chunk)
+
+            gap_ms = (time.monotonic() - lost_at) * 1000
+            self.connection_metrics["reconnects"] += 1
+            self.connection_metrics["gap_ms_total"] += gap_ms
+            self.connection_metrics["gap_ms_max"] = max(self.connection_metrics["gap_ms_max"], gap_ms)
+            self.connection_metrics["replayed_seconds"] += replayed / SAMPLE_RATE
+            logger.info(f"Deepgram reconnected after {gap_ms:.0f} ms, replayed {replayed / SAMPLE_RATE:.2f}s of audio")
+        finally:
+            self._reconnect_task = None
+
+    @staticmethod
+    async def _finish_quietly(connection):
+        try:
+            await connection.finish()
+        except Exception:
+            pass
 
     async def handle_utterance_end(self, self_obj, utterance_end):
         """
@@ -96,12 +223,13 @@ class TranscriptionService(EventHandler):
             utterance_end: The utterance end event.
         """
         try:
+            if self.turn_detector:
+                self.turn_detector.record("end")
+                self.turn_detector.baseline_end()
             if not self.speech_final:
                 logger.info(
                     f"UtteranceEnd received before speech was final, emit the text collected so far: {self.final_result}")
-                await self.createEvent('transcription', self.final_result)
-                self.final_result = ''
-                self.speech_final = True
+                await self._end_turn(early=False)
                 return
             else:
                 return
@@ -118,17 +246,28 @@ class TranscriptionService(EventHandler):
             result: The transcription result.
         """
         try:
+            self.last_result_at = time.monotonic()
+            if result.is_final:
+                self._confirm(result)
             alternatives = result.channel.alternatives if hasattr(result, 'channel') else []
             text = alternatives[0].transcript if alternatives else ""
 
             if result.is_final and text.strip():
                 self.final_result += f" {text}"
+                if self.turn_detector:
+                    self.turn_detector.record("final", text)
                 if result.speech_final:
-                    self.speech_final = True
-                    await self.createEvent('transcription', self.final_result)
-                    self.final_result = ''
+                    if self.turn_detector:
+                        self.turn_detector.record("end")
+                    await self._end_turn(early=False)
                 else:
                     self.speech_final = False
+                    if self.turn_detector and self._turn_watch is None:
+                        self._turn_watch = asyncio.create_task(self._watch_turn_end())
+            elif result.is_final and result.speech_final and self.turn_detector:
+                # Endpointing caught up with a turn we already ended
+                self.turn_detector.record("end")
+                self.turn_detector.baseline_end()
             else:
                 if text.strip():
                     stream_sid = self.stream_sid
@@ -137,6 +276,29 @@ class TranscriptionService(EventHandler):
             logger.error(f"Error while handling transcription: {e}")
             e.print_stack()
 
+    async def _end_turn(self, early: bool):
+        """Hand the collected text to the LLM and start a new turn."""
+        text, self.final_result = self.final_result, ''
+        self.speech_final = True
+        if self.turn_detector:
+            self.turn_detector.end_turn(early)
+        await self.createEvent('transcription', text)
+
+    async def _watch_turn_end(self):
+        """Ends the turn as soon as the TurnDetector is confident, instead of waiting for UtteranceEnd."""
+        try:
+            while not self.speech_final and self.final_result.strip():
+                if self.turn_detector.should_end_turn(self.final_result):
+                    logger.info(f"Turn ended early after {self.turn_detector.silence_ms:.0f} ms of silence: "
+                                f"{self.final_result}")
+                    await self._end_turn(early=True)
+                    return
+                await asyncio.sleep(0.02)
+        except Exception as e:
+            logger.error(f"Error while predicting end of turn: {e}")
+        finally:
+            self._turn_watch = None
+
     async def handle_error(self, self_obj, error):
         """
         Handles the event when an error occurs.
@@ -146,7 +308,8 @@ class TranscriptionService(EventHandler):
             error: The error message.
         """
         logger.error(f"Deepgram error: {error}")
-        self.is_connected = False
+        if self_obj is self.deepgram_live and not await self_obj.is_connected():
+            self._connection_lost(f"error: {error}")
 
     async def handle_warning(self, self_obj, warning):
         """
@@ -177,7 +340,9 @@ class TranscriptionService(EventHandler):
             close: The close event.
         """
         logger.info("Deepgram connection closed")
-        self.is_connected = False
+        # Ignore the close of a socket we already replaced
+        if self_obj is self.deepgram_live:
+            self._connection_lost("closed")
 
     async def send(self, payload: bytes):
         """
@@ -186,15 +351,49 @@ class TranscriptionService(EventHandler):
         Args:
             payload (bytes): The audio data.
         """
-        if self.deepgram_live:
-            await self.deepgram_live.send(payload)
+        if self.turn_detector:
+            self.turn_detector.add_audio(payload)
+        if self.reconnecting:
+            self._hold(self.silence_gate.process(payload) if self.silence_gate else [payload])
+            return
+        if not self.deepgram_live:
+            return
+        if self.silence_gate is None:
+            await self._forward(payload)
+            return
+
+        chunks = self.silence_gate.process(payload)
+        if chunks:
+            await self._forward(b"".join(chunks))
+        elif self.silence_gate.keepalive_due():
+            await self.deepgram_live.keep_alive()
 
     async def disconnect(self):
         """
         Disconnects from the Deepgram API.
         """
+        self._closing = True
+        if self._turn_watch is not None:
+            self._turn_watch.cancel()
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
         if self.deepgram_live:
             await self.deepgram_live.finish()
             self.deepgram_live = None
         self.is_connected = False
-        logger.info("Disconnected from Deepgram")
\ No newline at end of file
+        logger.info(f"STT connection: {self.connection_metrics}")
+        if self.silence_gate:
+            logger.info(f"Silence suppression: {self.silence_gate.metrics}")
+        if self.turn_detector:
+            logger.info(f"Turn prediction: {self.turn_detector.metrics}")
+            self.save_turn_trace()
+        logger.info("Disconnected from Deepgram")
+
+    def save_turn_trace(self):
+        """Write the recorded turn trace to STT_TURN_TRACE_DIR for replay with speach_to_text.turn_replay."""
+        if not TURN_TRACE_DIR or not self.turn_detector or not self.turn_detector.trace:
+            return
+        os.makedirs(TURN_TRACE_DIR, exist_ok=True)
+        with open(os.path.join(TURN_TRACE_DIR, f"{self.stream_sid or id(self)}.json"), "w") as f:
+            json.dump(self.turn_detector.trace, f)
\ No newline at end of file
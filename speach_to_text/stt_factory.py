@@ -0,0 +1,23 @@
+
+class STTFactory:
+    from .abstract_base import AbstractSTTService
+    @staticmethod
+    def get_stt_service(service_name: str, connection_factory=None) -> AbstractSTTService:
+        if service_name.lower() == "deepgram":
+            from .speach_to_text import TranscriptionService
+            return TranscriptionService(connection_factory)
+        elif service_name.lower() in ("offline", "vosk"):
+            from .offline_stt import OfflineTranscriptionService
+            return OfflineTranscriptionService()
+        elif service_name.lower() == "failover":
+            from .speach_to_text import TranscriptionService
+            from .offline_stt import FailoverTranscriptionService, OfflineTranscriptionService
+            return FailoverTranscriptionService(TranscriptionService(connection_factory),
+                                                OfflineTranscriptionService(active=False))
+        else:
+            raise ValueError(f"Unsupported STT service: {service_name}")
+
+    @staticmethod
+    def uses_deepgram(service_name: str) -> bool:
+        """Whether the service listens through Deepgram and can adopt a pooled connection."""
+        return service_name.lower() in ("deepgram", "failover")
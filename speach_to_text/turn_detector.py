@@ -0,0 +1,224 @@
+import math
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+'''
+Author: Sean Baker
+Date: 2024-09-12
+Description: Local end of turn predictor, combines transcript and audio cues so we don't always wait for UtteranceEnd
+'''
+
+SAMPLE_RATE = 8000
+FRAME_MS = 20
+
+
+def _mulaw_table() -> np.ndarray:
+    # G.711 mu-law decode table, indexed by the encoded byte
+    encoded = ~np.arange(256, dtype=np.int32) & 0xFF
+    sign = encoded & 0x80
+    exponent = (encoded >> 4) & 0x07
+    mantissa = encoded & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(sign != 0, -magnitude, magnitude).astype(np.int16)
+
+
+MULAW_TO_LINEAR = _mulaw_table()
+
+INCOMPLETE_ENDINGS = {
+    "and", "but", "or", "so", "because", "if", "then", "the", "a", "an", "to", "of", "for", "with", "in", "on",
+    "at", "my", "your", "is", "are", "was", "i", "we", "um", "uh", "like", "that", "which", "about", "from",
+}
+QUESTION_START = re.compile(
+    r"^(?:what|when|where|who|whom|why|how|which|can|could|would|will|do|does|did|is|are|was|were|should|may)\b")
+
+
+def mulaw_to_linear(payload: bytes) -> np.ndarray:
+    """Decode 8 bit mu-law audio to 16 bit linear samples."""
+    return MULAW_TO_LINEAR[np.frombuffer(payload, dtype=np.uint8)]
+
+
+def frame_features(samples: np.ndarray):
+    """
+    Energy and pitch of one frame of linear audio.
+
+    Returns:
+        tuple: (energy in dBFS, pitch in Hz or 0.0 when unvoiced)
+    """
+    if samples.size == 0:
+        return -100.0, 0.0
+    samples = samples.astype(np.float32)
+    rms = math.sqrt(float(np.mean(samples * samples)))
+    energy_db = 20 * math.log10(rms / 32768.0) if rms > 0 else -100.0
+    if energy_db < -45:
+        return energy_db, 0.0
+
+    # Autocorrelation pitch estimate over 80-400 Hz
+    centered = samples - samples.mean()
+    correlation = np.correlate(centered, centered, mode="full")[centered.size - 1:]
+    min_lag, max_lag = SAMPLE_RATE // 400, min(SAMPLE_RATE // 80, centered.size - 1)
+    if correlation[0] <= 0 or max_lag <= min_lag:
+        return energy_db, 0.0
+    lag = min_lag + int(np.argmax(correlation[min_lag:max_lag]))
+    voiced = correlation[lag] / correlation[0] > 0.3
+    return energy_db, SAMPLE_RATE / lag if voiced else 0.0
+
+
+def text_features(text: str) -> Dict[str, float]:
+    """Transcript cues for whether the caller finished their sentence."""
+    stripped = text.strip()
+    words = re.findall(r"[\w']+", stripped.lower())
+    return {
+        "terminal_punctuation": float(stripped.endswith((".", "!", "?"))),
+        "question": float(stripped.endswith("?") or bool(words and QUESTION_START.match(" ".join(words)))),
+        "incomplete": float(bool(words) and (words[-1] in INCOMPLETE_ENDINGS or stripped.endswith((",", "-")))),
+        "short": float(len(words) <= 2),
+    }
+
+
+class TurnDetector:
+    """
+    Predicts the end of the caller's turn from the running transcript and the
+    inbound audio.
+
+    Transcript features (terminal punctuation, questions, sentences left
+    hanging on a conjunction or article) and acoustic features (trailing
+    energy decay, falling pitch) go through a small logistic model. The turn
+    is declared over once the probability is high enough and the caller has
+    been silent for long enough; how long is enough adapts to the pauses this
+    caller makes mid-turn.
+
+    Args:
+        min_probability (float): Probability needed before the turn can end early.
+        min_silence_ms (float): Shortest trailing silence that can end a turn.
+        max_silence_ms (float): Longest silence we would require, matches the STT utterance end.
+        silence_db (float): Frames below this energy count as silence.
+        record (bool): Keep a trace of frame features and STT events for ``turn_replay``.
+    """
+
+    WEIGHTS = {
+        "bias": -1.0,
+        "terminal_punctuation": 1.6,
+        "question": 0.8,
+        "incomplete": -2.5,
+        "short": -0.4,
+        "energy_decay": 0.9,
+        "pitch_fall": 0.7,
+    }
+
+    def __init__(self, min_probability: float = 0.6, min_silence_ms: float = 200.0,
+                 max_silence_ms: float = 1000.0, silence_db: float = -45.0, record: bool = False):
+        self.min_probability = min_probability
+        self.min_silence_ms = min_silence_ms
+        self.max_silence_ms = max_silence_ms
+        self.silence_db = silence_db
+
+        self.energy: Deque[float] = deque(maxlen=25)
+        self.pitch: Deque[float] = deque(maxlen=25)
+        self.silent_frames = 0
+        self.pauses: Deque[float] = deque(maxlen=50)
+        self._turn_open = False
+        self._ended_early_at: Optional[float] = None
+
+        self.metrics = {"early_ends": 0, "false_cut_ins": 0, "latency_saved_ms": 0.0}
+        # Frame features and STT events for offline replay, see turn_replay
+        self.trace: Optional[List[list]] = [] if record else None
+        self._trace_start = time.monotonic()
+
+    @property
+    def silence_ms(self) -> float:
+        return self.silent_frames * FRAME_MS
+
+    def add_audio(self, payload: bytes):
+        """Feed inbound mu-law audio, any length, in arrival order."""
+        samples = mulaw_to_linear(payload)
+        frame = SAMPLE_RATE * FRAME_MS // 1000
+        for start in range(0, samples.size, frame):
+            self.add_frame(*frame_features(samples[start:start + frame]))
+
+    def add_frame(self, energy_db: float, pitch_hz: float, now: Optional[float] = None):
+        """Feed the features of one 20 ms frame."""
+        self.record("frame", round(energy_db, 1), round(pitch_hz, 1))
+        if energy_db >= self.silence_db:
+            if self._turn_open and self.silent_frames * FRAME_MS >= 100:
+                # The caller paused and kept going, remember how long their mid-turn pauses are
+                self.pauses.append(self.silence_ms)
+            self._check_cut_in(now)
+            self.silent_frames = 0
+            self._turn_open = True
+            self.energy.append(energy_db)
+            self.pitch.append(pitch_hz)
+        else:
+            self.silent_frames += 1
+
+    def acoustic_features(self) -> Dict[str, float]:
+        """Trailing energy decay and pitch fall over the last voiced frames, both scaled to about 0..1."""
+        energy = list(self.energy)
+        voiced = [p for p in self.pitch if p > 0]
+        energy_decay = 0.0
+        if len(energy) >= 6:
+            third = len(energy) // 3
+            energy_decay = (np.mean(energy[:third]) - np.mean(energy[-third:])) / 20.0
+        pitch_fall = 0.0
+        if len(voiced) >= 6:
+            third = len(voiced) // 3
+            start = float(np.mean(voiced[:third]))
+            pitch_fall = (start - float(np.mean(voiced[-third:]))) / max(start, 1.0) * 4.0
+        return {
+            "energy_decay": float(np.clip(energy_decay, -1.0, 1.0)),
+            "pitch_fall": float(np.clip(pitch_fall, -1.0, 1.0)),
+        }
+
+    def probability(self, text: str) -> float:
+        """Probability that the caller's turn is over given the transcript so far."""
+        features = {**text_features(text), **self.acoustic_features()}
+        z = self.WEIGHTS["bias"] + sum(self.WEIGHTS[name] * value for name, value in features.items())
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def required_silence_ms(self, probability: float) -> float:
+        """Silence needed before ending the turn, longer for callers that pause a lot and for unsure predictions."""
+        if len(self.pauses) >= 5:
+            typical_pause = float(np.percentile(self.pauses, 90))
+        else:
+            typical_pause = 500.0
+        required = typical_pause * (1.5 - probability)
+        return float(np.clip(required, self.min_silence_ms, self.max_silence_ms))
+
+    def should_end_turn(self, text: str) -> bool:
+        """Whether the transcript so far can be sent on without waiting for the STT utterance end."""
+        if not text.strip():
+            return False
+        probability = self.probability(text)
+        return probability >= self.min_probability and self.silence_ms >= self.required_silence_ms(probability)
+
+    def end_turn(self, early: bool, now: Optional[float] = None):
+        """Record that the turn was handed to the LLM, early by us or by the STT endpointing."""
+        self._turn_open = False
+        self.energy.clear()
+        self.pitch.clear()
+        if early:
+            self.metrics["early_ends"] += 1
+            self._ended_early_at = now if now is not None else time.monotonic()
+
+    def baseline_end(self, now: Optional[float] = None):
+        """The STT endpointing reached the turn end we already acted on, count the time we saved."""
+        if self._ended_early_at is not None:
+            now = now if now is not None else time.monotonic()
+            self.metrics["latency_saved_ms"] += (now - self._ended_early_at) * 1000
+            self._ended_early_at = None
+
+    def record(self, kind: str, *data):
+        """Append an event to the trace when recording, timestamps are ms since the detector was created."""
+        if self.trace is not None:
+            self.trace.append([round((time.monotonic() - self._trace_start) * 1000), kind, *data])
+
+    def _check_cut_in(self, now: Optional[float]):
+        if self._ended_early_at is None:
+            return
+        # Speech came back before the STT would have ended the turn: we cut the caller off
+        self.metrics["false_cut_ins"] += 1
+        self._ended_early_at = None
+        self.min_probability = min(self.min_probability + 0.05, 0.95)
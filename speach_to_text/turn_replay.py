@@ -0,0 +1,97 @@
+import argparse
+import json
+from typing import Dict, Iterable, List, Sequence
+
+from .turn_detector import TurnDetector
+
+'''
+Author: Sean Baker
+Date: 2024-09-12
+Description: Replays recorded call traces through the TurnDetector to compare latency saved against false cut-ins
+'''
+
+
+def replay(trace: Sequence[list], **detector_options) -> Dict[str, float]:
+    """
+    Run one recorded trace through a fresh TurnDetector.
+
+    A trace is a list of ``[t_ms, kind, *data]`` events as recorded by
+    ``TurnDetector(record=True)``: ``frame`` (energy dB, pitch Hz), ``final``
+    (transcript text) and ``end`` (the STT endpointing closed the turn).
+
+    Args:
+        trace (Sequence[list]): The recorded events in time order.
+        **detector_options: Passed to TurnDetector.
+
+    Returns:
+        Dict[str, float]: turns, early_ends, false_cut_ins and latency_saved_ms.
+    """
+    detector = TurnDetector(**detector_options)
+    text = ""
+    turns = 0
+    for t_ms, kind, *data in trace:
+        now = t_ms / 1000
+        if kind == "frame":
+            detector.add_frame(data[0], data[1], now=now)
+            if text and detector.should_end_turn(text):
+                detector.end_turn(early=True, now=now)
+                text = ""
+                turns += 1
+        elif kind == "final":
+            text += f" {data[0]}"
+        elif kind == "end":
+            detector.baseline_end(now=now)
+            if text:
+                detector.end_turn(early=False, now=now)
+                text = ""
+                turns += 1
+    return {"turns": turns, **detector.metrics}
+
+
+def evaluate(traces: Iterable[Sequence[list]], probabilities: Sequence[float] = (0.5, 0.6, 0.7, 0.8, 0.9)
+             ) -> List[Dict[str, float]]:
+    """
+    Sweep the early end threshold over a set of traces.
+
+    Args:
+        traces (Iterable[Sequence[list]]): The recorded traces.
+        probabilities (Sequence[float]): The min_probability values to try.
+
+    Returns:
+        List[Dict[str, float]]: One row per threshold with totals, the average latency
+        saved per turn and the false cut-in rate per early end.
+    """
+    traces = list(traces)
+    rows = []
+    for probability in probabilities:
+        totals = {"turns": 0, "early_ends": 0, "false_cut_ins": 0, "latency_saved_ms": 0.0}
+        for trace in traces:
+            for name, value in replay(trace, min_probability=probability).items():
+                totals[name] += value
+        rows.append({
+            "min_probability": probability,
+            **totals,
+            "avg_saved_ms_per_turn": totals["latency_saved_ms"] / totals["turns"] if totals["turns"] else 0.0,
+            "false_cut_in_rate": totals["false_cut_ins"] / totals["early_ends"] if totals["early_ends"] else 0.0,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded turn traces through the TurnDetector")
+    parser.add_argument("traces", nargs="+", help="JSON files written with STT_TURN_TRACE_DIR set")
+    args = parser.parse_args()
+
+    traces = []
+    for path in args.traces:
+        with open(path) as f:
+            traces.append(json.load(f))
+
+    print(f"{'p_min':>6} {'turns':>6} {'early':>6} {'cut-ins':>8} {'rate':>6} {'saved/turn ms':>14}")
+    for row in evaluate(traces):
+        print(f"{row['min_probability']:>6.2f} {row['turns']:>6} {row['early_ends']:>6} {row['false_cut_ins']:>8} "
+              f"{row['false_cut_in_rate']:>6.2f} {row['avg_saved_ms_per_turn']:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
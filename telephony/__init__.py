@@ -2,4 +2,4 @@ from .telephony_input_ouput_handler import *
 from .get_twilio_client import *
 from .telephone_base import *
 from .twilio_api import *
-
+from .twilio_client import get_twilio_client, set_twilio_client, close_twilio_client, PooledTwilioHttpClient
@@ -0,0 +1,105 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from aiohttp_retry import ExponentialRetry, RetryClient
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.response import Response
+from twilio.rest import Client
+
+from Utils.logger_config import basic_logger
+
+logger = basic_logger("TwilioClient")
+
+'''
+Author: Sean Baker
+Date: 2024-09-19
+Description: One async Twilio REST client per process, pooled connections, timeouts and retries of safe requests
+'''
+
+TWILIO_TIMEOUT = float(os.getenv("TWILIO_TIMEOUT", 10))
+TWILIO_MAX_RETRIES = int(os.getenv("TWILIO_MAX_RETRIES", 3))
+TWILIO_POOL_SIZE = int(os.getenv("TWILIO_POOL_SIZE", 20))
+
+
+class PooledTwilioHttpClient(AsyncTwilioHttpClient):
+    """
+    Async HTTP transport for the Twilio client.
+
+    The aiohttp session is opened on the first request, inside the event loop
+    that uses it, and keeps up to ``pool_size`` connections to Twilio alive.
+    Every request gets ``timeout`` unless the caller passes its own. Only
+    requests that are safe to repeat (GET, DELETE) are retried, a retried POST
+    could place a second call.
+
+    Args:
+        timeout (float): Total seconds a request may take.
+        max_retries (int): Attempts for GET and DELETE requests.
+        pool_size (int): Connections kept open to Twilio.
+    """
+
+    def __init__(self, timeout: float = TWILIO_TIMEOUT, max_retries: int = TWILIO_MAX_RETRIES,
+                 pool_size: int = TWILIO_POOL_SIZE):
+        super().__init__(pool_connections=False, timeout=timeout)
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+
+    def _open_session(self):
+        session = ClientSession(connector=TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                                timeout=ClientTimeout(total=self.timeout), trace_configs=self.trace_configs)
+        if self.max_retries > 1:
+            retry_options = ExponentialRetry(attempts=self.max_retries, start_timeout=0.2, max_timeout=2.0,
+                                             methods={"GET", "DELETE"})
+            return RetryClient(client_session=session, retry_options=retry_options)
+        return session
+
+    async def request(self, method: str, url: str, params: Optional[Dict[str, object]] = None,
+                      data: Optional[Dict[str, object]] = None, headers: Optional[Dict[str, str]] = None,
+                      auth: Optional[Tuple[str, str]] = None, timeout: Optional[float] = None,
+                      allow_redirects: bool = False) -> Response:
+        if self.session is None:
+            self.session = self._open_session()
+        # The Twilio client passes timeout=None, which aiohttp would read as no timeout at all
+        return await super().request(method, url, params=params, data=data, headers=headers, auth=auth,
+                                     timeout=timeout if timeout is not None else self.timeout,
+                                     allow_redirects=allow_redirects)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+_client: Optional[Client] = None
+
+
+def get_twilio_client() -> Client:
+    """
+    The process-wide Twilio client.
+
+    Use the ``*_async`` methods (``create_async``, ``fetch_async``,
+    ``update_async``, ``list_async``), the synchronous ones would block the
+    event loop and every call on the worker with it.
+
+    Returns:
+        Client: A Twilio client backed by the pooled async transport.
+    """
+    global _client
+    if _client is None:
+        _client = Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"),
+                         http_client=PooledTwilioHttpClient())
+    return _client
+
+
+def set_twilio_client(client: Optional[Client]):
+    """Replace the process-wide client, tests point it at a local stand-in."""
+    global _client
+    _client = client
+
+
+async def close_twilio_client():
+    """Close the shared client's connections, called on shutdown."""
+    global _client
+    if _client is not None:
+        await _client.http_client.close()
+        _client = None
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from DataLibrary.call_archive import CallArchive
+from DataLibrary.database_manager import DatabaseManager
+
+# Archival benchmark: live database size and read cost before and after moving old calls to the archive
+# usage: python testspeed_archive.py [calls ...]
+
+WORDS = ("account balance billing cancel card charge delivery order package refund replace return schedule "
+         "appointment address payment invoice technician warranty upgrade plan password reset agent manager "
+         "tomorrow today morning afternoon please thanks hello yes no maybe broken late missing wrong").split()
+TURNS_PER_CALL = 40
+HISTORY_DAYS = 90
+RETENTION_DAYS = 30
+
+
+async def fill(manager, calls, rng):
+    now = datetime.utcnow()
+    async with manager.engine.begin() as conn:
+        for first in range(0, calls, 500):
+            contexts, turns = [], []
+            for call in range(first, min(first + 500, calls)):
+                started = now - timedelta(days=HISTORY_DAYS * call / calls)
+                contexts.append({"call_sid": f"CA{call:08d}", "from_number": f"+1666{call:07d}",
+                                 "start_time": started, "end_time": started + timedelta(minutes=4)})
+                turns += [{"call_sid": f"CA{call:08d}", "seq": seq, "role": "assistant" if seq % 2 else "user",
+                           "content": " ".join(rng.choices(WORDS, k=12)),
+                           "created_at": started + timedelta(seconds=seq * 6),
+                           "latency_ms": rng.uniform(300, 1500) if seq % 2 else None} for seq in range(TURNS_PER_CALL)]
+            await conn.execute(text("INSERT INTO call_contexts (call_sid, to_number, from_number, start_time, "
+                                    "end_time, call_ended) VALUES (:call_sid, '+15550001111', :from_number, "
+                                    ":start_time, :end_time, 1)"), contexts)
+            await conn.execute(text("INSERT INTO transcript_turns (call_sid, seq, role, content, created_at, "
+                                    "latency_ms) VALUES (:call_sid, :seq, :role, :content, :created_at, :latency_ms)"),
+                               turns)
+
+
+def size_mb(*paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path)) / 1e6
+
+
+def tree_mb(root):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(root) for name in names) / 1e6
+
+
+async def timed(coroutine):
+    started = time.perf_counter()
+    result = await coroutine
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def run(calls):
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "calls.db")
+        files = (path, f"{path}-wal")
+        archive = CallArchive(os.path.join(directory, "archive"))
+        manager = DatabaseManager(f"sqlite+aiosqlite:///{path}", archive=archive)
+        await manager.ensure_schema()
+        await fill(manager, calls, rng)
+        await manager.vacuum()
+
+        before_mb = size_mb(*files)
+        _, list_before_ms = await timed(manager.get_all_call_contexts())
+        archived, archive_ms = await timed(manager.archive_calls(older_than=timedelta(days=RETENTION_DAYS)))
+        after_mb = size_mb(*files)
+        _, list_after_ms = await timed(manager.get_all_call_contexts())
+
+        fetches = []
+        for call in rng.sample(range(calls * RETENTION_DAYS // HISTORY_DAYS + 1, calls), 20):
+            call_data, fetch_ms = await timed(manager.get_archived_call(f"CA{call:08d}"))
+            assert len(call_data["turns"]) == TURNS_PER_CALL
+            fetches.append(fetch_ms)
+        fetches.sort()
+        await manager.close()
+
+        print(f"{calls:>8,} {archived['calls']:>9,} {before_mb:>9.1f} {after_mb:>8.1f} {tree_mb(archive.root):>10.1f} "
+              f"{archive_ms / 1000:>9.2f} {list_before_ms:>9.1f} {list_after_ms:>8.1f} {fetches[len(fetches) // 2]:>9.2f}")
+
+
+async def main(sizes):
+    print(f"{TURNS_PER_CALL} turns per call over {HISTORY_DAYS} days, calls older than {RETENTION_DAYS} days archived")
+    print(f"{'calls':>8} {'archived':>9} {'db MB':>9} {'after':>8} {'archive MB':>10} {'archive s':>9} "
+          f"{'list ms':>9} {'after':>8} {'fetch ms':>9}")
+    for calls in sizes:
+        await run(calls)
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(size) for size in sys.argv[1:]] or [1_000, 10_000, 50_000]))
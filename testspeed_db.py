@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from DataLibrary.database_manager import CallContextModel, DatabaseManager
+from services.call_details import CallContext
+
+# DatabaseManager write benchmark: sustained call context writes/sec with many concurrent calls
+# usage: python testspeed_db.py [calls] [seconds]
+
+
+def make_context(index):
+    context = CallContext()
+    context.call_sid = f"CA{index:05d}"
+    context.stream_sid = f"MZ{index:05d}"
+    context.to_number = "+15550001111"
+    context.from_number = "+15552223333"
+    return context
+
+
+async def call(context, save, deadline, latencies):
+    turn = 0
+    while time.perf_counter() < deadline:
+        context.user_context.append({"role": "user", "content": f"Caller turn {turn} of the conversation"})
+        started = time.perf_counter()
+        await save(context)
+        latencies.append(time.perf_counter() - started)
+        turn += 1
+
+
+async def per_write_transactions(manager, context):
+    """One session and commit per update, what every caller used to do."""
+    async with manager.SessionLocal() as db:
+        await db.merge(CallContextModel(**manager._row(context)))
+        await db.commit()
+
+
+async def measure(name, calls, seconds, per_write=False, **kwargs):
+    with tempfile.TemporaryDirectory() as directory:
+        manager = DatabaseManager(f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}", **kwargs)
+        await manager.ensure_schema()
+        if per_write:
+            save = lambda context: per_write_transactions(manager, context)
+        else:
+            save = manager.update_call_context
+
+        latencies = []
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(*(call(make_context(index), save, deadline, latencies) for index in range(calls)))
+        await manager.flush()
+        elapsed = time.perf_counter() - deadline + seconds
+        transactions = len(latencies) if per_write else manager.metrics["flushes"]
+        await manager.close()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    print(f"{name:<32} {len(latencies) / elapsed:>10,.0f} writes/s {transactions:>7} transactions   "
+          f"p99 {p99:7.1f} ms")
+
+
+async def main(calls, seconds):
+    print(f"{calls} concurrent calls, {seconds}s each")
+    await measure("per write transaction", calls, seconds, per_write=True)
+    await measure("write-behind, 50 ms flush", calls, seconds, flush_interval=0.05)
+    await measure("write-behind, 10 ms flush", calls, seconds, flush_interval=0.01)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+                     float(sys.argv[2]) if len(sys.argv) > 2 else 5.0))
@@ -0,0 +1,49 @@
+import asyncio
+import sys
+import time
+
+from EventHandlers.event_manager import BACKGROUND, CONCURRENT, INLINE, EventHandler
+
+# EventHandler dispatch benchmark: events/sec for the subscriber shapes a call uses
+# usage: python testspeed_events.py [events]
+
+
+def sync_callback(index, audio):
+    pass
+
+
+async def async_callback(index, audio):
+    pass
+
+
+async def slow_callback(index, audio):
+    await asyncio.sleep(0)
+
+
+async def measure(name, subscribers, events):
+    emitter = EventHandler()
+    for callback, mode in subscribers:
+        emitter.on('speech', callback, mode)
+
+    start = time.perf_counter()
+    for index in range(events):
+        await emitter.createEvent('speech', index, "audio")
+    await emitter.drain()
+    elapsed = time.perf_counter() - start
+
+    stats = emitter.metrics()['speech']
+    print(f"{name:<36} {events / elapsed:>12,.0f} events/s   mean {stats['mean_ms'] * 1000:.2f}us")
+
+
+async def main(events):
+    await measure("1 sync", [(sync_callback, INLINE)], events)
+    await measure("1 async inline", [(async_callback, INLINE)], events)
+    await measure("3 async inline", [(async_callback, INLINE)] * 3, events)
+    await measure("3 async concurrent", [(async_callback, CONCURRENT)] * 3, events)
+    await measure("inline + slow subscriber inline", [(async_callback, INLINE), (slow_callback, INLINE)], events)
+    await measure("inline + slow subscriber background", [(async_callback, INLINE), (slow_callback, BACKGROUND)],
+                  events)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
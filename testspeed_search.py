@@ -0,0 +1,87 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from DataLibrary.database_manager import DatabaseManager
+
+# Transcript search benchmark: query latency versus number of indexed turns
+# usage: python testspeed_search.py [turns ...]
+
+WORDS = ("account balance billing cancel card charge delivery order package refund replace return schedule "
+         "appointment address payment invoice technician warranty upgrade plan password reset agent manager "
+         "tomorrow today morning afternoon please thanks hello yes no maybe broken late missing wrong").split()
+RARE = "chargeback"
+TURNS_PER_CALL = 40
+QUERIES = (
+    ("common word", "refund", {}),
+    ("rare word", RARE, {}),
+    ("phrase", '"delivery late"', {}),
+    ("prefix", "tech*", {}),
+    ("number filter", "refund", {"number": "+15550000007"}),
+    ("ranked", "refund", {"order": "rank"}),
+)
+
+
+def make_turns(start, count, rng):
+    base = datetime(2024, 1, 1)
+    for turn_id in range(start, start + count):
+        call = turn_id // TURNS_PER_CALL
+        words = rng.choices(WORDS, k=12)
+        if rng.random() < 0.0005:
+            words[3] = RARE
+        yield {"call_sid": f"CA{call:08d}", "seq": turn_id % TURNS_PER_CALL, "role": "user",
+               "content": " ".join(words), "created_at": base + timedelta(seconds=turn_id * 5)}
+
+
+async def grow(manager, current, target, rng):
+    async with manager.engine.begin() as conn:
+        for start in range(current, target, 10_000):
+            count = min(10_000, target - start)
+            await conn.execute(text("INSERT INTO transcript_turns (call_sid, seq, role, content, created_at) "
+                                    "VALUES (:call_sid, :seq, :role, :content, :created_at)"),
+                               list(make_turns(start, count, rng)))
+        # A repeat caller with three calls, every other caller calls once
+        calls = [{"call_sid": f"CA{call:08d}",
+                  "number": "+15550000007" if call in (7, 107, 207) else f"+1666{call:07d}"}
+                 for call in range(current // TURNS_PER_CALL, (target + TURNS_PER_CALL - 1) // TURNS_PER_CALL)]
+        await conn.execute(text("INSERT OR IGNORE INTO call_contexts (call_sid, to_number, from_number) "
+                                "VALUES (:call_sid, '+15550001111', :number)"), calls)
+
+
+async def measure(manager, turns, repeats=20):
+    row = [f"{turns:>10,}"]
+    for name, query, kwargs in QUERIES:
+        latencies = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            await manager.search_turns(query, limit=20, **kwargs)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        p50, p95 = latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000
+        row.append(f"{p50:>8.2f}/{p95:<7.2f}")
+    print(" ".join(row))
+
+
+async def main(sizes):
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = DatabaseManager(f"sqlite+aiosqlite:///{os.path.join(directory, 'search.db')}")
+        await manager.ensure_schema()
+        print("p50/p95 ms per query, 20 results")
+        print(f"{'turns':>10} " + " ".join(f"{name:>16}" for name, _, _ in QUERIES))
+        current = 0
+        for size in sizes:
+            await grow(manager, current, size, rng)
+            current = size
+            await measure(manager, size)
+        await manager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000]))
@@ -0,0 +1,62 @@
+import asyncio
+import sys
+import time
+import wave
+
+import numpy as np
+
+from speach_to_text.offline_stt import OfflineTranscriptionService, shutdown_decoder_pool
+
+# Offline STT benchmark: decodes an 8 kHz mono 16 bit WAV through the CPU backend
+# usage: python testspeed_stt.py recording.wav [concurrent calls]
+
+
+def linear_to_mulaw(samples):
+    # G.711 mu-law encoder, truncates to 14 bits before adding the bias like the reference (audioop.lin2ulaw)
+    samples = samples.astype(np.int32) >> 2
+    mask = np.where(samples < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(samples) + 33, 0x1FFF)
+    segment = np.floor(np.log2(magnitude)).astype(np.int32) - 5
+    mantissa = (magnitude >> (segment + 1)) & 0x0F
+    return (((segment << 4) | mantissa) ^ mask).astype(np.uint8).tobytes()
+
+
+async def run_call(audio, results):
+    service = OfflineTranscriptionService()
+    turns = []
+    service.on('transcription', lambda text: turns.append(text))
+    await service.connect()
+
+    start = time.perf_counter()
+    for offset in range(0, len(audio), 160):
+        await service.send(audio[offset:offset + 160])
+        await asyncio.sleep(0)
+    while service.ring.pending >= service.chunk_bytes or service._decoding is not None:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    results.append((elapsed, service.real_time_factor, turns))
+    await service.disconnect()
+
+
+async def main(path, calls):
+    with wave.open(path) as f:
+        if f.getframerate() != 8000 or f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise SystemExit("Expected an 8 kHz mono 16 bit WAV")
+        audio = linear_to_mulaw(np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16))
+
+    results = []
+    await asyncio.gather(*(run_call(audio, results) for _ in range(calls)))
+    shutdown_decoder_pool()
+
+    seconds = len(audio) / 8000
+    elapsed = [r[0] for r in results]
+    factors = [r[1] for r in results]
+    print(f"{calls} calls of {seconds:.1f}s audio")
+    print(f"Wall time per call: avg {np.mean(elapsed):.2f}s, max {np.max(elapsed):.2f}s")
+    print(f"Decode real time factor: avg {np.mean(factors):.3f}, max {np.max(factors):.3f}")
+    print(f"Turns: {results[0][2]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1))
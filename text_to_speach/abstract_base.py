@@ -1,5 +1,6 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from dotenv import load_dotenv
 from EventHandlers import EventHandler
@@ -17,6 +18,11 @@ Description: TTS text to speach currently implemented elevenlabs still need to f
 class AbstractTTSService(EventHandler, ABC):
     """Abstract base class for Text-to-Speech (TTS) services."""
 
+    def __init__(self):
+        super().__init__()
+        # Text -> base64 audio for phrases rendered ahead of time (tool preambles, greetings)
+        self.phrase_cache: Dict[str, str] = {}
+
     @abstractmethod
     async def generate(self, llm_reply: Dict[str, Any], interaction_count: int):
         """Generate speech from the given LLM reply and interaction count.
@@ -31,6 +37,37 @@ class AbstractTTSService(EventHandler, ABC):
 
         pass
 
+    async def render(self, text: str) -> Optional[str]:
+        """Render text to base64 encoded audio without emitting a speech event.
+
+        Args:
+            text (str): The text to render.
+
+        Returns:
+            Optional[str]: The base64 encoded audio, or None if rendering failed or the service
+                does not render ahead of time.
+        """
+
+        return None
+
+    async def prerender(self, phrases: List[str]):
+        """Render phrases ahead of time so generate can stream them without a TTS round trip.
+
+        Args:
+            phrases (List[str]): The phrases to render, already cached phrases are skipped.
+
+        Returns:
+            None
+        """
+
+        pending = [phrase for phrase in dict.fromkeys(phrases) if phrase and phrase not in self.phrase_cache]
+        results = await asyncio.gather(*(self.render(phrase) for phrase in pending), return_exceptions=True)
+        for phrase, audio in zip(pending, results):
+            if isinstance(audio, Exception):
+                logger.error(f"Error pre-rendering '{phrase}': {audio}")
+            elif audio:
+                self.phrase_cache[phrase] = audio
+
     @abstractmethod
     async def set_voice(self, voice_id: str):
         """Set the voice for speech generation.
@@ -1,7 +1,6 @@
-import base64
 import os
-import numpy as np
 from deepgram import DeepgramClient
+from networking.audio_pool import shared_audio_pool
 from .abstract_base import AbstractTTSService, logger
 
 
@@ -31,42 +30,46 @@ class DeepgramTTS(AbstractTTSService):
             return
 
         try:
-            source = {
-                "text": partial_response
-            }
+            audio_base64 = self.phrase_cache.get(partial_response)
+            if audio_base64 is None:
+                audio_base64 = await self.render(partial_response)
 
-            options = {
-                "model": "aura-asteria-en",
-                "encoding": "mulaw",
-                "sample_rate": 8000
-            }
+            if audio_base64:
+                await self.createEvent('speech', partial_response_index, audio_base64, partial_response,
+                                       interaction_count)
 
-            response = await self.client.asyncspeak.v("1").stream(
-                source={"text": partial_response},
-                options=options
-            )
+        except Exception as e:
+            logger.error(f"Error in TTS generation: {str(e)}")
 
-            if response.stream:
-                audio_content = response.stream.getvalue()
+    async def render(self, text):
+        """
+        Render text to base64 encoded mu-law audio without emitting a speech event.
 
-                # Convert audio to numpy array
-                audio_array = np.frombuffer(audio_content, dtype=np.uint8)
+        Args:
+            text (str): The text to render.
 
-                # Trim the first 10ms (80 samples at 8000Hz) to remove the initial noise
-                trim_samples = 80
-                trimmed_audio = audio_array[trim_samples:]
+        Returns:
+            str: The base64 encoded audio, or None if no audio was returned.
+        """
+        options = {
+            "model": "aura-asteria-en",
+            "encoding": "mulaw",
+            "sample_rate": 8000
+        }
 
-                # Convert back to bytes
-                trimmed_audio_bytes = trimmed_audio.tobytes()
+        response = await self.client.asyncspeak.v("1").stream(
+            source={"text": text},
+            options=options
+        )
 
-                audio_base64 = base64.b64encode(trimmed_audio_bytes).decode('utf-8')
-                await self.createEvent('speech', partial_response_index, audio_base64, partial_response,
-                                       interaction_count)
-            else:
-                logger.error("Error in TTS generation: No audio stream returned")
+        if not response.stream:
+            logger.error("Error in TTS generation: No audio stream returned")
+            return None
 
-        except Exception as e:
-            logger.error(f"Error in TTS generation: {str(e)}")
+        audio_content = response.stream.getvalue()
+
+        # Trim the first 10ms (80 samples at 8000Hz) to remove the initial noise, long audio is encoded off the loop
+        return await shared_audio_pool().run("trim_encode", audio_content, trim_bytes=80)
 
     async def set_voice(self, voice_id):
         """
@@ -1,7 +1,7 @@
-import base64
 import os
 from typing import Dict, Any
 import aiohttp
+from networking.audio_pool import shared_audio_pool
 from .abstract_base import AbstractTTSService, logger
 
 
@@ -71,29 +71,48 @@ class ElevenLabsTTS(AbstractTTSService):
             return
 
         try:
-            output_format = "ulaw_8000"
-            url = f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}/stream"
-            headers = {
-                "xi-api-key": self.api_key,
-                "Content-Type": "application/json",
-                "Accept": "audio/wav"
-            }
-            params = {
-                "output_format": output_format,
-                "optimize_streaming_latency": 4
-            }
-            data = {
-                "model_id": self.model_id,
-                "text": partial_response
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, params=params, json=data) as response:
-                    if response.status == 200:
-                        audio_content = await response.read()
-                        audio_base64 = base64.b64encode(audio_content).decode('utf-8')
-                        await self.createEvent('speech', partial_response_index, audio_base64, partial_response,
-                                               interaction_count)
+            audio_base64 = self.phrase_cache.get(partial_response)
+            if audio_base64 is None:
+                audio_base64 = await self.render(partial_response)
+
+            if audio_base64:
+                await self.createEvent('speech', partial_response_index, audio_base64, partial_response,
+                                       interaction_count)
         except Exception as err:
             logger.error("Error occurred in ElevenLabs TTS service", exc_info=True)
             logger.error(str(err))
+
+    async def render(self, text: str):
+        """
+        Renders text to base64 encoded mu-law audio without emitting a speech event.
+
+        Args:
+            text (str): The text to render.
+
+        Returns:
+            str: The base64 encoded audio, or None if the request failed.
+
+        """
+        output_format = "ulaw_8000"
+        url = f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}/stream"
+        headers = {
+            "xi-api-key": self.api_key,
+            "Content-Type": "application/json",
+            "Accept": "audio/wav"
+        }
+        params = {
+            "output_format": output_format,
+            "optimize_streaming_latency": 4
+        }
+        data = {
+            "model_id": self.model_id,
+            "text": text
+        }
+
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, headers=headers, params=params, json=data) as response:
+                if response.status == 200:
+                    audio_content = await response.read()
+                    return await shared_audio_pool().run("trim_encode", audio_content)
+                logger.error(f"ElevenLabs TTS request failed with status {response.status}")
+                return None
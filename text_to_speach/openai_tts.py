@@ -1,13 +1,14 @@
 from collections import deque
 import os
 from dotenv import load_dotenv
-from bolna.helpers.logger_config import configure_logger
-from bolna.helpers.utils import convert_audio_to_wav, create_ws_data_packet, pcm_to_wav_bytes, resample
+from Utils.logger_config import basic_logger
+from networking.audio_pool import shared_audio_pool
+from networking.audio_utils import create_ws_data_packet
 from .abstract_base import AbstractTTSService
 from openai import AsyncOpenAI
 import io
 
-logger = configure_logger(__name__)
+logger = basic_logger(__name__)
 load_dotenv()
 
 
@@ -73,8 +74,7 @@ class OPENAISynthesizer(AbstractTTSService):
                         if not self.first_chunk_generated:
                             meta_info["is_first_chunk"] = True
                             self.first_chunk_generated = True
-                        yield create_ws_data_packet(
-                            resample(convert_audio_to_wav(chunk, 'mp3'), self.sample_rate, format="wav"), meta_info)
+                        yield create_ws_data_packet(await self.to_wav(chunk), meta_info)
 
                     if "end_of_llm_stream" in meta_info and meta_info["end_of_llm_stream"]:
                         meta_info["end_of_synthesizer_stream"] = True
@@ -91,12 +91,15 @@ class OPENAISynthesizer(AbstractTTSService):
                     if "end_of_llm_stream" in meta_info and meta_info["end_of_llm_stream"]:
                         meta_info["end_of_synthesizer_stream"] = True
                         self.first_chunk_generated = False
-                    yield create_ws_data_packet(
-                        resample(convert_audio_to_wav(audio, 'mp3'), self.sample_rate, format="wav"), meta_info)
+                    yield create_ws_data_packet(await self.to_wav(audio), meta_info)
 
         except Exception as e:
             logger.error(f"Error in openai generate {e}")
 
+    async def to_wav(self, audio):
+        # ffmpeg decode and resampling run in the audio worker processes, not on the event loop
+        return await shared_audio_pool().run("to_wav", audio, source_format="mp3", sample_rate=self.sample_rate)
+
     async def open_connection(self):
         pass
 
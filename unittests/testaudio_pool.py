@@ -0,0 +1,114 @@
+import asyncio
+import base64
+import os
+import time
+import unittest
+
+from networking.audio_pool import AudioWorkerPool, SHARED_MEMORY_MIN_BYTES
+
+
+def shared_segments():
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")} if os.path.isdir("/dev/shm") else set()
+
+
+class TestAudioWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.segments = shared_segments()
+
+    def tearDown(self):
+        self.assertEqual(shared_segments() - self.segments, set())
+
+    def test_small_jobs_run_inline(self):
+        async def scenario():
+            pool = AudioWorkerPool(workers=1)
+            audio = bytes(range(200))
+            self.assertEqual(await pool.run("trim_encode", audio, trim_bytes=80),
+                             base64.b64encode(audio[80:]).decode())
+            self.assertEqual(pool.metrics()["jobs"]["trim_encode"]["inline"], 1)
+            self.assertIsNone(pool._executor)
+
+        asyncio.run(scenario())
+
+    def test_large_payloads_go_through_shared_memory(self):
+        async def scenario():
+            pool = AudioWorkerPool(workers=2, inline=False)
+            try:
+                audio = os.urandom(SHARED_MEMORY_MIN_BYTES * 4)
+                encoded = await pool.run("trim_encode", audio, trim_bytes=80)
+                self.assertEqual(encoded, base64.b64encode(audio[80:]).decode())
+
+                stats = pool.metrics()["jobs"]
+                self.assertEqual((stats["trim_encode"]["count"], stats["trim_encode"]["inline"]), (1, 0))
+            finally:
+                pool.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_queue_depth_and_loop_stays_free(self):
+        async def scenario():
+            pool = AudioWorkerPool(workers=2, inline=False)
+            try:
+                # Start both workers first, forking them is not what is measured
+                await asyncio.gather(*(pool.run("trim_encode", os.urandom(SHARED_MEMORY_MIN_BYTES)) for _ in range(2)))
+                audio = bytes(16 * 1024 * 1024)
+                lags = []
+
+                async def ticker(stop):
+                    while not stop.done():
+                        started = time.perf_counter()
+                        await asyncio.sleep(0.005)
+                        lags.append(time.perf_counter() - started - 0.005)
+
+                jobs = asyncio.gather(*(pool.run("trim_encode", audio) for _ in range(4)))
+                await ticker(jobs)
+                results = await jobs
+
+                self.assertEqual(results[0], base64.b64encode(audio).decode())
+                self.assertEqual(pool.metrics()["max_queue_depth"], 4)
+                self.assertEqual(pool.queue_depth, 0)
+                # Far below the jobs' own run time, the loop only copies payloads in and out of shared memory
+                self.assertLess(max(lags), 0.25)
+            finally:
+                pool.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_cancelled_jobs_release_shared_memory(self):
+        async def scenario():
+            pool = AudioWorkerPool(workers=1, inline=False)
+            try:
+                busy = asyncio.ensure_future(pool.run("trim_encode", bytes(32 * 1024 * 1024)))
+                # Queued behind the busy worker, its input waits in shared memory
+                job = asyncio.ensure_future(pool.run("trim_encode", os.urandom(SHARED_MEMORY_MIN_BYTES)))
+                await asyncio.sleep(0.01)
+                self.assertTrue(shared_segments() - self.segments)
+                job.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await job
+                # The worker gets to it on its own, its input is unlinked when it does
+                await busy
+                for _ in range(100):
+                    if not shared_segments() - self.segments:
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertEqual(shared_segments() - self.segments, set())
+            finally:
+                pool.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_errors_are_raised_and_counted(self):
+        async def scenario():
+            pool = AudioWorkerPool(workers=1, inline=False)
+            try:
+                with self.assertRaises(TypeError):
+                    await pool.run("trim_encode", os.urandom(SHARED_MEMORY_MIN_BYTES * 2), trim_bytes="80")
+                self.assertEqual(pool.metrics()["jobs"]["trim_encode"]["errors"], 1)
+            finally:
+                pool.shutdown()
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+
+from networking.bounded_queue import BLOCK, DROP_NEWEST, DROP_OLDEST, BoundedQueue
+
+
+class TestBoundedQueue(unittest.TestCase):
+    def test_drop_oldest_keeps_the_newest_items(self):
+        async def scenario():
+            queue = BoundedQueue(3, DROP_OLDEST, "media")
+            for item in range(10):
+                await queue.put(item)
+            self.assertEqual(queue.drain(), [7, 8, 9])
+            self.assertEqual((queue.high_water, queue.dropped), (3, 7))
+
+        asyncio.run(scenario())
+
+    def test_drop_newest_keeps_the_oldest_items(self):
+        queue = BoundedQueue(2, DROP_NEWEST)
+        self.assertEqual([queue.offer(item) for item in "abc"], [True, True, False])
+        self.assertEqual(queue.drain(), ["a", "b"])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_block_waits_for_room(self):
+        async def scenario():
+            queue = BoundedQueue(1, BLOCK)
+            await queue.put("a")
+            with self.assertRaises(asyncio.QueueFull):
+                queue.offer("b")
+            waiter = asyncio.create_task(queue.put("b"))
+            await asyncio.sleep(0.02)
+            self.assertFalse(waiter.done())
+
+            self.assertEqual(await queue.get(), "a")
+            await waiter
+            self.assertEqual(queue.metrics()["blocked"], 1)
+            self.assertGreater(queue.metrics()["blocked_ms"], 10)
+
+        asyncio.run(scenario())
+
+    def test_blocked_producers_are_served_in_order(self):
+        async def scenario():
+            queue = BoundedQueue(1, BLOCK)
+            received = []
+
+            async def producer(name):
+                for index in range(5):
+                    await queue.put((name, index))
+
+            async def consumer():
+                while len(received) < 15:
+                    received.append(await queue.get())
+
+            await asyncio.gather(producer("a"), producer("b"), producer("c"), consumer())
+            # No producer falls more than one round behind the others
+            for position, (name, index) in enumerate(received):
+                self.assertLessEqual(abs(index - position // 3), 1)
+
+        asyncio.run(scenario())
+
+    def test_invalid_configuration_is_rejected(self):
+        with self.assertRaises(ValueError):
+            BoundedQueue(0)
+        with self.assertRaises(ValueError):
+            BoundedQueue(4, "drop_everything")
+
+
+if __name__ == '__main__':
+    unittest.main()
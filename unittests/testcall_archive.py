@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+
+from DataLibrary.call_archive import CALL_COLUMNS, TURN_COLUMNS, CallArchive, read_columns, write_columns
+
+
+def make_turns(call_sid, count):
+    return [{"call_sid": call_sid, "seq": seq, "role": "assistant" if seq % 2 else "user", "name": None,
+             "content": f"Réponse {seq} of {call_sid}", "created_at": "2024-09-01T10:00:00",
+             "latency_ms": 120.5 if seq % 2 else None, "tokens": 5} for seq in range(count)]
+
+
+class TestCallArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = CallArchive(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_columns_round_trip(self):
+        path = os.path.join(self.directory.name, "turns.gpc")
+        rows = make_turns("CA1", 3)
+        write_columns(path, TURN_COLUMNS, rows)
+
+        columns = read_columns(path)
+        self.assertEqual(columns["content"], [row["content"] for row in rows])
+        self.assertEqual(columns["latency_ms"], [None, 120.5, None])
+        self.assertEqual(columns["seq"], [0, 1, 2])
+        # Only the columns asked for are read
+        self.assertEqual(list(read_columns(path, ["role"])), ["role"])
+
+    def test_repetitive_columns_compress(self):
+        path = os.path.join(self.directory.name, "turns.gpc")
+        rows = make_turns("CA1", 2000)
+        size = write_columns(path, TURN_COLUMNS, rows)
+        self.assertEqual(size, os.path.getsize(path))
+        self.assertLess(size, len(json.dumps(rows)) / 10)
+
+    def test_calls_are_read_back_from_their_row_range(self):
+        turns = make_turns("CA2", 4) + make_turns("CA1", 3)
+        calls = [{"call_sid": "CA1", "turn_count": 3, "tokens": 15}, {"call_sid": "CA2", "turn_count": 4, "tokens": 20},
+                 {"call_sid": "CA3", "turn_count": 0, "tokens": 0}]
+        ranges = self.archive.write("2024-09-01", calls, turns)
+
+        path, start, count = ranges["CA2"]
+        self.assertTrue(path.startswith(os.path.join(self.directory.name, "date=2024-09-01")))
+        self.assertEqual([turn["seq"] for turn in CallArchive.read_turns(path, start, count)], [0, 1, 2, 3])
+        self.assertEqual({turn["call_sid"] for turn in CallArchive.read_turns(*ranges["CA1"])}, {"CA1"})
+        self.assertEqual(CallArchive.read_turns(*ranges["CA3"]), [])
+
+    def test_scan_reads_partitions_in_range(self):
+        for day in ("2024-09-01", "2024-09-02", "2024-09-03"):
+            self.archive.write(day, [{"call_sid": day, "turn_count": 1, "tokens": 1}], make_turns(day, 1))
+
+        scanned = list(self.archive.scan("calls", since="2024-09-02", until="2024-09-03", columns=["call_sid"]))
+        self.assertEqual(scanned, [{"call_sid": ["2024-09-02"]}])
+        self.assertEqual(len(list(self.archive.scan("turns"))), 3)
+        self.assertEqual(set(list(self.archive.scan("calls"))[0]), {name for name, _ in CALL_COLUMNS})
+
+
+if __name__ == '__main__':
+    unittest.main()
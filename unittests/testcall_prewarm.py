@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock
+
+from services.call_prewarm import CallPrewarmRegistry
+
+
+class TestCallPrewarmRegistry(unittest.TestCase):
+    def make_registry(self, **kwargs):
+        self.connection = AsyncMock()
+        self.stt_connect = AsyncMock(return_value=self.connection)
+        self.render_greeting = AsyncMock(return_value="Z3JlZXRpbmc=")
+        self.llm_warm_up = AsyncMock()
+        return CallPrewarmRegistry(self.stt_connect, self.render_greeting, self.llm_warm_up, **kwargs)
+
+    def test_prepared_call_is_claimed_on_start(self):
+        async def scenario():
+            registry = self.make_registry()
+            registry.prepare("CA123", "Hello there")
+            prepared = registry.claim("CA123")
+            return registry, await prepared.take_stt_connection(), await prepared.take_greeting()
+
+        registry, connection, greeting = asyncio.run(scenario())
+        self.assertIs(connection, self.connection)
+        self.assertEqual(greeting, "Z3JlZXRpbmc=")
+        self.render_greeting.assert_awaited_once_with("Hello there")
+        self.llm_warm_up.assert_awaited_once()
+        self.assertIsNone(registry.claim("CA123"))
+
+    def test_start_call_then_incoming_reuses_the_greeting(self):
+        async def scenario():
+            registry = self.make_registry()
+            registry.prepare("CA123", "Hello there", stt=False)
+            registry.prepare("CA123", "Hello there")
+            prepared = registry.claim("CA123")
+            await prepared.take_greeting()
+            return await prepared.take_stt_connection()
+
+        self.assertIs(asyncio.run(scenario()), self.connection)
+        self.render_greeting.assert_awaited_once()
+        self.stt_connect.assert_awaited_once()
+
+    def test_customer_profile_is_loaded_on_prepare(self):
+        async def scenario():
+            load_profile = AsyncMock(return_value={"name": "Ada"})
+            registry = self.make_registry(load_profile=load_profile)
+            registry.prepare("CA123", "Hello there", customer_number="+15552223333")
+            registry.prepare("CA123", "Hello there", customer_number="+15552223333")
+            prepared = registry.claim("CA123")
+            self.assertEqual(prepared.customer_number, "+15552223333")
+            self.assertEqual(await prepared.take_profile(), {"name": "Ada"})
+            load_profile.assert_awaited_once_with("+15552223333")
+
+            # Without a number or a loader nothing is looked up
+            registry.prepare("CA456", "Hello there")
+            self.assertIsNone(await registry.claim("CA456").take_profile())
+
+        asyncio.run(scenario())
+
+    def test_unclaimed_calls_are_released(self):
+        async def scenario():
+            registry = self.make_registry(ttl=0.01)
+            registry.prepare("CA123", "Hello there")
+            await asyncio.sleep(0.05)
+            registry.prepare("CA456")
+            # The release is referenced until it finishes
+            self.assertEqual(len(registry._releasing), 1)
+            await asyncio.gather(*registry._releasing)
+            self.assertEqual(registry._releasing, set())
+            return registry
+
+        registry = asyncio.run(scenario())
+        self.assertEqual(registry.metrics["expired"], 1)
+        self.connection.finish.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
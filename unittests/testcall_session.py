@@ -0,0 +1,430 @@
+import asyncio
+import base64
+import gc
+import json
+import logging
+import tracemalloc
+import unittest
+from unittest.mock import AsyncMock
+
+from fastapi import WebSocketDisconnect
+
+from EventHandlers import EventHandler
+from networking import DROP_OLDEST, BoundedQueue
+from services.call_prewarm import CallPrewarmRegistry
+from services.call_session import CallSession, SessionState
+
+
+class FakeWebSocket:
+    """Replays Twilio messages, then either sends stop or drops like a lost connection."""
+
+    def __init__(self, frames=5, stop=False, hang_up=None):
+        audio = base64.b64encode(bytes([0xFF]) * 160).decode()
+        self.messages = [{"event": "start", "start": {"streamSid": "MZ1", "callSid": "CA1"}}]
+        self.messages += [{"event": "media", "media": {"payload": audio}} for _ in range(frames)]
+        self.messages.append({"event": "mark", "mark": {"name": "unknown"}})
+        if stop:
+            self.messages.append({"event": "stop"})
+        self.sent = []
+        self.hang_up = hang_up
+
+    async def receive_text(self):
+        await asyncio.sleep(0)
+        if not self.messages and self.hang_up is not None:
+            await self.hang_up.wait()
+        if not self.messages:
+            raise WebSocketDisconnect(code=1006)
+        return json.dumps(self.messages.pop(0))
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+class StalledWebSocket(FakeWebSocket):
+    """A caller whose connection stops draining, media writes wait until ``unstall`` is set."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.unstall = asyncio.Event()
+
+    async def send_json(self, data):
+        if data["event"] == "media":
+            await self.unstall.wait()
+        await super().send_json(data)
+
+
+class FakeSTT(EventHandler):
+    def __init__(self):
+        super().__init__()
+        self.received = 0
+        self.connected = False
+
+    def set_stream_sid(self, stream_sid):
+        self.stream_sid = stream_sid
+
+    async def connect(self, connection=None):
+        self.connected = True
+
+    async def send(self, payload):
+        self.received += 1
+        if self.received == 3:
+            await self.createEvent('transcription', "What time do you open?")
+
+    async def disconnect(self):
+        self.connected = False
+
+
+class StalledSTT(FakeSTT):
+    """STT that stops accepting audio after a few frames."""
+
+    async def send(self, payload):
+        self.received += 1
+        if self.received > 3:
+            await asyncio.Event().wait()
+
+
+class FakeRouter:
+    def prerender_phrases(self):
+        return []
+
+
+class FakeLLM(EventHandler):
+    def __init__(self):
+        super().__init__()
+        self.intent_router = FakeRouter()
+        self.completions = []
+
+    def set_call_context(self, context):
+        self.context = context
+
+    async def fast_path(self, text, interaction_count):
+        return False
+
+    async def completion(self, text, interaction_count):
+        self.completions.append(text)
+        await self.createEvent('llmreply', {"partialResponseIndex": 0, "partialResponse": "We open at nine."},
+                               interaction_count)
+
+    def reset(self):
+        pass
+
+
+class FakeTTS(EventHandler):
+    def __init__(self):
+        super().__init__()
+        self.phrase_cache = {}
+        self.disconnected = False
+
+    async def prerender(self, phrases):
+        await asyncio.sleep(0.01)
+
+    async def generate(self, llm_reply, interaction_count):
+        audio = base64.b64encode(bytes([0xFF]) * 800).decode()
+        await self.createEvent('speech', llm_reply['partialResponseIndex'], audio, llm_reply['partialResponse'],
+                               interaction_count)
+
+    async def disconnect(self):
+        self.disconnected = True
+
+
+class SentenceLLM(FakeLLM):
+    """Streams a reply of several sentences, each one emitted as its own llmreply."""
+
+    def __init__(self, sentences=4):
+        super().__init__()
+        self.sentences = sentences
+        self.finished_at = None
+
+    async def completion(self, text, interaction_count):
+        self.completions.append(text)
+        for index in range(self.sentences):
+            await self.createEvent('llmreply', {"partialResponseIndex": index, "partialResponse": f"Sentence {index}."},
+                                   interaction_count)
+        self.finished_at = asyncio.get_running_loop().time()
+
+
+class SlowTTS(FakeTTS):
+    """Takes longer for earlier sentences, so parallel synthesis finishes them out of order."""
+
+    def __init__(self, delay=0.05):
+        super().__init__()
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def generate(self, llm_reply, interaction_count):
+        index = llm_reply['partialResponseIndex']
+        if index is None:
+            return
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep((4 - index) * self.delay)
+        finally:
+            self.active -= 1
+        audio = base64.b64encode(bytes([index]) * 800).decode()
+        await self.createEvent('speech', index, audio, llm_reply['partialResponse'], interaction_count)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.saves = []
+
+    def save_call_context(self, call_context, latency_ms=None):
+        self.saves.append((len(call_context.user_context), call_context.call_ended, latency_ms))
+
+
+def played_indexes(websocket):
+    return [base64.b64decode(message["media"]["payload"])[0] for message in websocket.sent
+            if message["event"] == "media"]
+
+
+def make_session(**kwargs):
+    return CallSession(FakeWebSocket(**kwargs), llm_service=FakeLLM(), stt_service=FakeSTT(), tts_service=FakeTTS())
+
+
+class TestCallSession(unittest.TestCase):
+    def test_stop_event_ends_session_and_releases_services(self):
+        async def scenario():
+            session = make_session(stop=True)
+            await session.run()
+
+            self.assertEqual(session.state, SessionState.CLOSED)
+            self.assertFalse(session.stt_service.connected)
+            self.assertTrue(session.tts_service.disconnected)
+            self.assertEqual(session.llm_service.completions, ["What time do you open?"])
+            self.assertEqual(session.call_context.stream_sid, "MZ1")
+            self.assertIsNone(session.call_context.mark_tracker)
+            self.assertEqual(session.stt_service._events, {})
+            stored = await session.call_store.get("CA1")
+            self.assertTrue(stored.call_ended)
+            self.assertEqual(stored.stream_sid, "MZ1")
+            self.assertLessEqual(stored.start_time, stored.end_time)
+            self.assertEqual(session.capacity.sessions, 0)
+            self.assertEqual(set(session.capacity.providers.values()), {0})
+            self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+        asyncio.run(scenario())
+
+    def test_turns_are_queued_for_the_database(self):
+        async def scenario():
+            database = FakeDatabase()
+            session = CallSession(FakeWebSocket(stop=True), llm_service=FakeLLM(), stt_service=FakeSTT(),
+                                  tts_service=FakeTTS(), database=database)
+            await session.run()
+
+            # Call start, the answered turn with its latency, call end
+            self.assertEqual(len(database.saves), 3)
+            self.assertIsNone(database.saves[0][2])
+            self.assertGreaterEqual(database.saves[1][2], 0)
+            self.assertTrue(database.saves[2][1])
+
+        asyncio.run(scenario())
+
+    def test_caller_profile_is_merged_before_the_first_llm_turn(self):
+        class PromptLLM(FakeLLM):
+            async def completion(self, text, interaction_count):
+                self.prompt = self.system_message
+                await super().completion(text, interaction_count)
+
+        async def load_profile(number):
+            return {"phone_number": number, "name": "Ada", "preferences": {"language": "es"}, "recent_calls": []}
+
+        async def scenario():
+            prewarm = CallPrewarmRegistry(AsyncMock(), AsyncMock(), AsyncMock(), load_profile=load_profile)
+            prewarm.prepare("CA1", stt=False, customer_number="+15552223333")
+            session = CallSession(FakeWebSocket(stop=True), llm_service=PromptLLM(), stt_service=FakeSTT(),
+                                  tts_service=FakeTTS(), prewarm=prewarm)
+            await session.run()
+
+            self.assertIn("- Name: Ada", session.llm_service.prompt)
+            self.assertIn("- Preferences: language: es", session.llm_service.prompt)
+            self.assertEqual(session.call_context.from_number, "+15552223333")
+
+        asyncio.run(scenario())
+
+    def test_greeting_plays_while_stt_connects(self):
+        class SlowConnectSTT(FakeSTT):
+            async def connect(self, connection=None):
+                await asyncio.sleep(0.1)
+                self.greeted_before_connect = any(message["event"] == "media" for message in websocket.sent)
+                await super().connect(connection)
+
+        async def scenario():
+            session = CallSession(websocket, llm_service=FakeLLM(), stt_service=SlowConnectSTT(),
+                                  tts_service=FakeTTS())
+            runner = asyncio.create_task(session.run())
+            await asyncio.wait_for(session.started.wait(), 1)
+            await asyncio.sleep(0.05)
+            websocket.hang_up.set()
+            await runner
+
+            self.assertTrue(session.stt_service.greeted_before_connect)
+            # Audio that arrived while STT connected was held for it
+            self.assertEqual(session.stt_service.received, 5)
+
+        websocket = FakeWebSocket(hang_up=asyncio.Event())
+        asyncio.run(scenario())
+
+    def test_close_is_idempotent(self):
+        async def scenario():
+            session = make_session()
+            await session.run()
+            await session.close()
+            self.assertEqual(session.state, SessionState.CLOSED)
+
+        asyncio.run(scenario())
+
+    def test_media_queue_is_bounded(self):
+        async def scenario():
+            session = make_session()
+            session.media = BoundedQueue(2, DROP_OLDEST, "media")
+            for payload in ("a", "b", "c"):
+                session.media.offer(payload)
+            self.assertEqual(session.buffer_metrics()["media"]["dropped"], 1)
+            self.assertEqual(session.media.get_nowait(), "b")
+
+        asyncio.run(scenario())
+
+    def test_stalled_stt_keeps_inbound_audio_bounded(self):
+        async def scenario():
+            hang_up = asyncio.Event()
+            stt = StalledSTT()
+            session = CallSession(FakeWebSocket(frames=20000, hang_up=hang_up), llm_service=FakeLLM(),
+                                  stt_service=stt, tts_service=FakeTTS(), media_queue_size=100)
+            tracemalloc.start()
+            try:
+                runner = asyncio.create_task(session.run())
+                while len(session.websocket.messages) > 15000:
+                    await asyncio.sleep(0.01)
+                baseline = tracemalloc.get_traced_memory()[0]
+                while session.websocket.messages:
+                    await asyncio.sleep(0.01)
+                growth = tracemalloc.get_traced_memory()[0] - baseline
+            finally:
+                tracemalloc.stop()
+            metrics = session.buffer_metrics()["media"]
+            hang_up.set()
+            await runner
+
+            # Another 15000 frames arrived, memory stays at what 100 frames take
+            self.assertLess(growth, 256 * 1024)
+            self.assertEqual(metrics["size"], 100)
+            self.assertEqual(metrics["high_water"], 100)
+            self.assertEqual(metrics["dropped"], 20000 - 100 - stt.received)
+
+        asyncio.run(scenario())
+
+    def test_stalled_websocket_pushes_back_on_the_llm(self):
+        async def scenario():
+            hang_up = asyncio.Event()
+            websocket = StalledWebSocket(frames=5, hang_up=hang_up)
+            session = CallSession(websocket, llm_service=SentenceLLM(sentences=500), stt_service=FakeSTT(),
+                                  tts_service=FakeTTS(), reply_queue_size=4, outbound_queue_size=8)
+            runner = asyncio.create_task(session.run())
+            await asyncio.sleep(0.3)
+
+            metrics = session.buffer_metrics()
+            # Nothing grew past its bound and the LLM waits for the sender instead of running ahead
+            self.assertIsNone(session.llm_service.finished_at)
+            for stage in ("replies", "outbound"):
+                self.assertLessEqual(metrics[stage]["high_water"], metrics[stage]["maxsize"])
+                self.assertEqual(metrics[stage]["dropped"], 0)
+            self.assertGreater(metrics["outbound"]["blocked"], 0)
+            self.assertLessEqual(metrics["reorder"]["high_water"], metrics["reorder"]["maxsize"])
+
+            websocket.unstall.set()
+            while len(played_indexes(websocket)) < 501:
+                await asyncio.sleep(0.01)
+            hang_up.set()
+            await runner
+            self.assertIsNotNone(session.llm_service.finished_at)
+
+        asyncio.run(scenario())
+
+    def test_only_the_latest_interim_is_checked(self):
+        async def scenario():
+            session = make_session()
+            for text in ("I", "I want", "I want to"):
+                await session.handle_utterance(text, "MZ1")
+            self.assertEqual(session.interims.drain(), ["I want to"])
+            self.assertEqual(session.buffer_metrics()["interims"]["dropped"], 2)
+
+        asyncio.run(scenario())
+
+    def test_sentences_synthesize_in_parallel_and_play_in_order(self):
+        async def scenario():
+            hang_up = asyncio.Event()
+            session = CallSession(FakeWebSocket(hang_up=hang_up), llm_service=SentenceLLM(), stt_service=FakeSTT(),
+                                  tts_service=SlowTTS(), tts_workers=4)
+            runner = asyncio.create_task(session.run())
+            started = asyncio.get_running_loop().time()
+            while len(played_indexes(session.websocket)) < 4:
+                await asyncio.sleep(0.01)
+            elapsed = asyncio.get_running_loop().time() - started
+            hang_up.set()
+            await runner
+
+            self.assertEqual(played_indexes(session.websocket), [0, 1, 2, 3])
+            self.assertEqual(session.tts_service.max_active, 4)
+            # Sequential synthesis would take 0.5s, the LLM only waits for the queue
+            self.assertLess(elapsed, 0.4)
+            self.assertLess(session.llm_service.finished_at - started, 0.1)
+
+        asyncio.run(scenario())
+
+    def test_interrupt_drops_queued_and_rendering_replies(self):
+        async def scenario():
+            hang_up = asyncio.Event()
+            session = CallSession(FakeWebSocket(frames=0, hang_up=hang_up), llm_service=SentenceLLM(),
+                                  stt_service=FakeSTT(), tts_service=SlowTTS(), tts_workers=1)
+            runner = asyncio.create_task(session.run())
+            await session.started.wait()
+            await session.llm_service.completion("Tell me everything", 1)
+            self.assertTrue(session.marks.busy)
+
+            await session.interrupt()
+            await asyncio.sleep(0.3)
+            hang_up.set()
+            await runner
+
+            self.assertEqual(played_indexes(session.websocket), [])
+            self.assertFalse(session.marks.busy)
+
+        asyncio.run(scenario())
+
+    def test_dropped_sessions_leak_nothing(self):
+        async def run_batch(count):
+            sessions = [make_session(frames=5) for _ in range(count)]
+            await asyncio.gather(*(session.run() for session in sessions))
+            self.assertTrue(all(session.state is SessionState.CLOSED for session in sessions))
+
+        # Only memory allocated by the sessions' code counts, and no log records a test runner would keep
+        repo_code = [tracemalloc.Filter(True, f"*/{package}/*")
+                     for package in ("services", "networking", "speach_to_text", "EventHandlers", "unittests")]
+
+        def session_memory():
+            gc.collect()
+            return sum(stat.size for stat in tracemalloc.take_snapshot().filter_traces(repo_code).statistics("filename"))
+
+        async def scenario():
+            logging.disable(logging.CRITICAL)
+            tracemalloc.start()
+            try:
+                await run_batch(100)
+                baseline = session_memory()
+                for _ in range(9):
+                    await run_batch(100)
+                growth = session_memory() - baseline
+            finally:
+                tracemalloc.stop()
+                logging.disable(logging.NOTSET)
+
+            self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+            self.assertLess(growth, 256 * 1024)
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
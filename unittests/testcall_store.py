@@ -0,0 +1,316 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from services.call_details import CallContext
+from services.call_store import CallStoreError, MemoryCallStore, RedisCallStore, RespConnection, SQLiteCallStore
+
+
+class FakeRedis:
+    """A local stand-in speaking enough of the Redis protocol for the call store."""
+
+    def __init__(self):
+        self.data = {}
+        self.sets = {}
+        self.subscribers = {}
+        self.clients = []
+        self.server = None
+        # Command name -> seconds its reply is held back
+        self.delays = {}
+
+    async def start(self, port=0):
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await self.server.wait_closed()
+        # Let the connection handlers see the closed sockets and return
+        await asyncio.sleep(0.01)
+
+    async def serve(self, reader, writer):
+        self.clients.append(writer)
+        try:
+            while True:
+                header = await reader.readuntil(b"\r\n")
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readuntil(b"\r\n"))[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode())
+                await asyncio.sleep(self.delays.get(args[0].upper(), 0))
+                writer.write(self.reply(self.execute(args, writer)))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    def execute(self, args, writer):
+        command, *rest = args
+        command = command.upper()
+        if command == "SET":
+            self.data[rest[0]] = rest[1]
+            return "OK"
+        if command == "GET":
+            return self.data.get(rest[0])
+        if command == "MGET":
+            return [self.data.get(key) for key in rest]
+        if command == "DEL":
+            return int(self.data.pop(rest[0], None) is not None)
+        if command == "SADD":
+            self.sets.setdefault(rest[0], set()).update(rest[1:])
+            return len(rest) - 1
+        if command == "SREM":
+            self.sets.get(rest[0], set()).difference_update(rest[1:])
+            return len(rest) - 1
+        if command == "SMEMBERS":
+            return sorted(self.sets.get(rest[0], ()))
+        if command == "SUBSCRIBE":
+            self.subscribers.setdefault(rest[0], []).append(writer)
+            return ["subscribe", rest[0], 1]
+        if command == "PUBLISH":
+            for subscriber in self.subscribers.get(rest[0], []):
+                subscriber.write(self.reply(["message", rest[0], rest[1]]))
+            return len(self.subscribers.get(rest[0], []))
+        return Exception(f"ERR unknown command '{command}'")
+
+    def reply(self, value):
+        if isinstance(value, Exception):
+            return f"-{value}\r\n".encode()
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, list):
+            return f"*{len(value)}\r\n".encode() + b"".join(self.reply(item) for item in value)
+        data = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def make_context(call_sid="CA1"):
+    context = CallContext()
+    context.call_sid = call_sid
+    context.system_message = "You are a receptionist."
+    context.user_context = [{"role": "user", "content": "Hello"}]
+    context.mark_tracker = object()
+    return context
+
+
+class CallStoreContract:
+    """Behaviour every backend shares, run against two stores pointing at the same state."""
+
+    async def make_stores(self):
+        raise NotImplementedError
+
+    async def cleanup(self):
+        pass
+
+    def test_round_trip_and_copies(self):
+        async def scenario():
+            writer, reader = await self.make_stores()
+            try:
+                context = make_context()
+                await writer.put(context)
+                context.user_context.append({"role": "assistant", "content": "Hi"})
+
+                stored = await reader.get("CA1")
+                self.assertEqual(stored.system_message, "You are a receptionist.")
+                self.assertEqual(stored.user_context, [{"role": "user", "content": "Hello"}])
+                self.assertIsNone(stored.mark_tracker)
+                self.assertIsNone(await reader.get("CA2"))
+
+                await writer.put(context)
+                await writer.put(make_context("CA2"))
+                self.assertEqual(len((await reader.get("CA1")).user_context), 2)
+                self.assertEqual(sorted(c.call_sid for c in await reader.all()), ["CA1", "CA2"])
+
+                await writer.delete("CA1")
+                self.assertIsNone(await reader.get("CA1"))
+                self.assertEqual([c.call_sid for c in await reader.all()], ["CA2"])
+            finally:
+                await writer.close()
+                await reader.close()
+                await self.cleanup()
+
+        asyncio.run(scenario())
+
+    def test_changes_are_announced_to_other_workers(self):
+        async def scenario():
+            writer, reader = await self.make_stores()
+            changed = asyncio.Queue()
+            reader.on('callchanged', changed.put_nowait)
+            await reader.start()
+            try:
+                await writer.put(make_context("CA7"))
+                self.assertEqual(await asyncio.wait_for(changed.get(), timeout=2), "CA7")
+            finally:
+                await writer.close()
+                await reader.close()
+                await self.cleanup()
+
+        asyncio.run(scenario())
+
+
+class TestMemoryCallStore(CallStoreContract, unittest.TestCase):
+    async def make_stores(self):
+        store = MemoryCallStore()
+        return store, store
+
+    def test_context_without_call_sid_is_rejected(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(MemoryCallStore().put(CallContext()))
+
+    def test_finished_calls_are_evicted(self):
+        async def scenario():
+            store = MemoryCallStore(finished_ttl=0.05)
+            finished = make_context("CA1")
+            finished.call_ended = True
+            await store.put(finished)
+            await store.put(make_context("CA2"))
+            self.assertIsNotNone(await store.get("CA1"))
+
+            await asyncio.sleep(0.1)
+            self.assertIsNone(await store.get("CA1"))
+            # Live calls stay however old they are
+            self.assertEqual([context.call_sid for context in await store.all()], ["CA2"])
+
+        asyncio.run(scenario())
+
+
+class TestSQLiteCallStore(CallStoreContract, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "call_state.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def make_stores(self):
+        return SQLiteCallStore(self.path, poll_interval=0.01), SQLiteCallStore(self.path, poll_interval=0.01)
+
+    def test_finished_calls_are_evicted(self):
+        async def scenario():
+            store = SQLiteCallStore(self.path, finished_ttl=0)
+            try:
+                finished = make_context("CA1")
+                finished.call_ended = True
+                await store.put(finished)
+                await store.put(make_context("CA2"))
+                self.assertIsNone(await store.get("CA1"))
+                self.assertEqual([context.call_sid for context in await store.all()], ["CA2"])
+            finally:
+                await store.close()
+
+        asyncio.run(scenario())
+
+    def test_sequence_is_not_reused_after_a_delete(self):
+        async def scenario():
+            writer, reader = await self.make_stores()
+            changed = asyncio.Queue()
+            reader.on('callchanged', changed.put_nowait)
+            await reader.start()
+            try:
+                await writer.put(make_context("CA1"))
+                await writer.put(make_context("CA2"))
+                self.assertEqual([await asyncio.wait_for(changed.get(), timeout=2) for _ in range(2)], ["CA1", "CA2"])
+
+                # CA3 must not take the seq CA2 had, the reader already saw it
+                await writer.delete("CA2")
+                await writer.put(make_context("CA3"))
+                self.assertEqual(await asyncio.wait_for(changed.get(), timeout=2), "CA3")
+            finally:
+                await writer.close()
+                await reader.close()
+
+        asyncio.run(scenario())
+
+
+class TestRedisCallStore(CallStoreContract, unittest.TestCase):
+    async def make_stores(self):
+        self.server = FakeRedis()
+        port = await self.server.start()
+        url = f"redis://127.0.0.1:{port}/0"
+        return RedisCallStore(url), RedisCallStore(url)
+
+    async def cleanup(self):
+        await self.server.stop()
+
+    def test_error_replies_raise(self):
+        async def scenario():
+            server = FakeRedis()
+            port = await server.start()
+            connection = RespConnection("127.0.0.1", port)
+            try:
+                with self.assertRaises(CallStoreError):
+                    await connection.execute("FLUSHALL")
+                self.assertEqual(await connection.execute("SET", "key", "value"), "OK")
+            finally:
+                await connection.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_cancelled_command_does_not_shift_replies(self):
+        async def scenario():
+            server = FakeRedis()
+            port = await server.start()
+            connection = RespConnection("127.0.0.1", port)
+            try:
+                await connection.execute("SET", "a", "value-of-a")
+                server.delays["GET"] = 0.05
+                pending = asyncio.create_task(connection.execute("GET", "a"))
+                await asyncio.sleep(0.01)
+                pending.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await pending
+                server.delays.clear()
+
+                self.assertEqual(await connection.execute("SADD", "calls", "CA1"), 1)
+                self.assertEqual(await connection.execute("GET", "a"), "value-of-a")
+                # Let the server answer the abandoned connection before it stops
+                await asyncio.sleep(0.05)
+            finally:
+                await connection.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_subscription_survives_a_server_restart(self):
+        async def scenario():
+            server = FakeRedis()
+            port = await server.start()
+            url = f"redis://127.0.0.1:{port}/0"
+            writer, reader = RedisCallStore(url), RedisCallStore(url, resubscribe_interval=0.05)
+            changed = asyncio.Queue()
+            reader.on('callchanged', changed.put_nowait)
+            await reader.start()
+            try:
+                await server.stop()
+                # Resubscribing fails while the server is down, the watcher keeps retrying
+                await asyncio.sleep(0.2)
+                self.assertFalse(reader._watcher.done())
+
+                server = FakeRedis()
+                await server.start(port)
+                for _ in range(100):
+                    if server.subscribers:
+                        break
+                    await asyncio.sleep(0.01)
+                await writer.put(make_context("CA7"))
+                self.assertEqual(await asyncio.wait_for(changed.get(), timeout=2), "CA7")
+            finally:
+                await writer.close()
+                await reader.close()
+                await server.stop()
+
+        asyncio.run(scenario())
+
+    def test_url_parsing(self):
+        connection = RespConnection.from_url("redis://:secret@cache.internal:6380/2")
+        self.assertEqual((connection.host, connection.port, connection.password, connection.db),
+                         ("cache.internal", 6380, "secret", 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+
+from services.caller_profile import CallerProfileCache, personalize
+
+
+class SlowLookup:
+    """Stands in for the database, each lookup takes ``delay`` and is counted."""
+
+    def __init__(self, delay=0.01, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.version = 0
+
+    async def __call__(self, phone_number):
+        self.calls += 1
+        version = self.version
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        return {"phone_number": phone_number, "name": f"Caller v{version}", "preferences": {}, "recent_calls": []}
+
+
+class TestCallerProfileCache(unittest.TestCase):
+    def test_prefetched_profile_is_served_from_the_cache(self):
+        async def scenario():
+            lookup = SlowLookup()
+            profiles = CallerProfileCache(lookup)
+            prefetch = asyncio.create_task(profiles.load("+15550001111"))
+            # The session asks while the prefetch is still running and joins it
+            joined = await profiles.load("+15550001111")
+            self.assertEqual(await prefetch, joined)
+            self.assertEqual((await profiles.load("+15550001111"))["name"], "Caller v0")
+
+            self.assertEqual(lookup.calls, 1)
+            metrics = profiles.metrics()
+            self.assertEqual((metrics["hits"], metrics["joined"], metrics["lookups"]), (1, 1, 1))
+            self.assertGreater(metrics["mean_lookup_ms"], 5)
+
+        asyncio.run(scenario())
+
+    def test_invalidation_drops_cached_and_in_flight_profiles(self):
+        async def scenario():
+            lookup = SlowLookup()
+            profiles = CallerProfileCache(lookup)
+            await profiles.load("+15550001111")
+            lookup.version = 1
+            profiles.invalidate("+15550001111")
+            self.assertEqual((await profiles.load("+15550001111"))["name"], "Caller v1")
+
+            # Changed while being looked up, the stale result is returned once but not kept
+            lookup.version = 2
+            profiles.invalidate("+15550001111")
+            in_flight = asyncio.create_task(profiles.load("+15550001111"))
+            await asyncio.sleep(0.002)
+            lookup.version = 3
+            profiles.invalidate("+15550001111")
+            self.assertEqual((await in_flight)["name"], "Caller v2")
+            self.assertEqual((await profiles.load("+15550001111"))["name"], "Caller v3")
+
+        asyncio.run(scenario())
+
+    def test_failed_lookups_are_not_cached(self):
+        async def scenario():
+            lookup = SlowLookup(fail=True)
+            profiles = CallerProfileCache(lookup)
+            self.assertIsNone(await profiles.load("+15550001111"))
+            self.assertIsNone(await profiles.load("+15550001111"))
+            self.assertIsNone(await profiles.load(None))
+            self.assertEqual((lookup.calls, profiles.metrics()["errors"]), (2, 2))
+
+        asyncio.run(scenario())
+
+    def test_entries_expire(self):
+        async def scenario():
+            lookup = SlowLookup(delay=0)
+            profiles = CallerProfileCache(lookup, ttl=0.01)
+            await profiles.load("+15550001111")
+            await asyncio.sleep(0.02)
+            await profiles.load("+15550001111")
+            self.assertEqual(lookup.calls, 2)
+
+        asyncio.run(scenario())
+
+    def test_personalize(self):
+        profile = {"name": "Ada", "preferences": {"language": "es"},
+                   "recent_calls": [{"start_time": "2024-09-20T10:00:00", "duration_s": 240.0,
+                                     "final_status": "completed", "first_request": "Where is my order?"}]}
+        message = personalize("You are a receptionist.", profile)
+        self.assertTrue(message.startswith("You are a receptionist.\n\n"))
+        self.assertIn("- Name: Ada", message)
+        self.assertIn("- Preferences: language: es", message)
+        self.assertIn('- Call on 2024-09-20 (completed, 4 min), they said: "Where is my order?"', message)
+
+        empty = {"name": None, "preferences": {}, "recent_calls": []}
+        self.assertEqual(personalize("You are a receptionist.", empty), "You are a receptionist.")
+        self.assertEqual(personalize("You are a receptionist.", None), "You are a receptionist.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import time
+import unittest
+
+from services.capacity import CapacityManager, LoopLagMonitor, hold_twiml, overflow_twiml, parse_limits
+
+
+class TestCapacityManager(unittest.TestCase):
+    def test_reservations_count_until_the_stream_starts(self):
+        capacity = CapacityManager(max_sessions=2, provider_limits={})
+        self.assertTrue(capacity.admit("CA1"))
+        self.assertTrue(capacity.admit("CA2"))
+        # A burst of calls cannot all pass before the first websocket arrives
+        self.assertFalse(capacity.admit("CA3"))
+        # Twilio retrying /incoming for an admitted call keeps its place
+        self.assertTrue(capacity.admit("CA1"))
+
+        capacity.session_started("CA1")
+        self.assertEqual((capacity.sessions, capacity.reserved), (1, 1))
+        self.assertFalse(capacity.admit("CA3"))
+        capacity.session_ended()
+        self.assertTrue(capacity.admit("CA3"))
+        self.assertEqual(capacity.metrics["rejected_sessions"], 2)
+
+    def test_unclaimed_reservations_expire(self):
+        capacity = CapacityManager(max_sessions=1, provider_limits={}, reservation_ttl=0.01)
+        self.assertTrue(capacity.admit("CA1"))
+        time.sleep(0.02)
+        self.assertTrue(capacity.admit("CA2"))
+        self.assertEqual(capacity.metrics["expired_reservations"], 1)
+
+    def test_outbound_calls_keep_their_place_while_ringing(self):
+        capacity = CapacityManager(max_sessions=1, provider_limits={}, reservation_ttl=0.01)
+        self.assertTrue(capacity.admit("outbound-1", ttl=60))
+        capacity.move_reservation("outbound-1", "CA1")
+        time.sleep(0.02)
+        # An inbound call arriving while the callee's phone rings is refused, the answered call is not
+        self.assertFalse(capacity.admit("CA2"))
+        self.assertTrue(capacity.admit("CA1"))
+
+        capacity.cancel_reservation("CA1")
+        self.assertTrue(capacity.admit("CA2"))
+
+    def test_loop_lag_and_provider_limits_refuse_calls(self):
+        lag = LoopLagMonitor(smoothing=1.0)
+        capacity = CapacityManager(max_sessions=10, max_loop_lag_ms=50, provider_limits={"tts": 2}, lag_monitor=lag)
+        lag.sample(120)
+        self.assertEqual(capacity.refusal(), "loop_lag")
+        lag.sample(5)
+        self.assertIsNone(capacity.refusal())
+
+        with capacity.provider("tts"), capacity.provider("tts"):
+            self.assertFalse(capacity.admit("CA1"))
+            self.assertEqual(capacity.load()["providers"]["tts"], {"in_use": 2, "limit": 2})
+        self.assertTrue(capacity.admit("CA1"))
+        self.assertEqual(capacity.metrics["rejected_provider"], 1)
+
+    def test_load(self):
+        capacity = CapacityManager(max_sessions=4, provider_limits={"stt": 100})
+        capacity.admit("CA1")
+        capacity.session_started("CA2")
+        load = capacity.load()
+        self.assertTrue(load["accepting"])
+        self.assertEqual((load["sessions"], load["reserved"], load["utilization"]), (1, 1, 0.5))
+
+    def test_loop_lag_monitor_sees_a_blocked_loop(self):
+        async def scenario():
+            monitor = LoopLagMonitor(interval=0.01, smoothing=1.0)
+            monitor.start()
+            await asyncio.sleep(0.03)
+            time.sleep(0.1)
+            await asyncio.sleep(0.03)
+            await monitor.stop()
+            self.assertGreater(monitor.max_lag_ms, 50)
+
+        asyncio.run(scenario())
+
+    def test_parse_limits(self):
+        self.assertEqual(parse_limits("stt=100, tts=15,"), {"stt": 100, "tts": 15})
+        self.assertEqual(parse_limits(""), {})
+
+
+class TestOverflowTwiml(unittest.TestCase):
+    def test_overflow_number_is_dialed(self):
+        self.assertIn("<Dial>+15550100</Dial>", overflow_twiml("+15550100", "overflow"))
+
+    def test_queue_with_hold_audio_and_retry(self):
+        twiml = overflow_twiml(queue_name="overflow", wait_url="https://example.com/hold",
+                               retry_url="https://example.com/incoming")
+        self.assertIn('<Enqueue waitUrl="https://example.com/hold">overflow</Enqueue>', twiml)
+        self.assertIn("<Redirect>https://example.com/incoming</Redirect>", twiml)
+
+    def test_busy_message_without_overflow(self):
+        self.assertIn("<Hangup />", overflow_twiml())
+
+    def test_hold(self):
+        self.assertIn("<Play>https://example.com/hold.mp3</Play>", hold_twiml(False, "https://example.com/hold.mp3"))
+        self.assertIn("<Leave />", hold_twiml(True, "https://example.com/hold.mp3"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from speach_to_text.connection_pool import DeepgramConnectionPool, PooledConnection
+
+
+class FakeConnection:
+    def __init__(self):
+        self.connected = True
+        self.keepalives = 0
+        self.finished = False
+
+    async def start(self, options):
+        return True
+
+    async def is_connected(self):
+        return self.connected
+
+    async def keep_alive(self):
+        self.keepalives += 1
+        return True
+
+    async def finish(self):
+        self.finished = True
+        self.connected = False
+        return True
+
+
+class SlowConnection(FakeConnection):
+    """Answers is_connected with the given (delay, result) pairs in turn."""
+
+    def __init__(self, *answers):
+        super().__init__()
+        self.answers = list(answers)
+
+    async def is_connected(self):
+        if not self.answers:
+            return self.connected
+        delay, result = self.answers.pop(0)
+        await asyncio.sleep(delay)
+        return result
+
+
+@patch("speach_to_text.connection_pool.DeepgramClient", MagicMock())
+class TestDeepgramConnectionPool(unittest.TestCase):
+    def make_pool(self, **kwargs):
+        pool = DeepgramConnectionPool(**kwargs)
+        pool.client.listen.asyncwebsocket.v.side_effect = lambda version: FakeConnection()
+        return pool
+
+    def test_pool_fills_and_serves_ready_connections(self):
+        async def scenario():
+            pool = self.make_pool(size=2, keepalive_interval=0.01)
+            await pool.start()
+            await asyncio.sleep(0.05)
+            self.assertEqual(pool.stats()["idle"], 2)
+
+            connection = await pool.acquire()
+            self.assertTrue(await connection.is_connected())
+            await asyncio.sleep(0.05)
+
+            stats = pool.stats()
+            await pool.stop()
+            return stats
+
+        stats = asyncio.run(scenario())
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 0)
+        self.assertEqual(stats["idle"], 2)
+
+    def test_stale_connections_are_recycled(self):
+        async def scenario():
+            pool = self.make_pool(size=0, max_age=10)
+            stale = FakeConnection()
+            dropped = FakeConnection()
+            dropped.connected = False
+            pool._idle.append(PooledConnection(stale, time.monotonic() - 60))
+            pool._idle.append(PooledConnection(dropped, time.monotonic()))
+
+            connection = await pool.acquire()
+            return pool, stale, connection
+
+        pool, stale, connection = asyncio.run(scenario())
+        self.assertTrue(stale.finished)
+        self.assertIsNot(connection, stale)
+        self.assertEqual(pool.metrics["recycled"], 2)
+        self.assertEqual(pool.metrics["misses"], 1)
+
+    def test_acquire_during_maintenance(self):
+        async def scenario():
+            pool = DeepgramConnectionPool(size=1, keepalive_interval=10)
+            connections = iter([SlowConnection((0.02, False), (0, True)), FakeConnection()])
+            pool.client.listen.asyncwebsocket.v.side_effect = lambda version: next(connections)
+            await pool.start()
+            await asyncio.sleep(0.01)
+
+            # Maintenance finds the socket dropped while acquire, a moment later, finds it fine and takes it
+            pool._wake.set()
+            await asyncio.sleep(0.005)
+            connection = await pool.acquire()
+            await asyncio.sleep(0.05)
+            stats = pool.stats()
+            await pool.stop()
+            return connection, stats
+
+        connection, stats = asyncio.run(scenario())
+        self.assertFalse(connection.finished)
+        # Refilled right away, not after keepalive_interval
+        self.assertEqual((stats["hits"], stats["idle"], stats["recycled"]), (1, 1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
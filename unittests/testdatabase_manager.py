@@ -0,0 +1,463 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from DataLibrary.call_archive import CallArchive
+from DataLibrary.database_manager import DatabaseManager, SearchUnavailableError, build_match_query
+from services.call_details import CallContext
+
+
+def make_context(call_sid="CA1", turns=1):
+    context = CallContext()
+    context.call_sid = call_sid
+    context.stream_sid = "MZ1"
+    context.to_number = "+15550001111"
+    context.from_number = "+15552223333"
+    context.start_time = "2024-09-23T10:00:00"
+    context.user_context = [{"role": "user", "content": f"Turn {turn}"} for turn in range(turns)]
+    return context
+
+
+class TestDatabaseManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "call_contexts.db")
+        self.url = f"sqlite+aiosqlite:///{self.path}"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_with_manager(self, scenario, **kwargs):
+        async def wrapper():
+            # Created inside the running loop, the schema is created on first use
+            manager = DatabaseManager(self.url, **kwargs)
+            try:
+                await scenario(manager)
+            finally:
+                await manager.close()
+
+        asyncio.run(wrapper())
+
+    def test_round_trip(self):
+        async def scenario(manager):
+            await manager.create_call_context(make_context())
+            self.assertEqual((await manager.get_call_context("CA1")).from_number, "+15552223333")
+            self.assertIsNone(await manager.get_call_context("CA2"))
+
+            context = make_context(turns=3)
+            context.call_ended = True
+            await manager.update_call_context(context)
+            updated = await manager.get_call_context("CA1")
+            self.assertTrue(updated.call_ended)
+            self.assertEqual([turn.content for turn in await manager.get_turns("CA1")], ["Turn 0", "Turn 1", "Turn 2"])
+
+            await manager.create_transcription("CA1", "Hello there")
+            self.assertEqual((await manager.get_transcription("CA1")).transcription_text, "Hello there")
+            self.assertEqual([c.call_sid for c in await manager.get_all_call_contexts()], ["CA1"])
+
+            await manager.delete_call_context("CA1")
+            self.assertIsNone(await manager.get_call_context("CA1"))
+            self.assertIsNone(await manager.get_transcription("CA1"))
+            self.assertEqual(await manager.get_turns("CA1"), [])
+            self.assertEqual(await manager.get_contact_by_phone("+15552223333"), None)
+
+        self.run_with_manager(scenario)
+
+    def test_concurrent_updates_share_transactions(self):
+        async def scenario(manager):
+            contexts = [make_context(f"CA{index}") for index in range(200)]
+            for turn in range(5):
+                for context in contexts:
+                    context.user_context.append({"role": "assistant", "content": f"Reply {turn}"})
+                    manager.save_call_context(context)
+            await asyncio.gather(*(manager.update_call_context(context) for context in contexts))
+
+            self.assertEqual(len(await manager.get_all_call_contexts()), 200)
+            self.assertEqual((await manager.get_turns("CA7"))[-1].content, "Reply 4")
+            # 1200 writes, each call's updates collapse into one row write in a single transaction
+            self.assertEqual(manager.metrics["queued"], 1200)
+            self.assertEqual(manager.metrics["rows"], 200)
+            self.assertEqual(manager.metrics["turns"], 1200)
+            self.assertEqual(manager.metrics["flushes"], 1)
+
+        self.run_with_manager(scenario, flush_interval=0.05)
+
+    def test_each_save_appends_only_new_turns(self):
+        async def scenario(manager):
+            context = make_context(turns=2)
+            await manager.update_call_context(context)
+            context.user_context.append({"role": "assistant", "content": "Hi", "name": None})
+            context.user_context.append({"role": "function", "content": "{}", "name": "check_hours"})
+            await manager.save_call_context(context, latency_ms=420.0)
+            await manager.update_call_context(context)
+
+            turns = await manager.get_turns("CA1")
+            self.assertEqual([turn.seq for turn in turns], [0, 1, 2, 3])
+            self.assertEqual([turn.latency_ms for turn in turns], [None, None, 420.0, None])
+            self.assertEqual(turns[3].as_dict()["name"], "check_hours")
+            self.assertEqual(manager.metrics["turns"], 4)
+            async with manager.engine.connect() as conn:
+                self.assertIsNone((await conn.execute(text("SELECT user_context FROM call_contexts"))).scalar())
+
+        self.run_with_manager(scenario)
+
+    def test_turns_are_keyset_paginated(self):
+        async def scenario(manager):
+            await manager.update_call_context(make_context(turns=25))
+            pages, after = [], -1
+            while True:
+                page = await manager.get_turns("CA1", after_seq=after, limit=10)
+                if not page:
+                    break
+                pages.append([turn.seq for turn in page])
+                after = page[-1].seq
+            self.assertEqual([len(page) for page in pages], [10, 10, 5])
+            self.assertEqual(sum(pages, []), list(range(25)))
+
+        self.run_with_manager(scenario)
+
+    def test_transcript_blobs_are_migrated_to_turns(self):
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("CREATE TABLE call_contexts (call_sid VARCHAR NOT NULL PRIMARY KEY, stream_sid VARCHAR, "
+                               "call_ended BOOLEAN, user_context TEXT, system_message VARCHAR, "
+                               "initial_message VARCHAR, start_time DATETIME, end_time DATETIME, "
+                               "final_status VARCHAR, to_number VARCHAR NOT NULL, from_number VARCHAR NOT NULL)")
+            connection.execute("CREATE TABLE transcriptions (transcription_id INTEGER PRIMARY KEY, "
+                               "call_id VARCHAR NOT NULL, transcription_text TEXT NOT NULL, created_at DATETIME)")
+            messages = [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi, how can I help?"}]
+            connection.execute("INSERT INTO call_contexts (call_sid, user_context, to_number, from_number) "
+                               "VALUES ('CA1', ?, '1', '2')", (json.dumps(messages),))
+            connection.execute("INSERT INTO transcriptions (call_id, transcription_text) "
+                               "VALUES ('CA2', 'Caller: hello' || char(10) || 'Agent: hi')")
+
+        async def scenario(manager):
+            turns = await manager.get_turns("CA1")
+            self.assertEqual([(turn.role, turn.content) for turn in turns],
+                             [("user", "Hello"), ("assistant", "Hi, how can I help?")])
+            self.assertEqual([turn.content for turn in await manager.get_turns("CA2")], ["Caller: hello", "Agent: hi"])
+            self.assertIsNone((await manager.get_call_context("CA1")).user_context)
+
+        self.run_with_manager(scenario)
+        # A second run finds nothing left to migrate
+        self.run_with_manager(lambda manager: self.assert_turn_count(manager, 4))
+
+    async def assert_turn_count(self, manager, count):
+        async with manager.engine.connect() as conn:
+            self.assertEqual((await conn.execute(text("SELECT count(*) FROM transcript_turns"))).scalar(), count)
+
+    def test_search_finds_phrases_and_prefixes(self):
+        async def scenario(manager):
+            first = make_context("CA1")
+            first.user_context = [{"role": "user", "content": "I want a refund for my broken blender"},
+                                  {"role": "assistant", "content": "I can start the refund request for you"}]
+            second = make_context("CA2")
+            second.from_number = "+15559990000"
+            second.user_context = [{"role": "user", "content": "When will my delivery arrive?"},
+                                   {"role": "user", "content": "The request for a refund was ignored"}]
+            await asyncio.gather(manager.update_call_context(first), manager.update_call_context(second))
+
+            found = await manager.search_turns('"refund request"')
+            self.assertEqual([(r["call_sid"], r["seq"]) for r in found["results"]], [("CA1", 1)])
+            self.assertIn("the <mark>refund request</mark> for", found["results"][0]["snippet"])
+
+            found = await manager.search_turns("deliver*")
+            self.assertEqual([r["call_sid"] for r in found["results"]], ["CA2"])
+
+            # Newest first, stemmed, filtered by role and number
+            self.assertEqual([(r["call_sid"], r["seq"]) for r in (await manager.search_turns("refunds"))["results"]],
+                             [("CA2", 1), ("CA1", 1), ("CA1", 0)])
+            self.assertEqual(len((await manager.search_turns("refund", role="assistant"))["results"]), 1)
+            self.assertEqual([r["call_sid"] for r in
+                              (await manager.search_turns("refund", number="+15559990000"))["results"]], ["CA2"])
+            self.assertEqual((await manager.search_turns("refund", until=datetime(2000, 1, 1)))["results"], [])
+            # Aware times are compared in UTC, a minute ago in UTC+5 is five hours ahead on the wall clock
+            a_minute_ago = datetime.now(timezone(timedelta(hours=5))) - timedelta(minutes=1)
+            self.assertEqual(len((await manager.search_turns("refund", since=a_minute_ago))["results"]), 3)
+            self.assertEqual((await manager.search_turns("refund", until=a_minute_ago))["results"], [])
+
+            await manager.delete_call_context("CA2")
+            self.assertEqual((await manager.search_turns("delivery"))["results"], [])
+
+        self.run_with_manager(scenario)
+
+    def test_search_pages(self):
+        async def scenario(manager):
+            context = make_context()
+            context.user_context = [{"role": "user", "content": f"Order number {index} is late"} for index in range(7)]
+            await manager.update_call_context(context)
+
+            for order in ("recent", "rank"):
+                seen, cursor = [], None
+                while True:
+                    page = await manager.search_turns("late", limit=3, cursor=cursor, order=order)
+                    seen += [result["seq"] for result in page["results"]]
+                    cursor = page["next"]
+                    if cursor is None:
+                        break
+                self.assertEqual(sorted(seen), list(range(7)))
+
+        self.run_with_manager(scenario)
+
+    def test_existing_turns_are_indexed(self):
+        async def scenario(manager):
+            await manager.update_call_context(make_context(turns=3))
+            async with manager.engine.begin() as conn:
+                await conn.execute(text("DROP TABLE transcript_search"))
+
+        self.run_with_manager(scenario)
+
+        async def search(manager):
+            self.assertEqual(len((await manager.search_turns("turn"))["results"]), 3)
+
+        self.run_with_manager(search)
+
+    def test_old_calls_are_archived(self):
+        archive = CallArchive(os.path.join(self.directory.name, "archive"))
+
+        async def scenario(manager):
+            for index, day in enumerate(("2024-09-01", "2024-09-01", "2024-09-02")):
+                context = make_context(f"CA{index}", turns=40)
+                context.start_time, context.end_time = f"{day}T10:00:00", f"{day}T10:05:00"
+                context.call_ended = True
+                manager.save_call_context(context, latency_ms=250.0)
+            recent = make_context("CA9", turns=2)
+            recent.start_time = datetime.utcnow().isoformat()
+            await manager.update_call_context(recent)
+            async with manager.engine.connect() as conn:
+                pages_before = (await conn.execute(text("PRAGMA page_count"))).scalar()
+
+            archived = await manager.archive_calls(older_than=timedelta(days=1))
+            self.assertEqual(archived, {"calls": 3, "turns": 120})
+            self.assertEqual([c.call_sid for c in await manager.get_all_call_contexts()], ["CA9"])
+            self.assertEqual(await manager.get_turns("CA1"), [])
+            self.assertEqual({r["call_sid"] for r in (await manager.search_turns("turn"))["results"]}, {"CA9"})
+            # A few free pages are not worth rebuilding the file for
+            self.assertFalse(await manager.vacuum())
+            self.assertTrue(await manager.vacuum(min_free=0.1))
+            async with manager.engine.connect() as conn:
+                self.assertLess((await conn.execute(text("PRAGMA page_count"))).scalar(), pages_before)
+
+            call = await manager.get_archived_call("CA2")
+            self.assertEqual((call["duration_s"], call["turn_count"]), (300.0, 40))
+            self.assertEqual([turn["content"] for turn in call["turns"][:2]], ["Turn 0", "Turn 1"])
+            self.assertIsNone(await manager.get_archived_call("CA9"))
+            self.assertEqual(sorted(os.listdir(archive.root)), ["date=2024-09-01", "date=2024-09-02"])
+            self.assertEqual(sum(len(columns["call_sid"]) for columns in archive.scan("turns")), 120)
+
+            # Nothing is left to archive
+            self.assertEqual(await manager.archive_calls(older_than=timedelta(days=1)), {"calls": 0, "turns": 0})
+
+        self.run_with_manager(scenario, archive=archive)
+
+    def test_calls_still_being_written_are_not_archived(self):
+        async def scenario(manager):
+            context = make_context(turns=2)
+            await manager.update_call_context(context)
+
+            self.assertEqual((await manager.archive_calls(older_than=timedelta(0)))["calls"], 0)
+            self.assertEqual(len(await manager.get_turns("CA1")), 2)
+
+        self.run_with_manager(scenario, archive=CallArchive(os.path.join(self.directory.name, "archive")))
+
+    def test_calls_saved_without_a_start_time_are_archived(self):
+        async def scenario(manager):
+            context = make_context(turns=2)
+            context.start_time = None
+            await manager.update_call_context(context)
+            started = (await manager.get_call_context("CA1")).start_time
+            self.assertIsNotNone(started)
+            context.call_ended = True
+            await manager.update_call_context(context)
+            # Later saves keep the time of the first one
+            self.assertEqual((await manager.get_call_context("CA1")).start_time, started)
+
+            self.assertEqual((await manager.archive_calls(older_than=timedelta(minutes=-1)))["calls"], 1)
+
+        self.run_with_manager(scenario, archive=CallArchive(os.path.join(self.directory.name, "archive")))
+
+    def test_concurrent_archive_runs_take_different_calls(self):
+        class SlowArchive(CallArchive):
+            def write(self, *args):
+                # Both runs are between picking their calls and committing at once
+                time.sleep(0.05)
+                return super().write(*args)
+
+        archive = SlowArchive(os.path.join(self.directory.name, "archive"))
+
+        async def scenario():
+            # Two workers archiving the same database
+            first, second = DatabaseManager(self.url, archive=archive), DatabaseManager(self.url, archive=archive)
+            try:
+                await second.ensure_schema()
+                for index in range(50):
+                    context = make_context(f"CA{index}", turns=2)
+                    context.call_ended = True
+                    first.save_call_context(context)
+                await first.flush()
+
+                results = await asyncio.gather(*(manager.archive_calls(older_than=timedelta(days=1), chunk=10)
+                                                  for manager in (first, second)))
+                self.assertEqual(sum(result["calls"] for result in results), 50)
+                self.assertEqual(sum(len(columns["call_sid"]) for columns in archive.scan("calls")), 50)
+                self.assertEqual(sum(len(columns["call_sid"]) for columns in archive.scan("turns")), 100)
+                self.assertEqual(await first.get_all_call_contexts(), [])
+            finally:
+                await first.close()
+                await second.close()
+
+        asyncio.run(scenario())
+
+    def test_lapsed_archive_claims_are_taken_over(self):
+        async def scenario(manager):
+            await manager.create_call_context(make_context(turns=2))
+            manager._persisted.clear()
+            # A run that died after claiming the call
+            async with manager.engine.begin() as conn:
+                await conn.execute(text("UPDATE call_contexts SET archive_claim = 'dead', archive_claimed_at = :at"),
+                                   {"at": datetime.utcnow()})
+            self.assertEqual((await manager.archive_calls(older_than=timedelta(days=1)))["calls"], 0)
+
+            async with manager.engine.begin() as conn:
+                await conn.execute(text("UPDATE call_contexts SET archive_claimed_at = :at"),
+                                   {"at": datetime.utcnow() - timedelta(hours=1)})
+            self.assertEqual(await manager.archive_calls(older_than=timedelta(days=1)), {"calls": 1, "turns": 2})
+
+        self.run_with_manager(scenario, archive=CallArchive(os.path.join(self.directory.name, "archive")))
+
+    def test_caller_profile(self):
+        archive = CallArchive(os.path.join(self.directory.name, "archive"))
+
+        async def scenario(manager):
+            changed = []
+            manager.on('contactchanged', changed.append)
+            await manager.update_contact("+15552223333", name="Ada", preferences={"language": "es", "sms": "yes"})
+            await manager.update_contact("+15552223333", preferences={"sms": None})
+            self.assertEqual(changed, ["+15552223333", "+15552223333"])
+
+            for index, day in enumerate(("2024-08-01", "2024-09-20", "2024-09-21")):
+                context = make_context(f"CA{index}")
+                context.user_context = [{"role": "user", "content": "Hello"},
+                                        {"role": "assistant", "content": "Hi, how can I help?"},
+                                        {"role": "user", "content": f"Question {index}"}]
+                context.start_time, context.end_time = f"{day}T10:00:00", f"{day}T10:03:00"
+                context.call_ended = True
+                await manager.update_call_context(context)
+            # A call still running is not history yet
+            await manager.update_call_context(make_context("CA9"))
+            self.assertIn("+15552223333", changed[2:])
+            await manager.archive_calls(older_than=timedelta(days=(datetime.utcnow() - datetime(2024, 9, 1)).days))
+
+            profile = await manager.get_caller_profile("+15552223333", recent_calls=3)
+            self.assertEqual((profile["name"], profile["preferences"]), ("Ada", {"language": "es"}))
+            self.assertEqual([(call["call_sid"], call["first_request"]) for call in profile["recent_calls"]],
+                             [("CA2", "Question 2"), ("CA1", "Question 1"), ("CA0", None)])
+            self.assertEqual(profile["recent_calls"][0]["duration_s"], 180.0)
+
+            unknown = await manager.get_caller_profile("+15550000000")
+            self.assertEqual((unknown["name"], unknown["preferences"], unknown["recent_calls"]), (None, {}, []))
+
+        self.run_with_manager(scenario, archive=archive)
+
+    def test_search_needs_sqlite(self):
+        async def scenario(manager):
+            # As on PostgreSQL, which has no FTS5 index
+            manager.is_sqlite = False
+            with self.assertRaises(SearchUnavailableError):
+                await manager.search_turns("refund")
+
+        self.run_with_manager(scenario)
+
+    def test_match_query_building(self):
+        self.assertEqual(build_match_query('"refund request" deliv*'), '"refund request" "deliv"*')
+        self.assertEqual(build_match_query("o'neil AND NEAR(x)"), '"o neil" "AND" "NEAR x"')
+        with self.assertRaises(ValueError):
+            build_match_query('" * "')
+
+    def test_batches_are_capped(self):
+        async def scenario(manager):
+            await asyncio.gather(*(manager.update_call_context(make_context(f"CA{index}")) for index in range(25)))
+            self.assertEqual(manager.metrics["max_batch"], 10)
+            self.assertEqual(manager.metrics["flushes"], 3)
+
+        self.run_with_manager(scenario, max_batch=10)
+
+    def test_queued_writes_are_flushed_on_close(self):
+        async def scenario(manager):
+            manager.save_call_context(make_context("CA9"))
+
+        self.run_with_manager(scenario, flush_interval=10)
+        with sqlite3.connect(self.path) as connection:
+            self.assertEqual(connection.execute("SELECT call_sid FROM call_contexts").fetchall(), [("CA9",)])
+            self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+
+    def test_failed_batches_are_written_again(self):
+        async def scenario(manager):
+            write_batch, attempts = manager._write_batch, []
+
+            async def locked_once(batch, turns):
+                attempts.append(len(turns))
+                if len(attempts) == 1:
+                    raise sqlite3.OperationalError("database is locked")
+                await write_batch(batch, turns)
+
+            manager._write_batch = locked_once
+            with self.assertRaises(sqlite3.OperationalError):
+                await manager.update_call_context(make_context(turns=2))
+            # The turns were queued once, the retry still writes them
+            for _ in range(100):
+                if not manager._pending:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(attempts, [2, 2])
+            self.assertEqual([turn.content for turn in await manager.get_turns("CA1")], ["Turn 0", "Turn 1"])
+            self.assertEqual(manager.metrics["errors"], 1)
+
+        self.run_with_manager(scenario, retry_interval=0.01)
+
+    def test_writes_are_dropped_after_max_attempts(self):
+        async def scenario(manager):
+            async def locked(batch, turns):
+                raise sqlite3.OperationalError("database is locked")
+
+            manager._write_batch = locked
+            saved = manager.save_call_context(make_context(turns=2))
+            self.assertFalse(await manager.flush())
+            self.assertEqual(len(manager._pending_turns["CA1"]), 2)
+            with self.assertRaises(sqlite3.OperationalError):
+                await saved
+
+            self.assertFalse(await manager.flush())
+            self.assertEqual((manager._pending, manager._pending_turns), ({}, {}))
+            self.assertTrue(await manager.flush())
+            self.assertEqual(manager.metrics["errors"], 2)
+
+        self.run_with_manager(scenario, flush_interval=10, max_attempts=2)
+
+    def test_older_schema_gains_missing_columns(self):
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("CREATE TABLE call_contexts (call_sid VARCHAR NOT NULL PRIMARY KEY, stream_sid VARCHAR, "
+                               "call_ended BOOLEAN, user_context TEXT, system_message VARCHAR, "
+                               "initial_message VARCHAR, start_time DATETIME, end_time DATETIME, "
+                               "final_status VARCHAR, to_number VARCHAR NOT NULL, from_number VARCHAR NOT NULL)")
+
+            connection.execute("INSERT INTO call_contexts (call_sid, call_ended, to_number, from_number) "
+                               "VALUES ('CA0', 1, '+15550001111', '+15552223333')")
+
+        async def scenario(manager):
+            await manager.create_call_context(make_context())
+            self.assertEqual((await manager.get_call_context("CA1")).call_sid, "CA1")
+            # Calls stored without a start time get one, or they would never be archived
+            self.assertIsNotNone((await manager.get_call_context("CA0")).start_time)
+
+        self.run_with_manager(scenario)
+
+
+if __name__ == '__main__':
+    unittest.main()
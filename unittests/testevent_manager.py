@@ -0,0 +1,141 @@
+import asyncio
+import unittest
+
+from EventHandlers.event_manager import BACKGROUND, CONCURRENT, EventHandler
+
+
+class TestEventHandler(unittest.TestCase):
+    def test_inline_callbacks_run_in_order(self):
+        async def scenario():
+            emitter = EventHandler()
+            calls = []
+
+            async def first(value):
+                await asyncio.sleep(0.01)
+                calls.append(("first", value))
+
+            emitter.on('speech', first)
+            emitter.on('speech', lambda value: calls.append(("second", value)))
+            await emitter.createEvent('speech', 1)
+            self.assertEqual(calls, [("first", 1), ("second", 1)])
+
+        asyncio.run(scenario())
+
+    def test_concurrent_callbacks_overlap(self):
+        async def scenario():
+            emitter = EventHandler()
+
+            async def slow(value):
+                await asyncio.sleep(0.05)
+
+            for _ in range(4):
+                emitter.on('speech', slow, mode=CONCURRENT)
+            started = asyncio.get_running_loop().time()
+            await emitter.createEvent('speech', 1)
+            self.assertLess(asyncio.get_running_loop().time() - started, 0.15)
+
+        asyncio.run(scenario())
+
+    def test_concurrent_failure_is_raised_after_the_others_finish(self):
+        async def scenario():
+            emitter = EventHandler()
+            finished = []
+
+            async def fails():
+                raise ValueError("boom")
+
+            async def works():
+                await asyncio.sleep(0.01)
+                finished.append(True)
+
+            emitter.on('speech', fails, mode=CONCURRENT)
+            emitter.on('speech', works, mode=CONCURRENT)
+            with self.assertRaises(ValueError):
+                await emitter.createEvent('speech')
+            self.assertEqual(finished, [True])
+            self.assertEqual(emitter.metrics()['speech']['errors'], 1)
+
+        asyncio.run(scenario())
+
+    def test_background_callback_does_not_block_and_is_supervised(self):
+        async def scenario():
+            emitter = EventHandler()
+            release = asyncio.Event()
+
+            async def slow():
+                await release.wait()
+
+            emitter.on('speech', slow, mode=BACKGROUND)
+            await asyncio.wait_for(emitter.createEvent('speech'), timeout=0.1)
+            self.assertEqual(emitter.background_tasks, 1)
+
+            await emitter.cancel_background()
+            self.assertEqual(emitter.background_tasks, 0)
+
+        asyncio.run(scenario())
+
+    def test_once_and_off(self):
+        async def scenario():
+            emitter = EventHandler()
+            calls = []
+            callback = calls.append
+            emitter.once('mark', callback)
+            emitter.on('audiosent', callback)
+
+            await emitter.createEvent('mark', 1)
+            await emitter.createEvent('mark', 2)
+            self.assertEqual(calls, [1])
+
+            emitter.off('audiosent', callback)
+            await emitter.createEvent('audiosent', 3)
+            self.assertEqual(calls, [1])
+            self.assertEqual(emitter._events, {})
+
+            # A once subscription only removes itself, not an on() of the same callback
+            emitter.on('mark', callback)
+            emitter.once('mark', callback)
+            await emitter.createEvent('mark', 4)
+            await emitter.createEvent('mark', 5)
+            self.assertEqual(calls, [1, 4, 4, 5])
+
+        asyncio.run(scenario())
+
+    def test_unsubscribing_during_dispatch_keeps_current_event(self):
+        async def scenario():
+            emitter = EventHandler()
+            calls = []
+
+            def first():
+                calls.append("first")
+                emitter.off('speech')
+
+            emitter.on('speech', first)
+            emitter.on('speech', lambda: calls.append("second"))
+            await emitter.createEvent('speech')
+            await emitter.createEvent('speech')
+            self.assertEqual(calls, ["first", "second"])
+
+        asyncio.run(scenario())
+
+    def test_timing_counters(self):
+        async def scenario():
+            emitter = EventHandler()
+            emitter.on('llmreply', lambda reply: None)
+            for _ in range(3):
+                await emitter.createEvent('llmreply', {})
+            await emitter.createEvent('unsubscribed')
+
+            stats = emitter.metrics()
+            self.assertEqual(list(stats), ['llmreply'])
+            self.assertEqual(stats['llmreply']['count'], 3)
+            self.assertEqual(stats['llmreply']['errors'], 0)
+
+        asyncio.run(scenario())
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            EventHandler().on('speech', print, mode="eventually")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+from Utils.function_calling_helpers import ApiTool, ApiToolExecutor
+
+
+class TestApiTool(unittest.TestCase):
+    def test_render_escapes_quoted_values(self):
+        tool = ApiTool("book", "https://example.com/book", "post",
+                       '{"name": "%(name)s", "guests": %(guests)s}')
+        body = json.loads(tool.render({"name": 'Sean "SB" Baker', "guests": 4}))
+
+        self.assertEqual(body, {"name": 'Sean "SB" Baker', "guests": 4})
+
+    def test_values_inside_longer_strings_are_escaped(self):
+        tool = ApiTool("note", "https://example.com/note", "post",
+                       '{"text": "Caller said: %(said)s (%(mood)s)", "tag": "a \\"%(tag)s\\"", "n": %(n)s}')
+        body = json.loads(tool.render({"said": 'a "quote" and a \\', "mood": "calm", "tag": "x", "n": 2}))
+
+        self.assertEqual(body, {"text": 'Caller said: a "quote" and a \\ (calm)', "tag": 'a "x"', "n": 2})
+
+    def test_invalid_template_is_rejected_at_registration(self):
+        with self.assertRaises(ValueError):
+            ApiTool("broken", "https://example.com", "post", '{"name": %(name)s')
+        with self.assertRaises(ValueError):
+            ApiTool("method", "https://example.com", "delete", '{}')
+
+
+class TestApiToolExecutor(unittest.TestCase):
+    @patch("Utils.function_calling_helpers.convert_to_request_log")
+    def test_identical_in_flight_requests_are_shared(self, request_log):
+        executor = ApiToolExecutor()
+        executor.register("lookup", "https://example.com/lookup", "get", '{"city": "%(city)s"}')
+        sent = []
+
+        async def fake_send(tool, req):
+            sent.append(req)
+            await asyncio.sleep(0.01)
+            return "sunny"
+
+        executor._send = fake_send
+
+        async def scenario():
+            return await asyncio.gather(
+                executor.execute("lookup", {"sequence_id": 1}, "run#1", city="Paris"),
+                executor.execute("lookup", {"sequence_id": 2}, "run#1", city="Paris"),
+                executor.execute("lookup", {"sequence_id": 3}, "run#1", city="Rome"),
+            )
+
+        results = asyncio.run(scenario())
+        self.assertEqual(results, ["sunny", "sunny", "sunny"])
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(executor.deduplicated, 1)
+        self.assertEqual(executor.in_flight, {})
+        # Every caller's request and response are logged, shared or not
+        directions = [call.kwargs["direction"] for call in request_log.call_args_list]
+        self.assertEqual((directions.count("request"), directions.count("response")), (3, 3))
+        self.assertIn(("sunny", {"sequence_id": 2}), [call.args[:2] for call in request_log.call_args_list])
+
+    @patch("Utils.function_calling_helpers.convert_to_request_log")
+    def test_requests_with_different_tokens_are_not_shared(self, _):
+        executor = ApiToolExecutor()
+        for name, token in (("first", "Bearer one"), ("second", "Bearer two")):
+            executor.register(name, "https://example.com/orders", "post", '{"id": "%(id)s"}', api_token=token)
+        sent = []
+
+        async def fake_send(tool, req):
+            sent.append(tool.headers["Authorization"])
+            await asyncio.sleep(0.01)
+            return f"orders of {tool.name}"
+
+        executor._send = fake_send
+
+        async def scenario():
+            return await asyncio.gather(executor.execute("first", {"sequence_id": 1}, "run#1", id="42"),
+                                        executor.execute("second", {"sequence_id": 2}, "run#1", id="42"))
+
+        self.assertEqual(asyncio.run(scenario()), ["orders of first", "orders of second"])
+        self.assertEqual(sent, ["Bearer one", "Bearer two"])
+        self.assertEqual(executor.deduplicated, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
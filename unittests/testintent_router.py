@@ -0,0 +1,43 @@
+import unittest
+
+from functions.function_manifest import tools
+from services.intent_router import IntentRouter
+
+
+class TestIntentRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = IntentRouter(tools)
+
+    def test_end_call_intent(self):
+        match = self.router.match("Okay, bye bye!")
+        self.assertEqual(match.intent, "end_call")
+        self.assertEqual(match.tool, "end_call")
+        self.assertEqual(match.say, "Goodbye.")
+
+    def test_transfer_call_intent(self):
+        for text in ["Transfer me to a person please.", "Can I speak to a human?", "Talk to an agent."]:
+            match = self.router.match(text)
+            self.assertIsNotNone(match, text)
+            self.assertEqual(match.tool, "transfer_call")
+
+    def test_repeat_and_stop_intents(self):
+        self.assertEqual(self.router.match("Sorry, can you repeat that?").intent, "repeat")
+        self.assertEqual(self.router.match("Say that again.").intent, "repeat")
+        self.assertEqual(self.router.match("Hold on.").intent, "stop")
+
+    def test_answers_and_long_utterances_go_to_llm(self):
+        self.assertIsNone(self.router.match("No."))
+        # Without a verb these are ordinary speech, e.g. answering "who helped you last time?"
+        self.assertIsNone(self.router.match("Agent."))
+        self.assertIsNone(self.router.match("The agent."))
+        self.assertIsNone(self.router.match("What?"))
+        self.assertIsNone(self.router.match("What is the weather in San Francisco?"))
+        self.assertIsNone(self.router.match("I said goodbye to my sister and then we went to the store"))
+
+    def test_prerender_phrases(self):
+        self.assertEqual(sorted(self.router.prerender_phrases()),
+                         sorted(["Transferring your call, please wait.", "Goodbye."]))
+
+
+if __name__ == '__main__':
+    unittest.main()
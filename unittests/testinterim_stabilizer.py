@@ -0,0 +1,58 @@
+import unittest
+
+from speach_to_text.interim_stabilizer import InterimStabilizer, estimate_tokens
+
+
+class TestInterimStabilizer(unittest.TestCase):
+    def test_requires_stable_words(self):
+        stabilizer = InterimStabilizer(min_stable_words=2, min_stable_ms=250)
+        self.assertFalse(stabilizer.should_interrupt("can you", playing=True, now=0.0))
+        self.assertFalse(stabilizer.should_interrupt("can you tell", playing=True, now=0.1))
+        self.assertTrue(stabilizer.should_interrupt("can you tell me", playing=True, now=0.3))
+        # Only once per utterance
+        self.assertFalse(stabilizer.should_interrupt("can you tell me more", playing=True, now=0.5))
+        self.assertEqual(stabilizer.metrics["barge_ins"], 1)
+
+    def test_revised_words_restart_their_clock(self):
+        stabilizer = InterimStabilizer(min_stable_words=2, min_stable_ms=250)
+        stabilizer.should_interrupt("cough cough", playing=True, now=0.0)
+        self.assertFalse(stabilizer.should_interrupt("could you", playing=True, now=0.3))
+        self.assertTrue(stabilizer.should_interrupt("could you", playing=True, now=0.6))
+
+    def test_backchannels_and_accidental_words_do_not_interrupt(self):
+        stabilizer = InterimStabilizer(min_stable_words=2, min_stable_ms=250)
+        for now in (0.0, 0.3, 0.6, 0.9):
+            self.assertFalse(stabilizer.should_interrupt("mm-hmm yeah no", playing=True, pending_audio_seconds=2.5,
+                                                         pending_tokens=40, now=now))
+        self.assertTrue(stabilizer.is_backchannel("Mm-hmm. Uh-huh."))
+        # Answers the assistant's question even though it did not interrupt
+        self.assertFalse(stabilizer.is_backchannel("Yes."))
+        self.assertFalse(stabilizer.is_backchannel("Okay, sure."))
+        stabilizer.reset()
+        self.assertEqual(stabilizer.metrics["suppressed"], 1)
+        self.assertEqual(stabilizer.metrics["audio_seconds_saved"], 2.5)
+        self.assertEqual(stabilizer.metrics["tokens_saved"], 40)
+
+    def test_stop_phrases(self):
+        stabilizer = InterimStabilizer(min_stable_words=2, min_stable_ms=250)
+        stabilizer.should_interrupt("hold on", playing=True, now=0.0)
+        self.assertTrue(stabilizer.should_interrupt("hold on", playing=True, now=0.3))
+
+        stabilizer.reset()
+        self.assertFalse(stabilizer.is_backchannel("Stop."))
+        self.assertTrue(stabilizer.should_interrupt("Stop.", playing=True, final=True))
+
+    def test_nothing_to_interrupt_when_silent(self):
+        stabilizer = InterimStabilizer(min_stable_words=2, min_stable_ms=0)
+        self.assertFalse(stabilizer.should_interrupt("book a table", playing=False, now=0.0))
+        stabilizer.reset()
+        self.assertEqual(stabilizer.metrics, {"interim_results": 1, "barge_ins": 0, "suppressed": 0,
+                                              "audio_seconds_saved": 0.0, "tokens_saved": 0})
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("Hello there"), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
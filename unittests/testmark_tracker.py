@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+
+from networking.mark_tracker import MarkTracker
+
+
+class TestMarkTracker(unittest.TestCase):
+    def test_wait_until_played_waits_for_acknowledgement(self):
+        async def scenario():
+            tracker = MarkTracker()
+
+            async def speak():
+                await asyncio.sleep(0.01)
+                tracker.sent("preamble")
+
+            tracker.track(asyncio.create_task(speak()))
+            waiter = asyncio.create_task(tracker.wait_until_played(timeout=1))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            self.assertIn("preamble", tracker)
+
+            tracker.acknowledged("preamble")
+            self.assertTrue(await waiter)
+            self.assertEqual(len(tracker), 0)
+
+        asyncio.run(scenario())
+
+    def test_wait_until_played_times_out(self):
+        async def scenario():
+            tracker = MarkTracker()
+            tracker.sent("never-acknowledged")
+            self.assertFalse(await tracker.wait_until_played(timeout=0.01))
+
+        asyncio.run(scenario())
+
+    def test_pending_audio_seconds(self):
+        async def scenario():
+            tracker = MarkTracker()
+            tracker.sent("a", 0.5)
+            tracker.sent("b", 1.25)
+            self.assertEqual(tracker.pending_audio_seconds, 1.75)
+            tracker.acknowledged("a")
+            self.assertEqual(tracker.pending_audio_seconds, 1.25)
+
+        asyncio.run(scenario())
+
+    def test_held_replies_keep_waiters_waiting(self):
+        async def scenario():
+            tracker = MarkTracker()
+            tracker.hold()
+            self.assertTrue(tracker.busy)
+            self.assertFalse(await tracker.wait_until_played(timeout=0.01))
+
+            tracker.sent("sentence")
+            tracker.release()
+            self.assertTrue(tracker.busy)
+            tracker.acknowledged("sentence")
+            self.assertFalse(tracker.busy)
+            self.assertTrue(await tracker.wait_until_played(timeout=0.01))
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from speach_to_text import offline_stt
+from speach_to_text.abstract_base import AbstractSTTService
+from speach_to_text.offline_stt import (DecoderPool, FailoverTranscriptionService, OfflineTranscriptionService,
+                                        SharedAudioRing)
+
+
+class FakeRecognizer:
+    """Vosk shaped recognizer: counts loud bytes and ends an utterance on a run of silence."""
+
+    def __init__(self):
+        self.loud = 0
+        self.quiet = 0
+
+    def AcceptWaveform(self, pcm):
+        for i in range(0, len(pcm), 2):
+            if abs(int.from_bytes(pcm[i:i + 2], "little", signed=True)) > 1000:
+                self.loud += 1
+                self.quiet = 0
+            else:
+                self.quiet += 1
+        return self.loud > 0 and self.quiet >= 800
+
+    def Result(self):
+        text, self.loud = f"heard {self.loud} samples", 0
+        return json.dumps({"text": text})
+
+    def PartialResult(self):
+        return json.dumps({"partial": "hello" if self.loud else ""})
+
+    def FinalResult(self):
+        return json.dumps({"text": ""})
+
+
+def init_fake_worker():
+    offline_stt._recognizer_factory = FakeRecognizer
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted.append(fn.__name__)
+        return super().submit(fn, *args, **kwargs)
+
+
+class SilentPrimary(AbstractSTTService):
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    async def connect(self, connection=None):
+        self.is_connected = True
+
+    async def send(self, payload):
+        self.sent += len(payload)
+
+    async def disconnect(self):
+        self.is_connected = False
+
+
+LOUD = bytes([0x80]) * 160  # mu-law full scale
+QUIET = bytes([0xFF]) * 160  # mu-law zero
+
+
+class TestSharedAudioRing(unittest.TestCase):
+    def test_wraps_and_drops_oldest(self):
+        ring = SharedAudioRing(10)
+        try:
+            ring.write(b"abcdefgh")
+            self.assertEqual(ring.take(5), (0, 5))
+            ring.write(b"ijklmn")
+            start, end = ring.take(100)
+            self.assertEqual(SharedAudioRing.read_range(ring.shm.buf, ring.capacity, start, end), b"fghijklmn")
+
+            ring.write(b"0123456789AB")
+            self.assertEqual(ring.pending, 10)
+            self.assertEqual(ring.dropped, 2)
+            start, end = ring.take(100)
+            self.assertEqual(SharedAudioRing.read_range(ring.shm.buf, ring.capacity, start, end), b"23456789AB")
+        finally:
+            ring.close()
+
+
+class TestOfflineTranscriptionService(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = DecoderPool(workers=2, initializer=init_fake_worker, initargs=())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def test_emits_utterance_and_transcription(self):
+        async def scenario():
+            service = OfflineTranscriptionService(pool=self.pool)
+            service.set_stream_sid("MZ1")
+            utterances, turns = [], []
+            service.on('utterance', lambda text, sid: utterances.append((text, sid)))
+            service.on('transcription', lambda text: turns.append(text))
+            await service.connect()
+
+            for payload in [LOUD] * 10 + [QUIET] * 10:
+                await service.send(payload)
+                await asyncio.sleep(0.005)
+            for _ in range(200):
+                if turns:
+                    break
+                await asyncio.sleep(0.01)
+            await service.disconnect()
+
+            self.assertIn(("hello", "MZ1"), utterances)
+            self.assertEqual(turns, ["heard 1600 samples"])
+            self.assertGreater(service.metrics["chunks"], 0)
+
+        asyncio.run(scenario())
+
+    def test_failover_replays_buffered_audio(self):
+        async def scenario():
+            primary = SilentPrimary()
+            fallback = OfflineTranscriptionService(pool=self.pool)
+            service = FailoverTranscriptionService(primary, fallback, timeout=0.05, backfill_seconds=1.0)
+            turns = []
+            service.on('transcription', lambda text: turns.append(text))
+            await service.connect()
+
+            for payload in [LOUD] * 5 + [QUIET] * 10:
+                await service.send(payload)
+            self.assertFalse(service.failed_over)
+            self.assertEqual(primary.sent, 15 * 160)
+            self.assertEqual(fallback.metrics["chunks"], 0)
+
+            await asyncio.sleep(0.1)
+            await service.send(QUIET)
+            self.assertTrue(service.failed_over)
+            for _ in range(200):
+                if turns:
+                    break
+                await asyncio.sleep(0.01)
+            await service.disconnect()
+
+            self.assertEqual(turns, ["heard 800 samples"])
+
+        asyncio.run(scenario())
+
+    def test_unused_fallback_never_reaches_a_worker(self):
+        async def scenario():
+            executor = RecordingExecutor()
+            fallback = OfflineTranscriptionService(pool=SimpleNamespace(assign=lambda: executor))
+            service = FailoverTranscriptionService(SilentPrimary(), fallback, timeout=10)
+            await service.connect()
+            for payload in [LOUD] * 5:
+                await service.send(payload)
+            await service.disconnect()
+
+            self.assertFalse(service.failed_over)
+            self.assertEqual(executor.submitted, [])
+            executor.shutdown()
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
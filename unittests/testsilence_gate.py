@@ -0,0 +1,42 @@
+import unittest
+
+from speach_to_text.silence_gate import SilenceGate, frame_energy_db
+
+LOUD = bytes([0x80]) * 160
+QUIET = bytes([0xFF]) * 160
+
+
+class TestSilenceGate(unittest.TestCase):
+    def test_frame_energy(self):
+        self.assertGreater(frame_energy_db(LOUD), -5)
+        self.assertEqual(frame_energy_db(QUIET), -100.0)
+
+    def test_hangover_then_suppress_then_preroll(self):
+        gate = SilenceGate(hangover_ms=100, preroll_ms=40)
+        self.assertEqual(gate.process(LOUD, now=0.0), [LOUD])
+        # 100 ms of hangover is still forwarded
+        for _ in range(5):
+            self.assertEqual(gate.process(QUIET, now=0.0), [QUIET])
+        for _ in range(10):
+            self.assertEqual(gate.process(QUIET, now=0.0), [])
+        self.assertTrue(gate.suppressing)
+
+        # Speech resumes with the last 40 ms in front of it
+        self.assertEqual(gate.process(LOUD, now=0.0), [QUIET, QUIET, LOUD])
+        self.assertFalse(gate.suppressing)
+        self.assertAlmostEqual(gate.metrics["suppressed_seconds"], 0.16)
+        self.assertAlmostEqual(gate.metrics["forwarded_seconds"], 0.18)
+
+    def test_keepalive_only_while_suppressing(self):
+        gate = SilenceGate(hangover_ms=0, keepalive_interval=5.0)
+        gate.process(LOUD, now=0.0)
+        self.assertFalse(gate.keepalive_due(now=10.0))
+        gate.process(QUIET, now=10.0)
+        self.assertTrue(gate.keepalive_due(now=10.0))
+        self.assertFalse(gate.keepalive_due(now=12.0))
+        self.assertTrue(gate.keepalive_due(now=15.0))
+        self.assertEqual(gate.metrics["keepalives"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import asyncio
+import base64
+import unittest
+
+from networking.streaming_service import StreamService
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+def chunk(index):
+    return base64.b64encode(bytes([index]) * 160).decode()
+
+
+def played(websocket):
+    return [base64.b64decode(message["media"]["payload"])[0] for message in websocket.sent
+            if message["event"] == "media"]
+
+
+class TestStreamService(unittest.TestCase):
+    def test_chunks_play_in_order(self):
+        async def scenario():
+            service = StreamService(FakeWebSocket())
+            for index in (1, 2, 0, 3):
+                await service.buffer(index, chunk(index))
+            self.assertEqual(played(service.ws), [0, 1, 2, 3])
+            self.assertEqual(service.buffer_stats["high_water"], 2)
+
+        asyncio.run(scenario())
+
+    def test_missing_chunk_is_skipped_once_the_buffer_is_full(self):
+        async def scenario():
+            service = StreamService(FakeWebSocket(), max_buffered=3)
+            for index in (1, 2, 3):
+                await service.buffer(index, chunk(index))
+            self.assertEqual(played(service.ws), [])
+
+            await service.buffer(4, chunk(4))
+            self.assertEqual(played(service.ws), [1, 2, 3, 4])
+            self.assertEqual(service.audio_buffer, {})
+            self.assertEqual(service.buffer_stats["skipped"], 1)
+
+            # The missing chunk turning up late is not played out of order
+            await service.buffer(0, chunk(0))
+            self.assertEqual(played(service.ws), [1, 2, 3, 4])
+            self.assertEqual(service.buffer_stats["late"], 1)
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
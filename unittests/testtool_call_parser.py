@@ -0,0 +1,34 @@
+import unittest
+
+from services.tool_call_parser import IncrementalArgumentParser
+
+
+class TestIncrementalArgumentParser(unittest.TestCase):
+    def test_detects_completion_across_fragments(self):
+        parser = IncrementalArgumentParser()
+        fragments = ['{"loc', 'ation": "San Francisco, CA"', ', "format": "cel', 'sius"', '}']
+        results = [parser.feed(fragment) for fragment in fragments]
+
+        self.assertEqual(results, [False, False, False, False, True])
+        self.assertEqual(parser.arguments, {"location": "San Francisco, CA", "format": "celsius"})
+
+    def test_braces_inside_strings_are_ignored(self):
+        parser = IncrementalArgumentParser()
+        self.assertFalse(parser.feed('{"note": "a } and a \\" quote {"'))
+        self.assertTrue(parser.feed(', "nested": {"a": 1}}'))
+        self.assertEqual(parser.arguments["nested"], {"a": 1})
+
+    def test_empty_object(self):
+        parser = IncrementalArgumentParser()
+        self.assertTrue(parser.feed('{}'))
+        self.assertEqual(parser.arguments, {})
+
+    def test_incomplete_arguments(self):
+        parser = IncrementalArgumentParser()
+        self.assertFalse(parser.feed('{"location": "Par'))
+        self.assertFalse(parser.complete)
+        self.assertEqual(parser.buffer, '{"location": "Par')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from functions.tool_http import TTLCache, ToolHttpClient
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_expiry(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        with patch("functions.tool_http.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestToolHttpClient(unittest.TestCase):
+    def test_normalized_arguments_share_a_cache_entry(self):
+        client = ToolHttpClient()
+        client.request = AsyncMock(return_value={"temperature": 21})
+
+        async def scenario():
+            first = await client.get_json("weather", "https://example.com", params={"location": "Paris "})
+            second = await client.get_json("weather", "https://example.com", params={"location": " paris"})
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(first, second)
+        client.request.assert_awaited_once()
+
+        report = client.report()["weather"]
+        self.assertEqual(report["cache_hits"], 1)
+        self.assertEqual(report["cache_misses"], 1)
+        self.assertEqual(report["cache_hit_rate"], 0.5)
+
+    def test_cache_can_be_disabled_per_tool(self):
+        client = ToolHttpClient()
+        client.configure("live", cache_ttl=0)
+        client.request = AsyncMock(return_value={})
+
+        async def scenario():
+            await client.get_json("live", "https://example.com")
+            await client.get_json("live", "https://example.com")
+
+        asyncio.run(scenario())
+        self.assertEqual(client.request.await_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import asyncio
+import types
+import unittest
+
+from speach_to_text.speach_to_text import TranscriptionService
+
+LOUD = bytes([0x80]) * 160
+
+
+class FakeConnection:
+    def __init__(self):
+        self.handlers = {}
+        self.sent = []
+        self.connected = True
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    async def send(self, chunk):
+        self.sent.append(chunk)
+
+    async def keep_alive(self):
+        return True
+
+    async def is_connected(self):
+        return self.connected
+
+    async def finish(self):
+        self.connected = False
+
+
+def final_result(text, start, duration):
+    alternative = types.SimpleNamespace(transcript=text)
+    return types.SimpleNamespace(channel=types.SimpleNamespace(alternatives=[alternative]), is_final=True,
+                                 speech_final=False, start=start, duration=duration)
+
+
+class TestTranscriptionReconnect(unittest.TestCase):
+    def test_reconnects_and_replays_unfinalized_audio(self):
+        async def scenario():
+            connections = []
+            failures = [1]
+
+            async def factory():
+                if failures[0]:
+                    failures[0] -= 1
+                    return None
+                connections.append(FakeConnection())
+                return connections[-1]
+
+            service = TranscriptionService(connection_factory=factory)
+            service.silence_gate = None
+            service.turn_detector = None
+            first = FakeConnection()
+            await service.connect(first)
+
+            frames = [bytes([0x80 + i]) * 160 for i in range(10)]
+            for frame in frames[:6]:
+                await service.send(frame)
+            # Deepgram finalized the first 4 frames (80 ms)
+            await service.handle_transcription(first, final_result("hello", 0.0, 0.08))
+
+            await service.handle_close(first, None)
+            self.assertTrue(service.reconnecting)
+            for frame in frames[6:]:
+                await service.send(frame)
+            while service.reconnecting:
+                await asyncio.sleep(0.01)
+
+            self.assertTrue(service.is_connected)
+            self.assertEqual(connections[0].sent, frames[4:])
+            self.assertEqual(service.connection_metrics["reconnects"], 1)
+            self.assertEqual(service.connection_metrics["failed_attempts"], 1)
+            self.assertAlmostEqual(service.connection_metrics["replayed_seconds"], 0.12)
+            self.assertGreater(service.connection_metrics["gap_ms_max"], 0)
+
+            # A late close from the replaced socket is ignored
+            await service.handle_close(first, None)
+            self.assertFalse(service.reconnecting)
+            await service.disconnect()
+
+        asyncio.run(scenario())
+
+    def test_disconnect_does_not_reconnect(self):
+        async def scenario():
+            service = TranscriptionService(connection_factory=None)
+            connection = FakeConnection()
+            await service.connect(connection)
+            await service.disconnect()
+            await service.handle_close(connection, None)
+            self.assertFalse(service.reconnecting)
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
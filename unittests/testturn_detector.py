@@ -0,0 +1,122 @@
+import unittest
+
+import numpy as np
+
+from speach_to_text.turn_detector import MULAW_TO_LINEAR, TurnDetector, frame_features, text_features
+from speach_to_text.turn_replay import evaluate, replay
+
+
+def encode_mulaw(samples):
+    # Nearest code in the decode table, good enough for test signals
+    return np.abs(MULAW_TO_LINEAR[None, :].astype(np.int32) - samples[:, None]).argmin(axis=1).astype(np.uint8).tobytes()
+
+
+def speech_frames(detector, count, pitch_start=200.0, pitch_end=200.0, energy_start=-20.0, energy_end=-20.0):
+    for i in range(count):
+        step = i / max(count - 1, 1)
+        detector.add_frame(energy_start + (energy_end - energy_start) * step,
+                           pitch_start + (pitch_end - pitch_start) * step)
+
+
+def silence_frames(detector, count):
+    for _ in range(count):
+        detector.add_frame(-70.0, 0.0)
+
+
+class TestTurnDetector(unittest.TestCase):
+    def test_text_features(self):
+        self.assertEqual(text_features("I'd like to book a table.")["terminal_punctuation"], 1.0)
+        self.assertEqual(text_features("Can you check my order")["question"], 1.0)
+        self.assertEqual(text_features("I want to go to the")["incomplete"], 1.0)
+        self.assertEqual(text_features("I want to go to the store.")["incomplete"], 0.0)
+
+    def test_frame_features_from_mulaw(self):
+        t = np.arange(160) / 8000
+        tone = (8000 * np.sin(2 * np.pi * 200 * t)).astype(np.int32)
+        energy, pitch = frame_features(MULAW_TO_LINEAR[np.frombuffer(encode_mulaw(tone), dtype=np.uint8)])
+        self.assertGreater(energy, -20)
+        self.assertAlmostEqual(pitch, 200, delta=15)
+
+        energy, pitch = frame_features(np.zeros(160, dtype=np.int16))
+        self.assertEqual((energy, pitch), (-100.0, 0.0))
+
+    def test_add_audio_splits_frames(self):
+        detector = TurnDetector()
+        detector.add_audio(encode_mulaw(np.zeros(480, dtype=np.int32)))
+        self.assertEqual(detector.silence_ms, 60)
+
+    def test_complete_sentence_with_falling_pitch_ends_early(self):
+        detector = TurnDetector()
+        speech_frames(detector, 30, pitch_start=220, pitch_end=150, energy_start=-18, energy_end=-35)
+        silence_frames(detector, 8)
+        self.assertFalse(detector.should_end_turn("I need a table for two at seven."))
+        silence_frames(detector, 12)
+        self.assertTrue(detector.should_end_turn("I need a table for two at seven."))
+
+    def test_incomplete_sentence_waits(self):
+        detector = TurnDetector()
+        speech_frames(detector, 30)
+        silence_frames(detector, 40)
+        self.assertFalse(detector.should_end_turn("I need a table for two and"))
+
+    def test_required_silence_adapts_to_caller_pauses(self):
+        detector = TurnDetector()
+        default = detector.required_silence_ms(0.8)
+        for _ in range(6):
+            speech_frames(detector, 10)
+            silence_frames(detector, 35)
+        speech_frames(detector, 10)
+        self.assertGreater(detector.required_silence_ms(0.8), default)
+
+    def test_false_cut_in_raises_threshold(self):
+        detector = TurnDetector()
+        speech_frames(detector, 20)
+        silence_frames(detector, 20)
+        detector.end_turn(early=True, now=1.0)
+        speech_frames(detector, 5)
+        self.assertEqual(detector.metrics["false_cut_ins"], 1)
+        self.assertAlmostEqual(detector.min_probability, 0.65)
+
+        detector.end_turn(early=True, now=2.0)
+        detector.baseline_end(now=2.6)
+        self.assertAlmostEqual(detector.metrics["latency_saved_ms"], 600)
+
+
+class TestTurnReplay(unittest.TestCase):
+    @staticmethod
+    def trace(text, pause_frames, end_after_ms=1000, resume=False):
+        events, t = [], 0
+        for i in range(30):
+            events.append([t, "frame", -18 - i * 0.5, 220 - i * 2])
+            t += 20
+        events.append([t, "final", text])
+        for _ in range(pause_frames):
+            events.append([t, "frame", -70.0, 0.0])
+            t += 20
+        if resume:
+            events.append([t, "frame", -18.0, 200.0])
+            t += 20
+        events.append([t + end_after_ms, "end"])
+        return events
+
+    def test_replay_counts_saved_latency(self):
+        result = replay(self.trace("Book me a table for two.", pause_frames=50))
+        self.assertEqual(result["turns"], 1)
+        self.assertEqual(result["early_ends"], 1)
+        self.assertEqual(result["false_cut_ins"], 0)
+        self.assertGreater(result["latency_saved_ms"], 1000)
+
+    def test_replay_counts_false_cut_in(self):
+        result = replay(self.trace("Book me a table.", pause_frames=20, resume=True))
+        self.assertEqual(result["false_cut_ins"], 1)
+        self.assertEqual(result["latency_saved_ms"], 0)
+
+    def test_evaluate_sweeps_thresholds(self):
+        rows = evaluate([self.trace("Book me a table for two.", pause_frames=50)], probabilities=(0.5, 0.99))
+        self.assertEqual(rows[0]["early_ends"], 1)
+        self.assertEqual(rows[1]["early_ends"], 0)
+        self.assertEqual(rows[1]["avg_saved_ms_per_turn"], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
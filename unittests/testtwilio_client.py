@@ -0,0 +1,135 @@
+import asyncio
+import time
+import unittest
+
+from aiohttp import web
+from twilio.rest import Client
+
+from telephony.twilio_client import PooledTwilioHttpClient
+
+
+class LocalTwilioHttpClient(PooledTwilioHttpClient):
+    """Sends the Twilio client's requests to a local stand-in instead of api.twilio.com."""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    async def request(self, method, url, **kwargs):
+        return await super().request(method, url.replace("https://api.twilio.com", self.base_url), **kwargs)
+
+
+class SlowTwilio:
+    """A stand-in for the calls API that answers after ``delay`` and can fail the first requests."""
+
+    def __init__(self, delay=0.0, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.requests = 0
+        self.runner = None
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            return web.json_response({"message": "Service unavailable"}, status=503)
+        status = "completed" if request.method == "POST" else "in-progress"
+        return web.json_response({"sid": request.match_info["sid"], "status": status})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/2010-04-01/Accounts/{account}/Calls/{sid}.json", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+async def media_loop(lags, stop):
+    """Stands in for another call's media stream, a frame every 20 ms."""
+    expected = time.perf_counter()
+    while not stop.is_set():
+        expected += 0.02
+        await asyncio.sleep(max(expected - time.perf_counter(), 0))
+        lags.append(time.perf_counter() - expected)
+
+
+class TestTwilioClient(unittest.TestCase):
+    def run_with_twilio(self, scenario, **kwargs):
+        async def wrapper():
+            twilio = SlowTwilio(**kwargs)
+            base_url = await twilio.start()
+            http_client = LocalTwilioHttpClient(base_url, timeout=kwargs.get("delay", 0) + 2, max_retries=3)
+            client = Client("ACtest", "token", http_client=http_client)
+            try:
+                await scenario(client, twilio)
+            finally:
+                await http_client.close()
+                await twilio.stop()
+
+        asyncio.run(wrapper())
+
+    def test_slow_twilio_does_not_stall_media(self):
+        async def scenario(client, twilio):
+            lags, stop = [], asyncio.Event()
+            media = asyncio.create_task(media_loop(lags, stop))
+            await asyncio.sleep(0.1)
+
+            started = time.perf_counter()
+            calls = await asyncio.gather(*(client.calls(f"CA{i}").fetch_async() for i in range(5)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await media
+
+            self.assertEqual([call.status for call in calls], ["in-progress"] * 5)
+            # The five requests ran side by side, and frames kept their 20 ms pace meanwhile
+            self.assertLess(elapsed, 1.0)
+            self.assertGreater(len(lags), 20)
+            self.assertLess(max(lags), 0.05)
+
+        self.run_with_twilio(scenario, delay=0.5)
+
+    def test_update_goes_through_the_pool(self):
+        async def scenario(client, twilio):
+            call = await client.calls("CA1").update_async(status="completed")
+            self.assertEqual(call.status, "completed")
+            self.assertEqual(twilio.requests, 1)
+
+        self.run_with_twilio(scenario)
+
+    def test_get_is_retried(self):
+        async def scenario(client, twilio):
+            call = await client.calls("CA1").fetch_async()
+            self.assertEqual(call.status, "in-progress")
+            self.assertEqual(twilio.requests, 3)
+
+        self.run_with_twilio(scenario, failures=2)
+
+    def test_post_is_not_retried(self):
+        async def scenario(client, twilio):
+            with self.assertRaises(Exception):
+                await client.calls("CA1").update_async(status="completed")
+            self.assertEqual(twilio.requests, 1)
+
+        self.run_with_twilio(scenario, failures=1)
+
+    def test_requests_time_out(self):
+        async def scenario(client, twilio):
+            http_client = LocalTwilioHttpClient(client.http_client.base_url, timeout=0.1, max_retries=1)
+            slow_client = Client("ACtest", "token", http_client=http_client)
+            try:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await slow_client.calls("CA1").fetch_async()
+            finally:
+                await http_client.close()
+
+        self.run_with_twilio(scenario, delay=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()